@@ -1,6 +1,6 @@
 from django.contrib import admin
 from unfold.admin import ModelAdmin
-from .models import Website, Activity, People, Tag
+from .models import Website, Activity, Page, People, Tag
 
 @admin.register(Website)
 class WebsiteAdmin(ModelAdmin):
@@ -8,6 +8,7 @@ class WebsiteAdmin(ModelAdmin):
     search_fields = ['domain', 'name', 'site_id']
     readonly_fields = ['site_id', 'tracking_code']
     list_filter = ['created_at', 'user']
+    list_select_related = ['user']
 
     def get_name(self, obj):
         if not obj:
@@ -19,24 +20,59 @@ class WebsiteAdmin(ModelAdmin):
         for obj in queryset:
             obj.delete()
 
+class ActivityTypeFilter(admin.SimpleListFilter):
+    """The known activity types, rather than a DISTINCT over every activity."""
+    title = 'activity type'
+    parameter_name = 'activity_type'
+
+    def lookups(self, request, model_admin):
+        return Activity.ACTIVITY_TYPE_CHOICES
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(activity_type=self.value())
+        return queryset
+
 @admin.register(Activity)
 class ActivityAdmin(ModelAdmin):
-    list_display = ['activity_type', 'website', 'get_visitor', 'page_title', 'occured_at']
-    list_filter = ['activity_type', 'website', 'occured_at']
-    search_fields = ['people__name', 'people__email', 'page_title', 'visitor_id']
+    list_display = ['activity_type', 'website', 'get_visitor', 'get_page_title', 'occured_at']
+    list_filter = [ActivityTypeFilter, 'website', 'occured_at']
+    list_select_related = ['website', 'people', 'page']
+    # Skips a second COUNT(*) of the whole table on filtered pages.
+    show_full_result_count = False
+    search_fields = ['people__name', 'people__email', 'page__title', 'visitor_id']
     date_hierarchy = 'occured_at'
+    # Shown as their strings rather than a select over every value.
+    readonly_fields = ['page', 'referrer_host', 'user_agent', 'language', 'screen_resolution']
 
     def get_visitor(self, obj):
         return obj.people.name if obj.people else f"Anonymous ({obj.visitor_id})"
     get_visitor.short_description = 'Visitor'
 
+    def get_page_title(self, obj):
+        return obj.page.title if obj.page else None
+    get_page_title.short_description = 'Page title'
+
 @admin.register(People)
 class PeopleAdmin(ModelAdmin):
-    list_display = ['name', 'email', 'phone', 'stage', 'last_activity']
+    list_display = ['name', 'email', 'phone', 'stage', 'activity_count', 'last_activity']
     list_filter = ['stage', 'created_at']
     search_fields = ['name', 'email', 'phone', 'visitor_id']
     filter_horizontal = ['tags']
-    readonly_fields = ['visitor_id', 'last_activity']
+    show_full_result_count = False
+    readonly_fields = [
+        'visitor_id', 'last_activity', 'activity_count', 'first_seen_at',
+        'last_activity_type', 'last_page_title', 'last_page_url',
+        'user_agent', 'language', 'screen_resolution',
+    ]
+
+@admin.register(Page)
+class PageAdmin(ModelAdmin):
+    list_display = ['url', 'title', 'website']
+    list_filter = ['website']
+    list_select_related = ['website']
+    search_fields = ['url', 'title']
+    readonly_fields = ['website', 'url', 'digest']
 
 @admin.register(Tag)
 class TagAdmin(ModelAdmin):
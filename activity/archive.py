@@ -0,0 +1,178 @@
+import gzip
+import io
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .dimensions import DIMENSION_FIELDS, VALUE_LOOKUPS, decode, dimension_ids, intern_events, intern_pages, page_for
+from .models import Activity, People, RollupWatermark, Website
+from .rollups import WATERMARK
+
+
+def archive_dir():
+    return Path(getattr(settings, 'TRACKING_ARCHIVE_DIR', Path(settings.BASE_DIR, 'archive')))
+
+
+def archive_fields():
+    # Dimension fields are archived as their strings, so archives do not
+    # depend on the dimension tables' ids.
+    return [
+        field.attname for field in Activity._meta.concrete_fields if field.name not in DIMENSION_FIELDS
+    ] + list(VALUE_LOOKUPS.values())
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds.
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def archive_path(directory, website, month):
+    """One compressed NDJSON file per website per month."""
+    return Path(directory) / str(website.site_id) / f'{month:%Y-%m}.ndjson.gz'
+
+
+def expired_activities(website, now=None):
+    """Activity older than the website's retention that is safe to archive.
+
+    Rows the rollup job has not seen yet are left alone so archiving never
+    loses traffic from the stats.
+    """
+    now = now or timezone.now()
+    activities = Activity.objects.filter(
+        website=website, occured_at__lt=now - timedelta(days=website.retention_days)
+    )
+    watermark = RollupWatermark.objects.filter(name=WATERMARK).values_list('last_activity_id', flat=True).first()
+    return activities.filter(id__lte=watermark or 0)
+
+
+def write_archive(activities, directory, website, chunk_size=2000):
+    """Stream ``activities`` into monthly archives; returns (rows, max id, paths).
+
+    Rows are appended as a new gzip member, so re-running after a crash
+    only ever adds lines; restoring skips ids that already exist.
+    """
+    rows = 0
+    max_id = None
+    paths = []
+    month = handle = None
+    encoder = ArchiveEncoder(separators=(',', ':'))
+    try:
+        queryset = activities.order_by('occured_at', 'id').values(*archive_fields())
+        for row in queryset.iterator(chunk_size=chunk_size):
+            row_month = timezone.localtime(row['occured_at']).date().replace(day=1)
+            if row_month != month:
+                if handle is not None:
+                    _close(handle)
+                month = row_month
+                path = archive_path(directory, website, month)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                handle = _open(path)
+                paths.append(path)
+            handle[0].write(encoder.encode(decode(row)) + '\n')
+            rows += 1
+            max_id = row['id'] if max_id is None else max(max_id, row['id'])
+    finally:
+        if handle is not None:
+            _close(handle)
+    return rows, max_id, paths
+
+
+def _open(path):
+    raw = open(path, 'ab')
+    return io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode='ab'), encoding='utf-8'), raw
+
+
+def _close(handle):
+    text, raw = handle
+    text.close()
+    raw.flush()
+    os.fsync(raw.fileno())
+    raw.close()
+
+
+def delete_in_chunks(activities, max_id, chunk_size=1000):
+    """Delete archived rows a bounded chunk at a time to keep locks short."""
+    deleted = 0
+    activities = activities.filter(id__lte=max_id)
+    while True:
+        ids = list(activities.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += Activity.objects.filter(id__in=ids).delete()[0]
+
+
+def read_archive(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def archived_people(directory=None, chunk_size=2000):
+    """``{people id: (activities, first occured_at)}`` over the archives in ``directory``.
+
+    Rows since restored into Activity are left out, as they are counted there.
+    """
+    summary = {}
+
+    def add(rows):
+        restored = set(Activity.objects.filter(id__in=[row['id'] for row in rows]).values_list('id', flat=True))
+        for row in rows:
+            if row['id'] in restored or not row.get('people_id'):
+                continue
+            occured_at = parse_datetime(row['occured_at'])
+            count, first = summary.get(row['people_id'], (0, occured_at))
+            summary[row['people_id']] = (count + 1, min(first, occured_at))
+
+    for path in sorted(Path(directory or archive_dir()).glob('*/*.ndjson.gz')):
+        rows = []
+        for row in read_archive(path):
+            rows.append(row)
+            if len(rows) >= chunk_size:
+                add(rows)
+                rows = []
+        if rows:
+            add(rows)
+    return summary
+
+
+def restore_rows(rows):
+    """Re-insert archived rows with their original ids; returns rows inserted.
+
+    Rows whose website or person has since been deleted are skipped, as the
+    cascade would have removed them had they still been in the table.
+    """
+    website_ids = set(Website.objects.filter(id__in={row['website_id'] for row in rows}).values_list('id', flat=True))
+    people_ids = set(People.objects.filter(
+        id__in={row['people_id'] for row in rows if row.get('people_id')}
+    ).values_list('id', flat=True))
+    existing = set(Activity.objects.filter(id__in=[row['id'] for row in rows]).values_list('id', flat=True))
+    ids = intern_events(rows)
+    # Old titles name the pages they create but do not replace current ones.
+    pages = intern_pages(
+        ((row['website_id'], row) for row in rows if row['website_id'] in website_ids), update_titles=False
+    )
+    activities = []
+    for row in rows:
+        if row['website_id'] not in website_ids or row['id'] in existing:
+            continue
+        if row.get('people_id') and row['people_id'] not in people_ids:
+            continue
+        # page_referrer: archives written before referrers were reduced to hosts.
+        fields = {key: value for key, value in row.items() if key not in VALUE_LOOKUPS and key != 'page_referrer'}
+        fields['occured_at'] = parse_datetime(row['occured_at'])
+        if row.get('inserted_at'):
+            fields['inserted_at'] = parse_datetime(row['inserted_at'])
+        activities.append(Activity(
+            **fields, **dimension_ids(row, ids), page=page_for(pages, row['website_id'], row),
+        ))
+    Activity.objects.bulk_create(activities, ignore_conflicts=True)
+    return len(activities)
+
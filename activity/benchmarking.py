@@ -0,0 +1,114 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+
+@contextmanager
+def benchmark_database(keepdb=False, verbosity=0):
+    """Run the body against a throwaway test database, never the real one.
+
+    Uses the same machinery as ``manage.py test``: the database is created
+    from migrations (honouring ``DATABASES[...]['TEST']``) and destroyed on
+    exit unless ``keepdb`` is set.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, keepdb=keepdb, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity, keepdb)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000 if samples else None,
+        'p50_ms': percentile(samples, 0.50) * 1000 if samples else None,
+        'p95_ms': percentile(samples, 0.95) * 1000 if samples else None,
+        'p99_ms': percentile(samples, 0.99) * 1000 if samples else None,
+        'max_ms': max(samples) * 1000 if samples else None,
+    }
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, name, results):
+    """Store ``results`` as JSON together with what produced them."""
+    payload = {
+        'benchmark': name,
+        'revision': git_revision(),
+        'recorded_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'results': results,
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(payload, indent=2, default=str))
+    return payload
+
+
+def load_results(path):
+    return json.loads(Path(path).read_text())['results']
+
+
+def compare(baseline, current, threshold=0.10, path=()):
+    """Walk two result trees side by side; returns ``(path, metric, old, new, change, regressed)`` rows.
+
+    Latencies (``*_ms``, bar the single-sample ``max_ms``) and query counts
+    (``queries_*``) regress when they grow by more than ``threshold``,
+    throughput (``*_per_s``) when it shrinks by more than ``threshold``.
+    """
+    rows = []
+    for key, new in current.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(new, dict):
+            if isinstance(old, dict):
+                rows.extend(compare(old, new, threshold, path + (key,)))
+            continue
+        if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or not old:
+            continue
+        change = (new - old) / old
+        if key == 'max_ms':
+            continue
+        if key.endswith('_ms') or key.startswith('queries_'):
+            regressed = change > threshold
+        elif key.endswith('_per_s'):
+            regressed = change < -threshold
+        else:
+            continue
+        rows.append(('/'.join(path), key, old, new, change, regressed))
+    return rows
@@ -0,0 +1,168 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from . import ingest
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting worker checks whether stop() was called.
+STOP_POLL_SECONDS = 0.05
+
+
+class BufferFull(Exception):
+    pass
+
+
+class IngestBuffer:
+    """Bounded in-memory queue of validated tracking events.
+
+    A daemon worker thread drains the queue and hands batches to ``flush``
+    (``ingest.ingest_events`` by default) whenever ``batch_size`` events are
+    waiting or ``flush_interval`` seconds have passed.  When the queue is
+    full, ``put`` either fails straight away (``overflow='reject'``) or waits
+    up to ``block_timeout`` seconds for room (``overflow='block'``) before
+    raising ``BufferFull``.
+    """
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=0.25,
+                 overflow='reject', block_timeout=1.0, flush=None):
+        if overflow not in ('reject', 'block'):
+            raise ValueError(f"overflow must be 'reject' or 'block', not {overflow!r}")
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.flush = flush or ingest.ingest_events
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.last_flush_seconds = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='tracking-ingest-buffer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the worker after flushing everything still queued."""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def put(self, event):
+        """Queue ``event``, stamped with when it was received."""
+        event = {'received_at': timezone.now(), **event}
+        self.start()
+        try:
+            if self.overflow == 'block':
+                self.queue.put(event, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise BufferFull()
+        with self._lock:
+            self.enqueued += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queue_capacity': self.queue.maxsize,
+                'enqueued': self.enqueued,
+                'rejected': self.rejected,
+                'flushed': self.flushed,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'flush_seconds_total': self.flush_seconds_total,
+                'flush_seconds_max': self.flush_seconds_max,
+                'last_flush_seconds': self.last_flush_seconds,
+            }
+
+    def _collect(self, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    # In slices, so stop() is not kept waiting for a whole interval.
+                    batch.append(self.queue.get(timeout=min(remaining, STOP_POLL_SECONDS)))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                if remaining <= 0 or self._stopping.is_set():
+                    break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect(self.flush_interval)
+            if batch:
+                self._flush(batch)
+        while True:
+            batch = self._collect(0)
+            if not batch:
+                break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        try:
+            self.flush(batch)
+        except Exception:
+            logger.exception('Failed to flush %d buffered tracking events', len(batch))
+            ok = False
+        else:
+            ok = True
+        finally:
+            close_old_connections()
+        elapsed = time.monotonic() - started
+        with self._lock:
+            if ok:
+                self.flushed += len(batch)
+            else:
+                self.failed += len(batch)
+            self.flushes += 1
+            self.flush_seconds_total += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+            self.last_flush_seconds = elapsed
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Return the process-wide buffer configured by ``TRACKING_BUFFER``."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            options = getattr(settings, 'TRACKING_BUFFER', {})
+            _buffer = IngestBuffer(
+                max_size=options.get('MAX_SIZE', 10000),
+                batch_size=options.get('BATCH_SIZE', 500),
+                flush_interval=options.get('FLUSH_INTERVAL_MS', 250) / 1000,
+                overflow=options.get('OVERFLOW', 'reject'),
+                block_timeout=options.get('BLOCK_TIMEOUT_MS', 1000) / 1000,
+            )
+            atexit.register(_buffer.stop)
+        return _buffer
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from django.conf import settings
+
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after a TTL.
+
+    ``None`` is a legitimate value and is used for negative entries ("we
+    looked and it does not exist"), which get their own, usually shorter,
+    ``negative_ttl``.  ``get`` returns ``MISSING`` on a miss.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, negative_ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class RecentKeys:
+    """Thread-safe set of the keys added in roughly the last ``window`` seconds.
+
+    Keys live in ``buckets`` sets, one per slice of the window; the oldest
+    set is dropped whole as time moves on, so expiry costs nothing per key.
+    When ``max_size`` keys are held the oldest sets go early.  A key can
+    thus be forgotten before ``window`` is up, never remembered longer.
+    """
+
+    def __init__(self, window=600, buckets=10, max_size=100000):
+        self.max_size = max_size
+        self.span = window / buckets
+        self.buckets = buckets
+        self._sets = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self.evictions = 0
+
+    def add(self, key):
+        """Remember ``key``; returns False, and counts a duplicate, if it was already held."""
+        slot = int(time.monotonic() // self.span)
+        with self._lock:
+            while self._sets and self._sets[0][0] <= slot - self.buckets:
+                self._size -= len(self._sets.popleft()[1])
+            for _, keys in self._sets:
+                if key in keys:
+                    self.duplicates += 1
+                    return False
+            if not self._sets or self._sets[-1][0] != slot:
+                self._sets.append((slot, set()))
+            self._sets[-1][1].add(key)
+            self._size += 1
+            while self._size > self.max_size and len(self._sets) > 1:
+                self._size -= len(self._sets.popleft()[1])
+                self.evictions += 1
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            for _, keys in self._sets:
+                if key in keys:
+                    keys.remove(key)
+                    self._size -= 1
+                    return
+
+    def count_duplicates(self, count):
+        """Record duplicates caught elsewhere, e.g. by a unique constraint."""
+        with self._lock:
+            self.duplicates += count
+
+    def clear(self):
+        with self._lock:
+            self._sets.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self._size,
+                'max_size': self.max_size,
+                'duplicates': self.duplicates,
+                'evictions': self.evictions,
+            }
+
+
+def _from_settings(name, **defaults):
+    options = {**defaults, **getattr(settings, name, {})}
+    return TTLCache(
+        max_size=options['MAX_SIZE'],
+        ttl=options['TTL'],
+        negative_ttl=options['NEGATIVE_TTL'],
+    )
+
+
+def _recent_from_settings(name, **defaults):
+    options = {**defaults, **getattr(settings, name, {})}
+    return RecentKeys(window=options['WINDOW_SECONDS'], max_size=options['MAX_SIZE'])
+
+
+# site_id -> Website.pk, or None for site_ids that do not exist.
+website_cache = _from_settings('TRACKING_SITE_CACHE', MAX_SIZE=1024, TTL=300, NEGATIVE_TTL=60)
+
+# visitor_id -> People.pk, or None for anonymous visitors.
+visitor_cache = _from_settings('TRACKING_VISITOR_CACHE', MAX_SIZE=10000, TTL=300, NEGATIVE_TTL=30)
+
+# (site_id, event_id) of recently ingested events, for duplicate suppression.
+recent_events = _recent_from_settings('TRACKING_DEDUPE', WINDOW_SECONDS=600, MAX_SIZE=100000)
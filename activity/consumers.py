@@ -0,0 +1,75 @@
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.middleware import BaseMiddleware
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from . import live
+from .models import Website
+
+
+class QueryTokenAuthMiddleware(BaseMiddleware):
+    """Authenticates WebSockets from a ``?token=<JWT access token>`` parameter.
+
+    Browsers cannot set an Authorization header on a WebSocket, so the CRM
+    passes the same access token it uses for the API in the URL.  Without
+    a valid token the user from the session, if any, is kept.
+    """
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+        if token:
+            user = await self.authenticate(token[0])
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
+
+    @database_sync_to_async
+    def authenticate(self, raw_token):
+        authentication = JWTAuthentication()
+        try:
+            return authentication.get_user(authentication.get_validated_token(raw_token))
+        except (InvalidToken, TokenError):
+            return None
+
+
+class ActivityFeedConsumer(AsyncJsonWebsocketConsumer):
+    """Live activity and person-online events for one of the user's websites.
+
+    Each message from ``live.LivePublisher``, already coalesced per
+    website over ``COALESCE_MS``, goes out as one frame::
+
+        {"type": "activity", "activities": [...], "online": [person ids], "dropped": 0}
+
+    A frame carries at most ``MAX_BATCH`` activities, the newest; ``dropped``
+    counts the older ones skipped during a spike.
+    """
+    group = None
+
+    async def connect(self):
+        user = self.scope.get('user')
+        website_id = self.scope['url_route']['kwargs']['website_id']
+        if user is None or not user.is_authenticated or not await self.owns(user, website_id):
+            await self.close()
+            return
+        self.group = live.group_name(website_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.group is not None:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        # The feed is one-way; anything the client sends is ignored.
+        pass
+
+    @database_sync_to_async
+    def owns(self, user, website_id):
+        return Website.objects.filter(pk=website_id, user=user).exists()
+
+    async def activity_batch(self, event):
+        await self.send_json({
+            'type': 'activity', 'activities': event['activities'], 'online': event['online'],
+            'dropped': event['dropped'],
+        })
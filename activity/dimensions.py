@@ -0,0 +1,306 @@
+from functools import partial
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from django.conf import settings
+from django.db import transaction
+from .cache import MISSING, TTLCache
+from .models import Language, Page, ReferrerHost, ScreenResolution, UserAgent
+
+# Query parameters that identify a campaign or click rather than content.
+TRACKING_PARAMS = {'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga', '_gl'}
+TRACKING_PARAM_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# Longest canonical URL stored, in UTF-8 bytes. People.last_page_url and
+# ActivityRollup.page_url copy it, and the rollup's unique index must fit
+# a btree entry.
+MAX_URL_LENGTH = 2000
+MAX_HOST_LENGTH = ReferrerHost._meta.get_field('value').max_length
+
+
+def _truncate(value, length):
+    return value.encode('utf-8')[:length].decode('utf-8', 'ignore')
+
+
+def _host(parts):
+    host = (parts.hostname or '').rstrip('.')
+    return host[4:] if host.startswith('www.') else host
+
+
+def canonical_url(url):
+    """``url`` with its host normalized and fragment and tracking parameters dropped.
+
+    Scheme and host are lower-cased, ``www.`` and default ports removed and
+    the remaining query parameters sorted, so every visit to a page maps to
+    one string.  Values that are not http(s) URLs come back unchanged.
+    Either way the result is cut to ``MAX_URL_LENGTH``.
+    """
+    if not url:
+        return None
+    return _truncate(_canonical(url.strip()), MAX_URL_LENGTH)
+
+
+def _canonical(url):
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = _host(parts)
+    if scheme not in DEFAULT_PORTS or not host:
+        return url
+    if ':' in host:
+        host = f'[{host}]'
+    if port and port != DEFAULT_PORTS[scheme]:
+        host = f'{host}:{port}'
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PARAM_PREFIXES)
+    ))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+def referrer_host(url):
+    """The normalized host of a referrer URL, or None."""
+    if not url:
+        return None
+    try:
+        host = _host(urlsplit(url.strip()))
+    except ValueError:
+        return None
+    return _truncate(host, MAX_HOST_LENGTH) or None
+
+
+class Interner:
+    """Turns dimension strings into row ids, inserting unseen ones.
+
+    Ids never change once assigned, so answers are cached in process for
+    long; a batch of events costs no query at all once its values are
+    warm, and one SELECT (plus one INSERT for new values) otherwise.
+    """
+
+    def __init__(self, model, key=None, max_size=10000, ttl=3600):
+        self.model = model
+        self.field = 'digest' if key else 'value'
+        self.key = key or (lambda value: value)
+        self.cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    def ids(self, values):
+        """Map each distinct non-empty value to its row id."""
+        ids = {}
+        missing = set()
+        for value in set(values):
+            if not value:
+                continue
+            pk = self.cache.get(value)
+            if pk is MISSING:
+                missing.add(value)
+            else:
+                ids[value] = pk
+        if missing:
+            found = self._lookup(missing)
+            new = missing - found.keys()
+            if new:
+                self.model.objects.bulk_create(
+                    # Sorted, so concurrent batches take row locks in one order.
+                    [self.model(**{'value': value, self.field: self.key(value)}) for value in sorted(new)],
+                    ignore_conflicts=True,
+                )
+                # Re-read: another process may have inserted some first.
+                found.update(self._lookup(new))
+            # Inside a transaction the rows may yet be rolled back.
+            transaction.on_commit(partial(self._remember, found))
+            ids.update(found)
+        return ids
+
+    def forget(self, values):
+        """Drop the cached ids of ``values``, to be looked up again."""
+        for value in values:
+            self.cache.invalidate(value)
+
+    def _remember(self, ids):
+        for value, pk in ids.items():
+            self.cache.set(value, pk)
+
+    def _lookup(self, values):
+        keyed = {self.key(value): value for value in values}
+        rows = self.model.objects.filter(**{f'{self.field}__in': list(keyed)}).values_list(self.field, 'pk')
+        return {keyed[key]: pk for key, pk in rows}
+
+
+class PageInterner:
+    """Turns ``(website id, URL, title)`` into Page rows, inserting unseen pages.
+
+    Cached like ``Interner``, together with the title last stored, so a
+    page costs a query only when it is new to this process or its title
+    changed.
+    """
+
+    title_length = Page._meta.get_field('title').max_length
+
+    def __init__(self, max_size=10000, ttl=3600):
+        self.cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    def pages(self, entries, update_titles=True):
+        """Map each ``(website id, raw URL)`` in ``entries`` to its Page.
+
+        URLs are canonicalized first; the last non-empty title given for a
+        page becomes its title, or only a new page's with ``update_titles``
+        off.  Empty URLs are left out.
+        """
+        canonical = {}
+        titles = {}
+        for website_id, url, title in entries:
+            if (website_id, url) not in canonical:
+                canonical[website_id, url] = canonical_url(url)
+            if canonical[website_id, url] is None:
+                continue
+            page = (website_id, canonical[website_id, url])
+            titles.setdefault(page, None)
+            if title:
+                titles[page] = title[:self.title_length]
+        found = {}
+        missing = set()
+        for page in titles:
+            cached = self.cache.get(page)
+            if cached is MISSING:
+                missing.add(page)
+            else:
+                found[page] = cached
+        if missing:
+            looked_up = self._lookup(missing)
+            new = missing - looked_up.keys()
+            if new:
+                Page.objects.bulk_create(
+                    [
+                        Page(website_id=website_id, url=url, digest=Page.digest_of(url), title=titles[website_id, url])
+                        # Sorted, so concurrent batches take row locks in one order.
+                        for website_id, url in sorted(new)
+                    ],
+                    ignore_conflicts=True,
+                )
+                # Re-read: another process may have inserted some first.
+                looked_up.update(self._lookup(new))
+            found.update(looked_up)
+        retitled = {
+            page: title for page, title in titles.items()
+            if update_titles and title and page in found and found[page][1] != title
+        }
+        for page, title in retitled.items():
+            Page.objects.filter(pk=found[page][0]).update(title=title)
+            found[page] = (found[page][0], title)
+        if missing or retitled:
+            # Inside a transaction the rows may yet be rolled back.
+            changed = (missing | retitled.keys()) & found.keys()
+            transaction.on_commit(partial(self._remember, {page: found[page] for page in changed}))
+        pages = {
+            (website_id, url): Page(pk=pk, website_id=website_id, url=url, digest=Page.digest_of(url), title=title)
+            for (website_id, url), (pk, title) in found.items()
+        }
+        return {
+            (website_id, url): pages[website_id, page_url]
+            for (website_id, url), page_url in canonical.items()
+            if (website_id, page_url) in pages
+        }
+
+    def forget(self, entries):
+        """Drop the cached pages of ``(website id, raw URL)`` entries."""
+        for website_id, url in entries:
+            self.cache.invalidate((website_id, canonical_url(url)))
+
+    def _remember(self, found):
+        for page, entry in found.items():
+            self.cache.set(page, entry)
+
+    def _lookup(self, pages):
+        keyed = {(website_id, Page.digest_of(url)): (website_id, url) for website_id, url in pages}
+        rows = Page.objects.filter(
+            website_id__in={website_id for website_id, url in pages},
+            digest__in={digest for website_id, digest in keyed},
+        ).values_list('website_id', 'digest', 'pk', 'title')
+        return {
+            keyed[website_id, digest]: (pk, title)
+            for website_id, digest, pk, title in rows
+            if (website_id, digest) in keyed
+        }
+
+
+def _cache_options():
+    return {'MAX_SIZE': 10000, 'TTL': 3600, **getattr(settings, 'TRACKING_DIMENSION_CACHE', {})}
+
+
+def _from_settings(model, key=None):
+    options = _cache_options()
+    return Interner(model, key, max_size=options['MAX_SIZE'], ttl=options['TTL'])
+
+
+# Fields stored through a dimension table, and their interners.
+interners = {
+    'user_agent': _from_settings(UserAgent, key=UserAgent.digest_of),
+    'language': _from_settings(Language),
+    'screen_resolution': _from_settings(ScreenResolution),
+    'referrer_host': _from_settings(ReferrerHost),
+}
+# The ones People keeps too.
+PERSON_DIMENSIONS = ['user_agent', 'language', 'screen_resolution']
+
+page_interner = PageInterner(max_size=_cache_options()['MAX_SIZE'], ttl=_cache_options()['TTL'])
+
+
+def _value(field, data):
+    if field == 'referrer_host':
+        # Events carry the full referrer; archived rows its host already.
+        return data.get('referrer_host') or referrer_host(data.get('page_referrer'))
+    return data.get(field)
+
+
+def intern_events(events):
+    """``{field: {value: id}}`` for the dimension values in ``events``."""
+    return {
+        field: interner.ids(_value(field, event) for event in events)
+        for field, interner in interners.items()
+    }
+
+
+def intern_pages(events, update_titles=True):
+    """``page_interner.pages`` for ``(website id, event)`` pairs."""
+    return page_interner.pages(
+        ((website_id, event.get('page_url'), event.get('page_title')) for website_id, event in events),
+        update_titles,
+    )
+
+
+def forget_interned(events):
+    """Drop the cached dimension and page ids of ``(website id, event)`` pairs."""
+    events = list(events)
+    for field, interner in interners.items():
+        interner.forget(_value(field, event) for website_id, event in events)
+    page_interner.forget((website_id, event.get('page_url')) for website_id, event in events)
+
+
+def dimension_ids(data, ids, fields=None):
+    """Keyword arguments setting the dimension ``_id`` fields for one event."""
+    return {f'{field}_id': ids[field].get(_value(field, data)) for field in fields or interners}
+
+
+def page_for(pages, website_id, data):
+    """The Page from ``intern_pages`` output for one event, or None."""
+    return pages.get((website_id, data.get('page_url')))
+
+
+# Exported and archived columns read back through the dimension tables,
+# with the values() lookups that produce them.
+VALUE_LOOKUPS = {
+    **{field: f'{field}__value' for field in interners},
+    'page_url': 'page__url',
+    'page_title': 'page__title',
+}
+# Activity foreign keys that VALUE_LOOKUPS stands in for.
+DIMENSION_FIELDS = [*interners, 'page']
+
+
+def decode(row):
+    """Replace dimension lookups in a ``values()`` row with their column names, in place."""
+    for name, lookup in VALUE_LOOKUPS.items():
+        if lookup in row:
+            row[name] = row.pop(lookup)
+    return row
@@ -1,6 +1,6 @@
 import django_filters
 from .models import People
-from django.db import models
+from .search import search_people
 
 class PeopleFilter(django_filters.FilterSet):
     search = django_filters.CharFilter(method='search_filter')
@@ -10,11 +10,7 @@ class PeopleFilter(django_filters.FilterSet):
     created_at_before = django_filters.DateTimeFilter(field_name='created_at', lookup_expr='lte')
     
     def search_filter(self, queryset, name, value):
-        return queryset.filter(
-            models.Q(name__icontains=value) |
-            models.Q(email__icontains=value) |
-            models.Q(phone__icontains=value)
-        )
+        return search_people(queryset, value)
     
     class Meta:
         model = People
@@ -0,0 +1,447 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, models, transaction
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+from . import live
+from .cache import MISSING, recent_events, visitor_cache, website_cache
+from .dimensions import PERSON_DIMENSIONS, dimension_ids, forget_interned, intern_events, intern_pages, page_for
+from .models import Website, Activity, People
+from .presence import get_presence
+from .summary import get_summary_writer
+
+
+def resolve_websites(site_ids):
+    """Map each distinct site_id to its website id.
+
+    Answers from ``website_cache`` where possible and fetches the rest with a
+    single query; unknown site_ids are cached as negative entries and left
+    out of the result.
+    """
+    websites = {}
+    unresolved = set()
+    for site_id in set(site_ids):
+        website_id = website_cache.get(site_id)
+        if website_id is MISSING:
+            unresolved.add(site_id)
+        elif website_id is not None:
+            websites[site_id] = website_id
+    if unresolved:
+        found = dict(Website.objects.filter(site_id__in=unresolved).values_list('site_id', 'id'))
+        for site_id in unresolved:
+            website_cache.set(site_id, found.get(site_id))
+        websites.update(found)
+    return websites
+
+
+def resolve_people(visitor_ids):
+    """Map each distinct visitor_id to a person id.
+
+    Answers from ``visitor_cache`` where possible and fetches the rest with a
+    single query.  Matches ``People.objects.filter(visitor_id=...).first()``:
+    when several people share a visitor_id the lowest pk wins.  Anonymous
+    visitors are cached as negative entries and left out of the result.
+    """
+    people = {}
+    unresolved = set()
+    for visitor_id in set(visitor_ids):
+        if not visitor_id:
+            continue
+        person_id = visitor_cache.get(visitor_id)
+        if person_id is MISSING:
+            unresolved.add(visitor_id)
+        elif person_id is not None:
+            people[visitor_id] = person_id
+    if unresolved:
+        found = {}
+        rows = People.objects.filter(visitor_id__in=unresolved).order_by('pk').values_list('visitor_id', 'id')
+        for visitor_id, person_id in rows:
+            found.setdefault(visitor_id, person_id)
+        for visitor_id in unresolved:
+            visitor_cache.set(visitor_id, found.get(visitor_id))
+        people.update(found)
+    return people
+
+
+def forget_cached(events):
+    """Drop the cached website, person, dimension and page ids of ``events``.
+
+    They are looked up again on the next attempt, as any of them may name a
+    row deleted since it was cached.
+    """
+    for event in events:
+        website_cache.invalidate(event.get('site_id'))
+        if event.get('visitor_id'):
+            visitor_cache.invalidate(event['visitor_id'])
+    websites = resolve_websites(event.get('site_id') for event in events)
+    forget_interned(
+        (websites[event.get('site_id')], event) for event in events if event.get('site_id') in websites
+    )
+
+
+def identifies(data):
+    """Whether ``data`` is a Form Submission naming its person by email."""
+    return data.get('event_type') == 'Form Submission' and bool((data.get('form_data') or {}).get('email'))
+
+
+def upsert_person(data, now=None, ids=None):
+    """Create or update the person behind a Form Submission event.
+
+    ``ids`` is the ``intern_events`` output covering ``data``.  Returns the
+    person, or None when the event does not identify anyone.
+    """
+    if not identifies(data):
+        return None
+    form_data = data['form_data']
+    email = form_data['email']
+    defaults = {
+        'name': form_data.get('name', ''),
+        'phone': form_data.get('phone', ''),
+        'visitor_id': data.get('visitor_id'),
+        **dimension_ids(data, ids or intern_events([data]), PERSON_DIMENSIONS),
+        'stage': 'Contact',
+    }
+    occured_at = data.get('occured_at')
+    if occured_at is not None:
+        # A backdated event (an import) older than what is already known
+        # about the person only fills in blanks: it never rolls name, phone,
+        # visitor_id or stage back to older values.
+        person = People.objects.select_for_update().filter(email=email, last_activity__gt=occured_at).first()
+        if person is not None:
+            fill_blanks(person, {key: value for key, value in defaults.items() if key != 'stage'})
+            return person
+    # Existing people get last_activity from update_people_summary(), which
+    # never moves it backwards when historical events are imported.
+    person, created = People.objects.update_or_create(
+        email=email,
+        defaults=defaults,
+        create_defaults={**defaults, 'last_activity': occured_at or data.get('received_at') or now or timezone.now()},
+    )
+    return person
+
+
+def fill_blanks(person, values):
+    """Set the fields of ``person`` that are still empty from ``values``."""
+    blank = [field for field, value in values.items() if value and not getattr(person, field)]
+    for field in blank:
+        setattr(person, field, values[field])
+    if blank:
+        person.save(update_fields=blank)
+
+
+def build_activity(website_id, person_id, data, ids, pages):
+    """An unsaved Activity for one event.
+
+    ``ids`` and ``pages`` are the ``intern_events`` and ``intern_pages``
+    output covering ``data``.
+    """
+    at = data.get('occured_at') or data.get('received_at')
+    extra = {'occured_at': at} if at else {}
+    return Activity(
+        website_id=website_id,
+        visitor_id=data.get('visitor_id'),
+        people_id=person_id,
+        activity_type=data.get('event_type'),
+        page=page_for(pages, website_id, data),
+        form_data=data.get('form_data') or {},
+        metadata=data.get('metadata'),
+        event_id=data.get('event_id'),
+        **dimension_ids(data, ids),
+        **extra,
+    )
+
+
+def _per_person(values, output_field):
+    # One branch per distinct value rather than per person: in a batch most
+    # people share a count, page or activity type, and every branch costs
+    # compile time.
+    by_value = {}
+    for pk, value in values.items():
+        by_value.setdefault(value, []).append(pk)
+    return models.Case(
+        *[models.When(pk__in=pks, then=models.Value(value)) for value, pks in by_value.items()],
+        output_field=output_field,
+    )
+
+
+def summarize(activities, counts=None, first=None, latest=None):
+    """Per-person activity counts and earliest and latest activities.
+
+    Folds into ``counts``, ``first`` and ``latest`` when they are given, so
+    a caller can accumulate several batches before writing them.
+    """
+    counts = Counter() if counts is None else counts
+    first = {} if first is None else first
+    latest = {} if latest is None else latest
+    for activity in activities:
+        pk = activity.people_id
+        counts[pk] += 1
+        if pk not in first or activity.occured_at < first[pk].occured_at:
+            first[pk] = activity
+        if pk not in latest or activity.occured_at >= latest[pk].occured_at:
+            latest[pk] = activity
+    return counts, first, latest
+
+
+def update_people_summary(activities):
+    """Fold newly stored activities into their people's summary columns.
+
+    Bumps ``activity_count``, moves ``last_activity`` and the ``last_*``
+    columns to each person's latest activity and sets ``first_seen_at`` the
+    first time, all in one UPDATE however many people are involved.
+    """
+    apply_people_summary(*summarize(activities))
+
+
+def apply_people_summary(counts, first, latest):
+    """Write the output of ``summarize`` to the People rows in one UPDATE."""
+    if not counts:
+        return
+    first_seen = _per_person({pk: a.occured_at for pk, a in first.items()}, models.DateTimeField())
+    last_seen = _per_person({pk: a.occured_at for pk, a in latest.items()}, models.DateTimeField())
+    # Historical imports can arrive older than what is already stored; the
+    # last_* columns then keep their values, like last_activity does.
+    stale = models.Q(last_activity__gt=last_seen)
+
+    def latest_value(column, value):
+        return models.Case(
+            models.When(stale, then=models.F(column)),
+            default=_per_person({pk: value(a) for pk, a in latest.items()}, models.CharField()),
+        )
+
+    People.objects.filter(pk__in=counts).update(
+        activity_count=models.F('activity_count') + _per_person(counts, models.IntegerField()),
+        first_seen_at=Least(Coalesce('first_seen_at', first_seen), first_seen),
+        last_activity=Greatest(Coalesce('last_activity', last_seen), last_seen),
+        last_activity_type=latest_value('last_activity_type', lambda a: a.activity_type),
+        last_page_title=latest_value('last_page_title', lambda a: a.page.title if a.page else None),
+        last_page_url=latest_value('last_page_url', lambda a: a.page.url if a.page else None),
+    )
+
+
+# Per-event outcomes reported by ingest_events().
+STORED = 'stored'
+ANONYMOUS = 'anonymous'
+UNKNOWN_SITE = 'unknown_site'
+DUPLICATE = 'duplicate'
+
+
+def ingest_events(events):
+    """Store a batch of validated tracking events.
+
+    ``events`` is a list of ``TrackingEventSerializer.validated_data`` dicts,
+    possibly spanning several websites and visitors; an ``occured_at`` key
+    (see ``ImportEventSerializer``) backdates the activity.  Events queued
+    before storing (spool, buffer) carry ``received_at`` instead: it dates
+    the activity but is not an import, so people are updated as usual.
+    Websites and people are
+    resolved once per distinct id, activities are written with one
+    ``bulk_create`` and the people summaries (``last_activity`` included) are
+    updated with one more query, all in a single transaction.  With
+    ``TRACKING_SUMMARY['WRITE_BEHIND']`` on, the summaries are instead
+    handed to the ``SummaryWriteBehind`` on commit.
+
+    Events carrying an ``event_id`` seen recently for the same site are
+    dropped before any query runs (``recent_events``); older repeats and
+    ones ingested by another process are caught by the unique constraint.
+    Cached website and person ids can outlive rows deleted by another
+    process; a batch rejected for that at commit is retried once with the
+    ids looked up again.
+
+    Returns a list of ``(status, activity)`` tuples in input order, where
+    ``activity`` is None unless the status is ``STORED``.
+    """
+    duplicate = []
+    claimed = []
+    for event in events:
+        key = (event['site_id'], event['event_id']) if event.get('event_id') else None
+        duplicate.append(key is not None and not recent_events.add(key))
+        if key is not None and not duplicate[-1]:
+            claimed.append(key)
+    try:
+        try:
+            results, activities = _store_events(events, duplicate)
+        except IntegrityError:
+            if transaction.get_connection().in_atomic_block:
+                raise
+            # Deferred foreign key checks fail the batch at commit when a
+            # cached website, person or page was deleted by another process.
+            forget_cached(events)
+            results, activities = _store_events(events, duplicate)
+    except Exception:
+        # Let a retry of the same events through.
+        for key in claimed:
+            recent_events.discard(key)
+        raise
+    live.publish(activities, mark_present(activities))
+    return results
+
+
+def storable(events, people):
+    """The ``events`` that belong to someone, given ``resolve_people`` output.
+
+    A Form Submission with an email identifies its visitor for the events
+    after it in the batch, as ``_store_events`` will.
+    """
+    identified = set(people)
+    owned = []
+    for event in events:
+        visitor_id = event.get('visitor_id')
+        if identifies(event):
+            if visitor_id:
+                identified.add(visitor_id)
+        elif visitor_id not in identified:
+            continue
+        owned.append(event)
+    return owned
+
+
+def _store_events(events, duplicate):
+    now = timezone.now()
+    fresh = [event for event, dup in zip(events, duplicate) if not dup]
+    if not fresh:
+        return [(DUPLICATE, None)] * len(events), []
+    websites = resolve_websites(event['site_id'] for event in fresh)
+    known = [event for event in fresh if event['site_id'] in websites]
+    results = []
+    activities = []
+    with transaction.atomic():
+        people = resolve_people(event.get('visitor_id') for event in known)
+        # Only events that will be stored intern their dimension values and
+        # pages, so anonymous traffic adds no rows and retitles no pages.
+        owned = storable(known, people)
+        ids = intern_events(owned)
+        pages = intern_pages((websites[event['site_id']], event) for event in owned)
+        for event, dup in zip(events, duplicate):
+            if dup:
+                results.append((DUPLICATE, None))
+                continue
+            website_id = websites.get(event['site_id'])
+            if website_id is None:
+                results.append((UNKNOWN_SITE, None))
+                continue
+            visitor_id = event.get('visitor_id')
+            person = upsert_person(event, now, ids)
+            if person is not None:
+                person_id = person.pk
+                if visitor_id:
+                    people[visitor_id] = person_id
+            else:
+                person_id = people.get(visitor_id) if visitor_id else None
+            if person_id is None:
+                results.append((ANONYMOUS, None))
+                continue
+            activity = build_activity(website_id, person_id, event, ids, pages)
+            activities.append(activity)
+            results.append((STORED, activity))
+        activities = create_activities(activities, results)
+        writer = get_summary_writer()
+        if writer is None:
+            update_people_summary(activities)
+        else:
+            # Counted once the activities are committed.
+            transaction.on_commit(partial(writer.add, activities))
+    return results, activities
+
+
+def create_activities(activities, results):
+    """``bulk_create`` the activities whose ``event_id`` is not stored yet.
+
+    The unique constraint on ``(website, event_id)`` makes the insert fail
+    as a whole when any event was already stored; the insert is then
+    retried without those, whose entries in ``results`` become
+    ``DUPLICATE``.  Returns the activities actually created.
+    """
+    if not any(activity.event_id for activity in activities):
+        Activity.objects.bulk_create(activities)
+        return activities
+    try:
+        with transaction.atomic():
+            Activity.objects.bulk_create(activities)
+        return activities
+    except IntegrityError:
+        pass
+    seen = set(Activity.objects.filter(
+        website_id__in={activity.website_id for activity in activities},
+        event_id__in={activity.event_id for activity in activities if activity.event_id},
+    ).values_list('website_id', 'event_id'))
+    created = []
+    skipped = set()
+    for activity in activities:
+        key = (activity.website_id, activity.event_id)
+        if activity.event_id and key in seen:
+            skipped.add(id(activity))
+            continue
+        seen.add(key)
+        created.append(activity)
+    Activity.objects.bulk_create(created)
+    results[:] = [
+        (DUPLICATE, None) if id(activity) in skipped else (status, activity)
+        for status, activity in results
+    ]
+    recent_events.count_duplicates(len(skipped))
+    return created
+
+
+def mark_present(activities):
+    """Tell the presence tracker about everyone seen in ``activities``.
+
+    Activities already older than the presence window (imported history)
+    say nothing about who is online and are ignored.  Returns the
+    ``(website id, person id)`` pairs that just came online.
+    """
+    presence = get_presence()
+    cutoff = timezone.now() - timedelta(seconds=presence.window)
+    seen = {}
+    for activity in activities:
+        if activity.occured_at < cutoff:
+            continue
+        key = (activity.website_id, activity.people_id)
+        seen[key] = max(seen.get(key, activity.occured_at), activity.occured_at)
+    return {
+        (website_id, person_id) for (website_id, person_id), at in seen.items()
+        if presence.mark_seen(website_id, person_id, at.timestamp())
+    }
+
+
+_write_executor = None
+_write_executor_lock = threading.Lock()
+
+
+def get_write_executor():
+    """Thread pool for database writes from async views.
+
+    Sized by ``TRACKING_ASYNC['WRITE_THREADS']``; 0 returns None, which
+    sends writes to Django's single shared sync thread instead.  SQLite has
+    a single writer, so it never gets more than one thread.
+    """
+    global _write_executor
+    with _write_executor_lock:
+        threads = getattr(settings, 'TRACKING_ASYNC', {}).get('WRITE_THREADS', 8)
+        if connection.vendor == 'sqlite':
+            threads = min(threads, 1)
+        if _write_executor is None and threads:
+            _write_executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='tracking-write')
+        return _write_executor
+
+
+def _ingest_in_pool(events):
+    # Pool threads outlive requests, so they honour CONN_MAX_AGE themselves.
+    close_old_connections()
+    try:
+        return ingest_events(events)
+    finally:
+        close_old_connections()
+
+
+async def aingest_events(events):
+    """``ingest_events`` for async callers, run on the write pool."""
+    executor = get_write_executor()
+    if executor is None:
+        return await sync_to_async(ingest_events)(events)
+    return await sync_to_async(_ingest_in_pool, thread_sensitive=False, executor=executor)(events)
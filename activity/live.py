@@ -0,0 +1,161 @@
+import atexit
+import logging
+import threading
+from datetime import timedelta
+from functools import partial
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .presence import get_presence
+
+logger = logging.getLogger(__name__)
+
+
+def options():
+    return {
+        'ENABLED': True,
+        'COALESCE_MS': 250,
+        'MAX_BATCH': 200,
+        **getattr(settings, 'TRACKING_LIVE', {}),
+    }
+
+
+def group_name(website_id):
+    return f'website-{website_id}-activity'
+
+
+def activity_payload(activity):
+    return {
+        'id': activity.pk,
+        'people': activity.people_id,
+        'visitor_id': activity.visitor_id,
+        'activity_type': activity.activity_type,
+        'page_title': activity.page.title if activity.page else None,
+        'page_url': activity.page.url if activity.page else None,
+        'occured_at': activity.occured_at.isoformat(),
+    }
+
+
+class LivePublisher:
+    """Coalesces live feed messages per website and sends them in bulk.
+
+    ``add`` folds committed activities into one pending message per
+    website; a daemon thread sends everything pending every ``interval``
+    seconds, one ``group_send`` per website however many sockets and
+    ingest batches there are.  A message carries at most ``max_batch``
+    activities, the newest; ``dropped`` counts the older ones skipped
+    during a spike.
+    """
+
+    def __init__(self, send, interval=0.25, max_batch=200):
+        self.send = send
+        self.interval = interval
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._send_late = True
+        self.pending = {}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='tracking-live-publisher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10, send_pending=True):
+        """Stop the worker, sending everything still pending unless ``send_pending`` is off."""
+        self._send_late = send_pending
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        if send_pending:
+            self.flush()
+        else:
+            with self._lock:
+                self.pending = {}
+
+    def add(self, activities, online):
+        """Queue ``{website id: [payloads]}`` and ``{website id: [person ids]}``."""
+        if self._stopping.is_set() and not self._send_late:
+            return
+        if not self._stopping.is_set():
+            self.start()
+        with self._lock:
+            for website_id in activities.keys() | online.keys():
+                message = self.pending.setdefault(website_id, {'activities': [], 'online': [], 'dropped': 0})
+                message['activities'].extend(activities.get(website_id, []))
+                message['online'].extend(pk for pk in online.get(website_id, []) if pk not in message['online'])
+                overflow = len(message['activities']) - self.max_batch
+                if overflow > 0:
+                    del message['activities'][:overflow]
+                    message['dropped'] += overflow
+        if self._stopping.is_set():
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        for website_id, message in pending.items():
+            try:
+                self.send(group_name(website_id), {'type': 'activity.batch', **message})
+            except Exception:
+                logger.exception('Failed to publish %d activities to the live feed', len(message['activities']))
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.flush()
+
+
+def group_send(group, message):
+    layer = get_channel_layer()
+    if layer is not None:
+        async_to_sync(layer.group_send)(group, message)
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    """The process-wide publisher, or None when the feed is disabled."""
+    global _publisher
+    live = options()
+    if not live['ENABLED']:
+        return None
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = LivePublisher(group_send, interval=live['COALESCE_MS'] / 1000, max_batch=live['MAX_BATCH'])
+            # At exit asgiref can no longer start the event loop group_send
+            # runs on, and a live feed has nothing to catch up on anyway.
+            atexit.register(_publisher.stop, send_pending=False)
+        return _publisher
+
+
+def publish(activities, came_online=()):
+    """Send newly stored activities to the live feed of their websites.
+
+    ``came_online`` holds the ``(website id, person id)`` pairs that just
+    came online.  Activities older than the presence window (imported
+    history) are not live and are left out.  Handed to the publisher when
+    the surrounding transaction commits, so rolled back activities are
+    never announced.
+    """
+    publisher = get_publisher()
+    if publisher is None:
+        return
+    cutoff = timezone.now() - timedelta(seconds=get_presence().window)
+    by_website = {}
+    for activity in activities:
+        if activity.occured_at >= cutoff:
+            by_website.setdefault(activity.website_id, []).append(activity_payload(activity))
+    online = {}
+    for website_id, person_id in came_online:
+        online.setdefault(website_id, []).append(person_id)
+    if by_website or online:
+        transaction.on_commit(partial(publisher.add, by_website, online))
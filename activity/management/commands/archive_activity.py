@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from activity.archive import archive_dir, delete_in_chunks, expired_activities, write_archive
+from activity.models import Website
+
+
+class Command(BaseCommand):
+    help = "Archive Activity older than each website's retention to NDJSON files and delete it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--website', type=int, action='append', help="Only these website ids")
+        parser.add_argument('--directory', help="Archive root (defaults to TRACKING_ARCHIVE_DIR)")
+        parser.add_argument('--read-chunk-size', type=int, default=2000)
+        parser.add_argument('--delete-chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be archived")
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or archive_dir()
+        websites = Website.objects.filter(retention_days__isnull=False)
+        if options['website']:
+            websites = websites.filter(id__in=options['website'])
+        now = timezone.now()
+        for website in websites:
+            activities = expired_activities(website, now)
+            if options['dry_run']:
+                self.stdout.write(f"{website}: {activities.count()} activities to archive")
+                continue
+            rows, max_id, paths = write_archive(activities, directory, website, options['read_chunk_size'])
+            if not rows:
+                continue
+            deleted = delete_in_chunks(activities, max_id, options['delete_chunk_size'])
+            self.stdout.write(
+                f"{website}: archived {rows} activities to {len(paths)} file(s), deleted {deleted}"
+            )
@@ -0,0 +1,220 @@
+import http.client
+import itertools
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.testcases import LiveServerThread
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from activity import metrics
+from activity.benchmarking import benchmark_database, compare, load_results, summarize, write_results
+from activity.models import People, Website
+
+SCENARIOS = ['viewed_page', 'form_submission', 'anonymous']
+TRANSPORTS = ['client', 'wsgi']
+ENDPOINTS = {'sync': 'track-event', 'async': 'track-event-async'}
+SITE_ID = 'bench-site'
+
+
+class Command(BaseCommand):
+    help = "Benchmark track_event throughput, latency and queries per event on a throwaway database"
+    shared_connection = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requests per scenario and transport")
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--transport', action='append', choices=TRANSPORTS,
+                            help="client: Django test client, in process; "
+                                 "wsgi: threaded WSGI server over TCP (default: all)")
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="Default: all")
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS,
+                            help="sync: track_event (DRF); async: track_event_async on the write pool "
+                                 "(default: sync)")
+        parser.add_argument('--payloads', help="NDJSON file of recorded payloads, replayed as the 'recorded' scenario")
+        parser.add_argument('--concurrency', type=int, default=4, help="Requests in flight for wsgi")
+        parser.add_argument('--people', type=int, default=1000, help="Known visitors to seed")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true', help="Reuse (and keep) the benchmark database")
+        parser.add_argument('--output', help="Write results as JSON to this path")
+        parser.add_argument('--compare', help="Baseline JSON written by an earlier --output")
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help="Relative change that counts as a regression when comparing")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        scenarios = options['scenario'] or SCENARIOS
+        transports = options['transport'] or TRANSPORTS
+        recorded = self.read_payloads(options['payloads']) if options['payloads'] else None
+        with benchmark_database(keepdb=options['keepdb']):
+            self.seed(options['people'], recorded)
+            connection_created.connect(metrics.install)
+            metrics.install(connections[DEFAULT_DB_ALIAS])
+            results = {}
+            for transport, endpoint in itertools.product(transports, options['endpoint'] or ['sync']):
+                self.path = reverse(ENDPOINTS[endpoint])
+                label = transport if endpoint == 'sync' else f'{transport}-{endpoint}'
+                results[label] = {}
+                concurrency = 1 if transport == 'client' else options['concurrency']
+                if transport == 'wsgi' and connection.vendor == 'sqlite' and connection.is_in_memory_db():
+                    # Server threads share this in-memory connection, which
+                    # cannot run two transactions at once.
+                    concurrency = 1
+                runs = {name: self.payloads(name, options['requests'], options['people'], rng) for name in scenarios}
+                if recorded:
+                    runs['recorded'] = recorded
+                for name, payloads in runs.items():
+                    warmup = self.payloads(name, options['warmup'], options['people'], rng) if name != 'recorded' else []
+                    row = self.run(transport, endpoint, warmup, payloads, concurrency)
+                    results[label][name] = row
+                    self.report(label, name, row)
+        if options['output']:
+            write_results(options['output'], 'ingest', results)
+        if options['compare']:
+            self.compare(load_results(options['compare']), results, options)
+
+    def read_payloads(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot read {path}: {exc}")
+
+    def seed(self, total, recorded):
+        user, _ = get_user_model().objects.get_or_create(username='bench-ingest')
+        Website.objects.get_or_create(site_id=SITE_ID, defaults={'user': user, 'domain': 'bench.example.com'})
+        for site_id in {str(payload.get('site_id')) for payload in recorded or []}:
+            Website.objects.get_or_create(site_id=site_id, defaults={'user': user, 'domain': 'recorded.example.com'})
+        existing = set(People.objects.filter(visitor_id__startswith='bench-visitor-').values_list('visitor_id', flat=True))
+        People.objects.bulk_create([
+            People(name=f'Bench {i}', email=f'bench{i}@example.com', phone='5550000', visitor_id=f'bench-visitor-{i}')
+            for i in range(total) if f'bench-visitor-{i}' not in existing
+        ], batch_size=1000)
+
+    def payloads(self, scenario, count, people, rng):
+        events = []
+        for _ in range(count):
+            i = rng.randrange(people)
+            event = {
+                'site_id': SITE_ID,
+                'event_type': 'Viewed Page',
+                'visitor_id': f'bench-visitor-{i}',
+                'page_url': f'https://bench.example.com/listing/{rng.randrange(200)}',
+                'page_title': 'Listing',
+                'user_agent': 'Mozilla/5.0 (bench)',
+                'language': 'en-CA',
+                'screen_resolution': '1920x1080',
+            }
+            if scenario == 'form_submission':
+                # Half update a known person, half create a new one.
+                n = i if rng.random() < 0.5 else people + rng.randrange(10 ** 9)
+                event.update(
+                    event_type='Form Submission', visitor_id=f'bench-visitor-{n}',
+                    form_data={'name': f'Bench {n}', 'email': f'bench{n}@example.com', 'phone': '5550000'},
+                )
+            elif scenario == 'anonymous':
+                event['visitor_id'] = f'anonymous-{rng.getrandbits(64):x}'
+            events.append(event)
+        return events
+
+    def run(self, transport, endpoint, warmup, payloads, concurrency):
+        runner = getattr(self, f'run_{transport}')
+        runner(warmup, concurrency)
+        stats = metrics.RequestStats()
+        with metrics.tracking(stats), CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            samples, errors = runner(payloads, concurrency)
+            elapsed = time.perf_counter() - started
+        if transport == 'client':
+            # Follows the request into sync_to_async and write-pool threads.
+            queries = stats.queries
+        elif self.shared_connection and endpoint == 'sync':
+            queries = len(captured)
+        else:
+            # WSGI server and write-pool threads use connections of their own.
+            queries = None
+        return {
+            'requests': len(payloads),
+            'errors': errors,
+            'concurrency': concurrency,
+            'requests_per_s': len(payloads) / elapsed if elapsed else None,
+            'queries_per_event': queries / len(payloads) if queries is not None and payloads else None,
+            'latency': summarize(samples),
+        }
+
+    def run_client(self, payloads, concurrency):
+        client = Client()
+        samples = []
+        errors = 0
+        for payload in payloads:
+            started = time.perf_counter()
+            response = client.post(self.path, json.dumps(payload), content_type='application/json')
+            samples.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+        return samples, errors
+
+    def run_wsgi(self, payloads, concurrency):
+        server = self.start_server()
+        try:
+            def send(payload):
+                body = json.dumps(payload)
+                started = time.perf_counter()
+                conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=30)
+                try:
+                    conn.request('POST', self.path, body, {'Content-Type': 'application/json'})
+                    response = conn.getresponse()
+                    response.read()
+                    failed = response.status >= 400
+                except OSError:
+                    failed = True
+                finally:
+                    conn.close()
+                return time.perf_counter() - started, failed
+
+            with ThreadPoolExecutor(concurrency) as pool:
+                outcomes = list(pool.map(send, payloads))
+        finally:
+            server.terminate()
+            if self.shared_connection:
+                connection.dec_thread_sharing()
+        return [latency for latency, failed in outcomes], sum(failed for latency, failed in outcomes)
+
+    def start_server(self):
+        # Like LiveServerTestCase: an in-memory SQLite database only exists
+        # on this connection, so the server threads have to borrow it.
+        self.shared_connection = connection.vendor == 'sqlite' and connection.is_in_memory_db()
+        override = None
+        if self.shared_connection:
+            connection.inc_thread_sharing()
+            override = {DEFAULT_DB_ALIAS: connections[DEFAULT_DB_ALIAS]}
+        server = LiveServerThread('127.0.0.1', lambda handler: handler, connections_override=override)
+        server.daemon = True
+        server.start()
+        server.is_ready.wait()
+        if server.error:
+            raise server.error
+        return server
+
+    def report(self, transport, scenario, row):
+        latency = row['latency']
+        queries = row['queries_per_event']
+        self.stdout.write(
+            f"{transport:>11} {scenario:>15}: {row['requests_per_s']:8.1f} req/s, "
+            f"p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms, p99 {latency['p99_ms']:.2f} ms, "
+            f"{'-' if queries is None else f'{queries:.2f}'} queries/event, {row['errors']} errors"
+        )
+
+    def compare(self, baseline, results, options):
+        regressions = 0
+        for path, metric, old, new, change, regressed in compare(baseline, results, options['threshold']):
+            regressions += regressed
+            line = f"{path:>30} {metric:>17}: {old:10.2f} -> {new:10.2f} ({change:+.1%})"
+            self.stdout.write(self.style.ERROR(line + " REGRESSION") if regressed else line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{regressions} metrics regressed by more than {options['threshold']:.0%}")
@@ -0,0 +1,80 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from activity import search
+from activity.benchmarking import benchmark_database, measure, summarize, write_results
+from activity.models import People
+from activity.synthetic import DOMAINS, FIRST_NAMES, LAST_NAMES
+
+
+def legacy_search(queryset, value):
+    return queryset.filter(
+        models.Q(name__icontains=value) |
+        models.Q(email__icontains=value) |
+        models.Q(phone__icontains=value)
+    )
+
+
+class Command(BaseCommand):
+    help = "Benchmark PeopleFilter search against the pre-index icontains scan on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--people', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true', help="Reuse (and keep) the benchmark database")
+        parser.add_argument('--output', help="Write results as JSON to this path")
+
+    def handle(self, *args, **options):
+        with benchmark_database(keepdb=options['keepdb']):
+            self.seed(options['people'], options['batch_size'], random.Random(options['seed']))
+            terms = {
+                'email fragment': 'guez12',
+                'name fragment': 'patel',
+                'phone fragment': '5550',
+                'no match': 'zzqx',
+                'short term': 'ja',
+            }
+            results = {'people': People.objects.count(), 'terms': {}}
+            for label, term in terms.items():
+                results['terms'][label] = {
+                    'term': term,
+                    'matches': search.search_people(People.objects.all(), term).count(),
+                    'indexed': summarize(measure(lambda: self.page(search.search_people, term), options['repeat'])),
+                    'icontains': summarize(measure(lambda: self.page(legacy_search, term), options['repeat'])),
+                }
+                row = results['terms'][label]
+                self.stdout.write(
+                    f"{label:>15} {term!r:>8}: {row['matches']:>8} matches, "
+                    f"indexed p50 {row['indexed']['p50_ms']:.1f} ms / p95 {row['indexed']['p95_ms']:.1f} ms, "
+                    f"icontains p50 {row['icontains']['p50_ms']:.1f} ms / p95 {row['icontains']['p95_ms']:.1f} ms"
+                )
+            if options['output']:
+                write_results(options['output'], 'people_search', results)
+
+    def page(self, search_fn, term):
+        # What PeopleListCreateView does for ?search=: a COUNT and the first page.
+        queryset = search_fn(People.objects.all(), term)
+        queryset.count()
+        list(queryset.order_by('-last_activity', '-id').values_list('id', flat=True)[:30])
+
+    def seed(self, total, batch_size, rng):
+        existing = People.objects.count()
+        if existing >= total:
+            return
+        started = time.perf_counter()
+        for start in range(existing, total, batch_size):
+            People.objects.bulk_create([self.person(i, rng) for i in range(start, min(start + batch_size, total))])
+        search.rebuild_index(connection)
+        self.stdout.write(f"Seeded {total - existing} people in {time.perf_counter() - started:.1f}s")
+
+    def person(self, i, rng):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        return People(
+            name=f'{first.title()} {last.title()}',
+            email=f'{first}.{last}{i}@{rng.choice(DOMAINS)}',
+            phone=f'{rng.randint(200, 999)}555{rng.randint(0, 9999):04d}',
+            visitor_id=f'visitor-{i}',
+        )
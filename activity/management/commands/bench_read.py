@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from activity.benchmarking import benchmark_database, compare, load_results, measure, summarize, write_results
+from activity.models import People, Tag
+from activity.synthetic import Generator
+
+
+class Command(BaseCommand):
+    help = "Benchmark the people, activity and admin read paths at growing data sizes on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='10000,100000,1000000',
+                            help="Comma-separated activity counts to measure at, smallest first")
+        parser.add_argument('--people-per-activity', type=float, default=0.1,
+                            help="People seeded per activity at each scale")
+        parser.add_argument('--websites', type=int, default=5)
+        parser.add_argument('--skew', type=float, default=1.1)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true', help="Reuse (and keep) the benchmark database")
+        parser.add_argument('--output', help="Write results as JSON to this path")
+        parser.add_argument('--compare', help="Baseline JSON written by an earlier --output")
+        parser.add_argument('--threshold', type=float, default=0.10)
+
+    def handle(self, *args, **options):
+        try:
+            scales = sorted(int(scale) for scale in options['scales'].split(','))
+        except ValueError:
+            raise CommandError("--scales must be comma-separated integers")
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        generator = Generator(seed=options['seed'], skew=options['skew'], log=log)
+        results = {}
+        with benchmark_database(keepdb=options['keepdb']):
+            for scale in scales:
+                people = max(1, int(scale * options['people_per_activity']))
+                self.stdout.write(f"Seeding {scale} activities, {people} people")
+                generator.grow(options['websites'], people, scale)
+                client = Client()
+                client.force_login(generator.owner())
+                results[str(scale)] = {}
+                for name, url in self.cases():
+                    row = self.measure(client, url, options['repeat'])
+                    results[str(scale)][name] = row
+                    self.stdout.write(
+                        f"{scale:>9} {name:>28}: p50 {row['latency']['p50_ms']:8.1f} ms, "
+                        f"p95 {row['latency']['p95_ms']:8.1f} ms, {row['queries_per_request']:5.1f} queries"
+                        + (f", HTTP {row['status']}" if row['status'] != 200 else "")
+                    )
+        if options['output']:
+            write_results(options['output'], 'read_path', results)
+        if options['compare']:
+            for path, metric, old, new, change, regressed in compare(
+                load_results(options['compare']), results, options['threshold']
+            ):
+                line = f"{path:>40} {metric:>20}: {old:10.2f} -> {new:10.2f} ({change:+.1%})"
+                self.stdout.write(self.style.ERROR(line + " REGRESSION") if regressed else line)
+
+    def cases(self):
+        people = People.objects.exclude(visitor_id=None)
+        heavy = people.order_by('-activity_count').first()
+        typical = people.filter(activity_count__gt=0).order_by('activity_count')
+        typical = typical[typical.count() // 2]
+        tag = Tag.objects.order_by('pk').first()
+        people_list = reverse('people-list-create')
+        return [
+            ('people_list', people_list),
+            ('people_list_last_page', f'{people_list}?page=last'),
+            ('people_list_search', f'{people_list}?search={heavy.name.split()[-1].lower()}'),
+            ('people_list_search_email', f'{people_list}?search={heavy.email[:8]}'),
+            ('people_list_stage', f'{people_list}?stage=Lead'),
+            ('people_list_tag', f'{people_list}?tags={tag.name}'),
+            ('people_list_ordering_name', f'{people_list}?ordering=name'),
+            ('people_list_cursor', f'{people_list}?cursor='),
+            ('person_activities_heavy', reverse('person-activities', args=[heavy.pk])),
+            ('person_activities_typical', reverse('person-activities', args=[typical.pk])),
+            ('people_from_visitor_id', reverse('people-from-visitor-id', args=[typical.visitor_id])),
+            ('admin_people', reverse('admin:activity_people_changelist')),
+            ('admin_people_search', reverse('admin:activity_people_changelist') + f'?q={heavy.email[:8]}'),
+            ('admin_activity', reverse('admin:activity_activity_changelist')),
+            ('admin_activity_type', reverse('admin:activity_activity_changelist') + '?activity_type=Inquiry'),
+            ('admin_website', reverse('admin:activity_website_changelist')),
+        ]
+
+    def measure(self, client, url, repeat):
+        response = client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return {
+            'url': url,
+            'status': response.status_code,
+            'queries_per_request': len(queries),
+            'latency': summarize(measure(lambda: client.get(url), repeat)),
+        }
@@ -0,0 +1,131 @@
+import json
+import os
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, InterfaceError, OperationalError, transaction
+from django.utils.dateparse import parse_datetime
+from activity import ingest
+from activity.cache import recent_events
+from activity.models import SpoolCheckpoint
+from activity.spool import list_segments, list_streams, read_records, segment_number
+
+
+class Command(BaseCommand):
+    help = "Replay spooled tracking events into Activity/People in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to sleep between passes when there is nothing to drain")
+        parser.add_argument('--once', action='store_true', help="Drain what is there and exit")
+        parser.add_argument('--stale-after', type=float, default=3600,
+                            help="Seconds after which a fully drained stream with no new writes is removed")
+
+    def handle(self, *args, **options):
+        spool = getattr(settings, 'TRACKING_SPOOL', {})
+        directory = Path(spool.get('DIR', Path(settings.BASE_DIR, 'spool')))
+        self.dead_letter_path = Path(spool.get('DEAD_LETTER', directory / 'dead-letter.jsonl'))
+        while True:
+            drained = sum(
+                self.drain_stream(stream, options['batch_size'], options['stale_after'])
+                for stream in list_streams(directory)
+            )
+            if drained:
+                self.stdout.write(f"Replayed {drained} events")
+            if options['once']:
+                return
+            if not drained:
+                time.sleep(options['interval'])
+
+    def drain_stream(self, stream_dir, batch_size, stale_after):
+        checkpoint, _ = SpoolCheckpoint.objects.get_or_create(stream=stream_dir.name)
+        segments = list_segments(stream_dir)
+        drained = 0
+        for index, path in enumerate(segments):
+            number = segment_number(path)
+            is_last = index == len(segments) - 1
+            if number < checkpoint.segment:
+                path.unlink(missing_ok=True)
+                continue
+            offset = checkpoint.offset if number == checkpoint.segment else 0
+            batch = []
+            for event, end in read_records(path, offset):
+                if event.get('received_at'):
+                    event['received_at'] = parse_datetime(event['received_at'])
+                batch.append(event)
+                offset = end
+                if len(batch) >= batch_size:
+                    self.commit(checkpoint, batch, number, offset)
+                    drained += len(batch)
+                    batch = []
+            if batch or number != checkpoint.segment:
+                self.commit(checkpoint, batch, number, offset)
+                drained += len(batch)
+
+            if not is_last:
+                # Anything after ``offset`` in a sealed segment is a record torn
+                # by a crashed writer; it can never complete.
+                if offset < path.stat().st_size:
+                    self.stderr.write(f"Skipping {path.stat().st_size - offset} corrupt bytes at the end of {path}")
+                self.commit(checkpoint, [], number + 1, 0)
+                path.unlink(missing_ok=True)
+            elif offset >= path.stat().st_size and time.time() - path.stat().st_mtime > stale_after:
+                # The writer of this stream is gone and everything it wrote is in.
+                path.unlink(missing_ok=True)
+                stream_dir.rmdir()
+                checkpoint.delete()
+        return drained
+
+    def commit(self, checkpoint, batch, segment, offset):
+        try:
+            self.commit_once(checkpoint, batch, segment, offset)
+        except IntegrityError:
+            # See ingest_events(): a cached id may be stale, which only
+            # shows when the deferred foreign key checks run at commit.
+            # The rolled back events must not pass for repeats either.
+            ingest.forget_cached(batch)
+            for event in batch:
+                if event.get('event_id'):
+                    recent_events.discard((event.get('site_id'), event['event_id']))
+            self.commit_once(checkpoint, batch, segment, offset)
+        checkpoint.segment = segment
+        checkpoint.offset = offset
+
+    def commit_once(self, checkpoint, batch, segment, offset):
+        with transaction.atomic():
+            if batch:
+                self.replay(checkpoint.stream, segment, batch)
+            SpoolCheckpoint.objects.filter(pk=checkpoint.pk).update(segment=segment, offset=offset)
+
+    def replay(self, stream, segment, batch):
+        """Ingest ``batch``, bisecting it to set aside the events that fail.
+
+        A record that can never be ingested would otherwise stop its stream
+        for good.  Lost connections are not the record's fault and are
+        raised, leaving the checkpoint where it was.
+        """
+        try:
+            with transaction.atomic():
+                ingest.ingest_events(batch)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as exc:
+            if len(batch) == 1:
+                self.dead_letter(stream, segment, batch[0], exc)
+                return
+            middle = len(batch) // 2
+            self.replay(stream, segment, batch[:middle])
+            self.replay(stream, segment, batch[middle:])
+
+    def dead_letter(self, stream, segment, event, exc):
+        # Written before the checkpoint moves past the event: a crash in
+        # between repeats the line rather than losing the event.
+        record = {'stream': stream, 'segment': segment, 'error': repr(exc), 'event': event}
+        self.dead_letter_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.stderr.write(f"Moved an event from {stream} to {self.dead_letter_path}: {exc!r}")
@@ -0,0 +1,143 @@
+import json
+import multiprocessing
+import time
+import zlib
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from rest_framework.exceptions import ValidationError
+from activity import ingest
+from activity.serializers import ImportEventSerializer
+
+
+def partition(visitor_id, workers):
+    """Worker that owns ``visitor_id``; stable across runs and processes."""
+    if workers == 1 or not visitor_id:
+        return 0
+    return zlib.crc32(str(visitor_id).encode()) % workers
+
+
+def read_events(path, worker, workers):
+    """Yield ``(line number, validated data, error)`` for this worker's events."""
+    # One serializer validates every line; building one per line deep-copies
+    # its fields each time and costs more than storing the event.
+    serializer = ImportEventSerializer()
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                payload = json.loads(line)
+            except ValueError as exc:
+                if worker == 0:
+                    yield number, None, str(exc)
+                continue
+            if not isinstance(payload, dict):
+                if worker == 0:
+                    yield number, None, "not a JSON object"
+                continue
+            if partition(payload.get('visitor_id'), workers) != worker:
+                continue
+            try:
+                yield number, serializer.run_validation(payload), None
+            except ValidationError as exc:
+                yield number, None, json.dumps(exc.detail)
+
+
+def import_partition(path, worker, workers, chunk_size, max_errors, progress=None):
+    """Import this worker's share of ``path``; ``progress`` is called with a line per chunk."""
+    counts = Counter()
+    errors = []
+    chunk = []
+
+    def flush():
+        for status, activity in ingest.ingest_events(chunk):
+            counts[status] += 1
+        chunk.clear()
+
+    try:
+        for number, data, error in read_events(path, worker, workers):
+            if error is not None:
+                counts['invalid'] += 1
+                if len(errors) < max_errors:
+                    errors.append(f"line {number}: {error}")
+                continue
+            chunk.append(data)
+            if len(chunk) >= chunk_size:
+                flush()
+                if progress is not None:
+                    progress(f"worker {worker}: {sum(counts.values())} events")
+        if chunk:
+            flush()
+    finally:
+        connections.close_all()
+    return counts, errors
+
+
+# Set in each pool worker by _init_worker; forked workers inherit it as is.
+_progress = None
+
+
+def _init_worker(progress):
+    global _progress
+    _progress = progress
+
+
+def _run(args):
+    return import_partition(*args, progress=_progress)
+
+
+class Command(BaseCommand):
+    help = "Import historical tracking events from an NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, one tracking payload per line")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Events stored per ingest batch and transaction")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Parallel processes; events are partitioned by visitor_id")
+        parser.add_argument('--max-errors', type=int, default=20,
+                            help="Invalid lines to print (all are counted)")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers < 1 or options['chunk_size'] < 1:
+            raise CommandError("--workers and --chunk-size must be positive")
+        if workers > 1 and connection.vendor == 'sqlite':
+            raise CommandError("SQLite allows a single writer; use --workers 1")
+        try:
+            open(options['path'], encoding='utf-8').close()
+        except OSError as exc:
+            raise CommandError(exc)
+        jobs = [
+            (options['path'], worker, workers, options['chunk_size'], options['max_errors'])
+            for worker in range(workers)
+        ]
+        progress = self.progress if options['verbosity'] > 1 else None
+        started = time.perf_counter()
+        if workers == 1:
+            results = [import_partition(*jobs[0], progress=progress)]
+        else:
+            # Forked children must open their own database connections.
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers, _init_worker, (progress,)) as pool:
+                results = pool.map(_run, jobs)
+        elapsed = time.perf_counter() - started
+
+        counts = Counter()
+        for worker_counts, errors in results:
+            counts.update(worker_counts)
+            for error in errors:
+                self.stderr.write(error)
+        total = sum(counts.values())
+        self.stdout.write(
+            f"Imported {counts[ingest.STORED]} of {total} events in {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else 0:.0f} events/s): "
+            f"{counts[ingest.ANONYMOUS]} anonymous, {counts[ingest.UNKNOWN_SITE]} unknown site, "
+            f"{counts[ingest.DUPLICATE]} duplicate, {counts['invalid']} invalid"
+        )
+
+    def progress(self, message):
+        # Pool workers exit without flushing their copy of stdout.
+        self.stdout.write(message)
+        self.stdout.flush()
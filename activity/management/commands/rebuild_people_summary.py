@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from activity.archive import archived_people
+from activity.models import Activity, People
+
+SUMMARY_FIELDS = [
+    'activity_count', 'first_seen_at', 'last_activity',
+    'last_activity_type', 'last_page_title', 'last_page_url',
+]
+
+
+class Command(BaseCommand):
+    help = "Recompute the activity summary columns on People from Activity and its archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--start-id', type=int, default=0, help="Resume from this People id")
+        parser.add_argument('--archive-directory',
+                            help="Archive root whose rows also count (defaults to TRACKING_ARCHIVE_DIR)")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = options['start_id']
+        # archive_activity deletes the rows it archives; counted from the
+        # table alone, archived people would lose that history.
+        self.archived = archived_people(options['archive_directory'])
+        if self.archived:
+            self.stdout.write(f"Counting archived activity for {len(self.archived)} people")
+        total = 0
+        while True:
+            ids = list(
+                People.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                self.rebuild(ids)
+            total += len(ids)
+            last_id = ids[-1]
+            self.stdout.write(f"Rebuilt {total} people (last id {last_id})")
+        self.stdout.write(self.style.SUCCESS(f"Done, {total} people rebuilt"))
+
+    def rebuild(self, ids):
+        latest = Activity.objects.filter(people=models.OuterRef('pk')).order_by('-occured_at', '-id')
+        people = list(People.objects.filter(pk__in=ids).annotate(
+            summary_count=models.Count('activity'),
+            summary_first=models.Min('activity__occured_at'),
+            summary_last=models.Max('activity__occured_at'),
+            summary_type=models.Subquery(latest.values('activity_type')[:1]),
+            summary_title=models.Subquery(latest.values('page__title')[:1]),
+            summary_url=models.Subquery(latest.values('page__url')[:1]),
+        ))
+        for person in people:
+            archived, archived_first = self.archived.get(person.pk, (0, None))
+            person.activity_count = person.summary_count + archived
+            person.first_seen_at = min(filter(None, [person.summary_first, archived_first]), default=None)
+            if person.summary_last and (not person.last_activity or person.summary_last > person.last_activity):
+                person.last_activity = person.summary_last
+            if person.summary_count or not archived:
+                # Otherwise the latest activity is archived and the stored
+                # values are the best left.
+                person.last_activity_type = person.summary_type
+                person.last_page_title = person.summary_title
+                person.last_page_url = person.summary_url
+        People.objects.bulk_update(people, SUMMARY_FIELDS)
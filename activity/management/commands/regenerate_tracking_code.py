@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from activity.models import Website
+
+
+class Command(BaseCommand):
+    help = "Rewrite every Website's tracking_code with the loader for the current tracker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Count the stale snippets without saving")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = 0
+        total = changed = 0
+        while True:
+            websites = list(
+                Website.objects.filter(pk__gt=last_id).order_by('pk').only('pk', 'site_id', 'tracking_code')[:chunk_size]
+            )
+            if not websites:
+                break
+            stale = []
+            for website in websites:
+                code = website.generate_tracking_code()
+                if website.tracking_code != code:
+                    website.tracking_code = code
+                    stale.append(website)
+            if stale and not options['dry_run']:
+                Website.objects.bulk_update(stale, ['tracking_code'])
+            total += len(websites)
+            changed += len(stale)
+            last_id = websites[-1].pk
+        verb = "would be updated" if options['dry_run'] else "updated"
+        self.stdout.write(self.style.SUCCESS(f"Done, {changed} of {total} snippets {verb}"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from activity.archive import read_archive, restore_rows
+
+
+class Command(BaseCommand):
+    help = "Re-import Activity rows from archive_activity NDJSON files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            restored = read = 0
+            batch = []
+            for row in read_archive(path):
+                batch.append(row)
+                if len(batch) >= options['chunk_size']:
+                    restored += self.restore(batch)
+                    read += len(batch)
+                    batch = []
+            if batch:
+                restored += self.restore(batch)
+                read += len(batch)
+            self.stdout.write(f"{path}: restored {restored} of {read} activities")
+
+    def restore(self, batch):
+        with transaction.atomic():
+            return restore_rows(batch)
@@ -0,0 +1,27 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from activity.rollups import rebuild, roll_up
+
+
+class Command(BaseCommand):
+    help = "Fold new Activity rows into the hourly and daily rollup tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help="Activity ids per transaction")
+        parser.add_argument('--grace-seconds', type=int, default=60,
+                            help="Leave activities stored less than this long ago for the next run")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Recompute the rollups from the raw activities; buckets older than "
+                                 "a website's retention are kept, as their rows may be archived")
+
+    def handle(self, *args, **options):
+        grace = timedelta(seconds=options['grace_seconds'])
+        if options['rebuild']:
+            up_to_id, buckets = rebuild(grace)
+            self.stdout.write(f"Rebuilt {buckets} buckets through id {up_to_id}")
+        chunks = 0
+        for up_to_id, buckets in roll_up(options['chunk_size'], grace):
+            chunks += 1
+            self.stdout.write(f"Rolled up activities through id {up_to_id} ({buckets} buckets)")
+        if not chunks:
+            self.stdout.write("Rollups are up to date")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from activity.synthetic import Generator
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic websites, people and activity for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--websites', type=int, default=5)
+        parser.add_argument('--people', type=int, default=10_000)
+        parser.add_argument('--activities', type=int, default=100_000)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help="Zipf exponent for how activity is spread over people; 0 is uniform")
+        parser.add_argument('--days', type=int, default=365, help="Spread activity over this many days back")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive')
+
+    def handle(self, *args, **options):
+        database = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        if options['interactive']:
+            confirm = input(
+                f"This adds synthetic rows to {database} until it holds {options['people']} people and "
+                f"{options['activities']} activities. Type 'yes' to continue: "
+            )
+            if confirm != 'yes':
+                raise CommandError("Seeding cancelled.")
+        generator = Generator(
+            seed=options['seed'], skew=options['skew'], days=options['days'],
+            batch_size=options['batch_size'], log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        generator.grow(options['websites'], options['people'], options['activities'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded up to {options['websites']} synthetic websites, {options['people']} people "
+            f"and {options['activities']} activities"
+        ))
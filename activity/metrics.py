@@ -0,0 +1,234 @@
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from django.conf import settings
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Component stats that only ever grow; the rest are exported as gauges.
+COUNTERS = {'hits', 'misses', 'evictions', 'enqueued', 'rejected', 'flushed', 'failed', 'flushes',
+            'flush_seconds_total', 'duplicates'}
+
+
+def options():
+    return {
+        'ENABLED': False,
+        'SLOW_REQUEST_MS': 500,
+        'SLOW_REQUEST_TOP_QUERIES': 5,
+        'ALLOWED_IPS': [],
+        'TOKEN': None,
+        **getattr(settings, 'TRACKING_METRICS', {}),
+    }
+
+
+class RequestStats:
+    """What one request spent, filled in while it runs."""
+
+    def __init__(self, keep=0):
+        self.keep = keep
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.render_seconds = 0.0
+        self.slowest = []
+
+    def record_query(self, sql, seconds):
+        self.queries += 1
+        self.query_seconds += seconds
+        if self.keep:
+            self.slowest.append((seconds, sql))
+            if len(self.slowest) > self.keep:
+                self.slowest.sort(reverse=True)
+                del self.slowest[self.keep:]
+
+
+_current = contextvars.ContextVar('activity_request_stats', default=None)
+_serializing = contextvars.ContextVar('activity_serializing', default=False)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def tracking(stats):
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper that charges each query to the current request, if any.
+
+    Installed once per connection by ``install``; the request is found
+    through a context variable, which ``sync_to_async`` carries into the
+    sync and write-pool threads of async requests.
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(sql, time.perf_counter() - started)
+
+
+def install(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedSerializerMixin:
+    """Adds a serializer's ``to_representation`` time to the request's stats.
+
+    Only the outermost serializer is timed, so nested and ``many=True``
+    children are not counted twice.
+    """
+
+    def to_representation(self, instance):
+        stats = _current.get()
+        if stats is None or _serializing.get():
+            return super().to_representation(instance)
+        token = _serializing.set(True)
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serialization_seconds += time.perf_counter() - started
+            _serializing.reset(token)
+
+
+class Registry:
+    """Process-wide aggregates keyed by route and method.
+
+    Every worker process keeps its own; Prometheus sums them across
+    scrape targets.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.histograms = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+            self.duration_seconds = defaultdict(float)
+            self.queries = defaultdict(int)
+            self.query_seconds = defaultdict(float)
+            self.serialization_seconds = defaultdict(float)
+            self.render_seconds = defaultdict(float)
+            self.slow_requests = defaultdict(int)
+
+    def observe(self, route, method, status, seconds, stats, slow):
+        key = (route, method)
+        with self._lock:
+            self.requests[(route, method, str(status))] += 1
+            buckets = self.histograms[key]
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            self.duration_seconds[key] += seconds
+            self.queries[key] += stats.queries
+            self.query_seconds[key] += stats.query_seconds
+            self.serialization_seconds[key] += stats.serialization_seconds
+            self.render_seconds[key] += stats.render_seconds
+            if slow:
+                self.slow_requests[key] += 1
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            _family(lines, 'tracking_http_requests_total', 'counter', "Requests served",
+                    {_labels(route=r, method=m, status=s): n for (r, m, s), n in self.requests.items()})
+            lines.append("# HELP tracking_http_request_duration_seconds Request latency")
+            lines.append("# TYPE tracking_http_request_duration_seconds histogram")
+            for (route, method), buckets in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(
+                        f"tracking_http_request_duration_seconds_bucket{_labels(route=route, method=method, le=le)} {cumulative}"
+                    )
+                labels = _labels(route=route, method=method)
+                lines.append(f"tracking_http_request_duration_seconds_sum{labels} {self.duration_seconds[(route, method)]}")
+                lines.append(f"tracking_http_request_duration_seconds_count{labels} {cumulative}")
+            for name, kind, description, values in [
+                ('tracking_db_queries_total', 'counter', "SQL queries run by requests", self.queries),
+                ('tracking_db_query_seconds_total', 'counter', "Time requests spent in SQL", self.query_seconds),
+                ('tracking_serialization_seconds_total', 'counter', "Time spent in serializers",
+                 self.serialization_seconds),
+                ('tracking_render_seconds_total', 'counter', "Time spent rendering responses", self.render_seconds),
+                ('tracking_slow_requests_total', 'counter', "Requests over SLOW_REQUEST_MS", self.slow_requests),
+            ]:
+                _family(lines, name, kind, description,
+                        {_labels(route=r, method=m): v for (r, m), v in values.items()})
+        lines.extend(component_lines())
+        return '\n'.join(lines) + '\n'
+
+
+def component_lines():
+    """Gauges and counters from the ingest buffer, caches, duplicate filter,
+    summary writer and presence tracker.
+
+    Components that were never used in this process are left out rather
+    than started just to be measured.
+    """
+    from . import buffer, presence, summary
+    from .cache import recent_events, visitor_cache, website_cache
+
+    lines = []
+    caches = defaultdict(dict)
+    for name, cache in [('website', website_cache), ('visitor', visitor_cache)]:
+        for key, value in cache.stats().items():
+            caches[key][_labels(cache=name)] = value
+    for key, samples in caches.items():
+        _family(lines, f'tracking_cache_{key}', _kind(key), None, samples)
+    for key, value in recent_events.stats().items():
+        _family(lines, f'tracking_dedupe_{key}', _kind(key), None, {'': value})
+    if buffer._buffer is not None:
+        for key, value in buffer._buffer.stats().items():
+            if value is not None:
+                _family(lines, f'tracking_buffer_{key}', _kind(key), None, {'': value})
+    if summary._writer is not None:
+        for key, value in summary._writer.stats().items():
+            _family(lines, f'tracking_summary_{key}', _kind(key), None, {'': value})
+    if presence._presence is not None:
+        for key, value in presence._presence.stats().items():
+            _family(lines, f'tracking_presence_{key}', _kind(key), None, {'': value})
+    return lines
+
+
+def _kind(key):
+    return 'counter' if key in COUNTERS else 'gauge'
+
+
+def _family(lines, name, kind, description, samples):
+    if not samples:
+        return
+    if description:
+        lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in sorted(samples.items()):
+        lines.append(f"{name}{labels} {value}")
+
+
+def _labels(**labels):
+    escaped = (
+        f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+registry = Registry()
@@ -0,0 +1,88 @@
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from . import metrics
+
+logger = logging.getLogger('activity.metrics')
+
+
+class MetricsMiddleware:
+    """Per-route latency, SQL and serialization timings for ``/api/_metrics``.
+
+    Opt-in through ``TRACKING_METRICS['ENABLED']``; when off, Django drops
+    the middleware at startup and requests pay nothing.  Requests slower
+    than ``SLOW_REQUEST_MS`` are logged with their slowest queries.
+
+    Works in sync and async stacks; queries are counted on whichever
+    thread runs them, the ingest write pool included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        options = metrics.options()
+        if not options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_seconds = options['SLOW_REQUEST_MS'] / 1000
+        self.top_queries = options['SLOW_REQUEST_TOP_QUERIES']
+        connection_created.connect(metrics.install)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.install()
+        stats = metrics.RequestStats(self.top_queries)
+        started = time.perf_counter()
+        with metrics.tracking(stats):
+            response = self.get_response(request)
+        return self.finish(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        self.install()
+        stats = metrics.RequestStats(self.top_queries)
+        started = time.perf_counter()
+        with metrics.tracking(stats):
+            response = await self.get_response(request)
+        return self.finish(request, response, stats, time.perf_counter() - started)
+
+    def install(self):
+        # Connections opened before the middleware loaded missed connection_created.
+        for connection in connections.all(initialized_only=True):
+            metrics.install(connection)
+
+    def finish(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        if route == 'api/_metrics':
+            return response
+        slow = elapsed >= self.slow_seconds
+        metrics.registry.observe(route, request.method, response.status_code, elapsed, stats, slow)
+        if slow:
+            logger.warning(
+                "Slow request %s %s: %.0f ms, %d queries in %.0f ms, serialization %.0f ms, render %.0f ms%s",
+                request.method, request.path, elapsed * 1000, stats.queries,
+                stats.query_seconds * 1000, stats.serialization_seconds * 1000, stats.render_seconds * 1000,
+                ''.join(
+                    f"\n  {seconds * 1000:.1f} ms: {sql[:500]}"
+                    for seconds, sql in sorted(stats.slowest, reverse=True)
+                ),
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns.
+        stats = metrics.current()
+        if stats is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                stats.render_seconds += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0015_alter_people_stage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpoolCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stream', models.CharField(max_length=255, unique=True)),
+                ('segment', models.PositiveBigIntegerField(default=0)),
+                ('offset', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0016_spoolcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='people',
+            name='activity_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='people',
+            name='first_seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='people',
+            name='last_activity_type',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='people',
+            name='last_page_title',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='people',
+            name='last_page_url',
+            field=models.URLField(blank=True, null=True),
+        ),
+    ]
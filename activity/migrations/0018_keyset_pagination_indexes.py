@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0017_people_activity_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['people', 'occured_at', 'id'], name='activity_ac_people__cec171_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='people',
+            index=models.Index(fields=['last_activity', 'id'], name='activity_pe_last_ac_17ed20_idx'),
+        ),
+    ]
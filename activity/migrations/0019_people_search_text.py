@@ -0,0 +1,51 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:46
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+# Names as in activity.search, written out so this migration does not
+# depend on that module.
+TRIGRAM_INDEX = 'activity_people_search_trgm'
+FTS_TABLE = 'activity_people_fts'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON activity_people '
+            f'USING gin (search_text gin_trgm_ops)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(search_text, tokenize='trigram')"
+        )
+        schema_editor.execute(f'DELETE FROM {FTS_TABLE}')
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE}(rowid, search_text) SELECT id, search_text FROM activity_people'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {TRIGRAM_INDEX}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0018_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='people',
+            name='search_text',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Lower(django.db.models.functions.text.Concat('name', models.Value(' '), 'email', models.Value(' '), 'phone')), output_field=models.TextField()),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
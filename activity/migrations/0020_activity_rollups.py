@@ -0,0 +1,52 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0019_people_search_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('bucket', models.DateTimeField()),
+                ('page_url', models.URLField(blank=True, default='')),
+                ('activity_type', models.CharField(blank=True, default='', max_length=50)),
+                ('events', models.PositiveIntegerField(default=0)),
+                ('unique_visitors', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_activity_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['website', 'occured_at'], name='activity_ac_website_a52490_idx'),
+        ),
+        migrations.AddField(
+            model_name='activityrollup',
+            name='website',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='activity.website'),
+        ),
+        migrations.AddIndex(
+            model_name='activityrollup',
+            index=models.Index(fields=['website', 'granularity', 'bucket'], name='activity_ac_website_129484_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='activityrollup',
+            constraint=models.UniqueConstraint(fields=('website', 'granularity', 'bucket', 'page_url', 'activity_type'), name='unique_activity_rollup'),
+        ),
+    ]
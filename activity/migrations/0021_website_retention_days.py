@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:54
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0020_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='website',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Days of raw activity to keep; older rows are archived. Empty keeps everything.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='occured_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
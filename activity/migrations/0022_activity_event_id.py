@@ -0,0 +1,22 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0021_website_retention_days'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='event_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='activity',
+            constraint=models.UniqueConstraint(condition=models.Q(('event_id__isnull', False)), fields=('website', 'event_id'), name='unique_activity_event_id'),
+        ),
+    ]
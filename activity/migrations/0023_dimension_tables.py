@@ -0,0 +1,66 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0022_activity_event_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Language',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=10, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScreenResolution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=50, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.TextField()),
+                ('digest', models.CharField(max_length=40, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='user_agent_dim',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='activity.useragent'),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='language_dim',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='activity.language'),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='screen_resolution_dim',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='activity.screenresolution'),
+        ),
+        migrations.AddField(
+            model_name='people',
+            name='user_agent_dim',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='activity.useragent'),
+        ),
+        migrations.AddField(
+            model_name='people',
+            name='language_dim',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='activity.language'),
+        ),
+        migrations.AddField(
+            model_name='people',
+            name='screen_resolution_dim',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='activity.screenresolution'),
+        ),
+    ]
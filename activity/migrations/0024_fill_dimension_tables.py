@@ -0,0 +1,80 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:40
+
+import hashlib
+from collections import defaultdict
+from django.db import migrations, transaction
+
+# Rows rewritten per transaction. Each chunk commits on its own so locks
+# stay short; rewriting is idempotent, so an interrupted run is re-run.
+CHUNK_SIZE = 5000
+FIELDS = [('user_agent', 'UserAgent'), ('language', 'Language'), ('screen_resolution', 'ScreenResolution')]
+
+
+def intern(model, values):
+    """Map each value to its dimension row id, inserting the missing ones."""
+    values = {value for value in values if value}
+    if not values:
+        return {}
+    if model.__name__ == 'UserAgent':
+        keyed = {hashlib.sha1(value.encode('utf-8')).hexdigest(): value for value in values}
+        field = 'digest'
+    else:
+        keyed = {value: value for value in values}
+        field = 'value'
+    model.objects.bulk_create(
+        [model(**{'value': value, field: key}) for key, value in keyed.items()], ignore_conflicts=True
+    )
+    rows = model.objects.filter(**{f'{field}__in': list(keyed)}).values_list(field, 'pk')
+    return {keyed[key]: pk for key, pk in rows}
+
+
+def rewrite(model, read, write, convert):
+    """Copy ``read`` columns to ``write`` columns chunk by chunk, through ``convert``."""
+    last = 0
+    while True:
+        with transaction.atomic():
+            rows = list(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', *read)[:CHUNK_SIZE])
+            if not rows:
+                return
+            converted = [convert(index, {row[index + 1] for row in rows}) for index in range(len(read))]
+            groups = defaultdict(list)
+            for pk, *values in rows:
+                groups[tuple(mapping.get(value) for mapping, value in zip(converted, values))].append(pk)
+            for values, pks in groups.items():
+                if any(value is not None for value in values):
+                    model.objects.filter(pk__in=pks).update(**dict(zip(write, values)))
+            last = rows[-1][0]
+
+
+def encode(apps, schema_editor):
+    dimensions = [apps.get_model('activity', dimension) for name, dimension in FIELDS]
+    for model_name in ['Activity', 'People']:
+        rewrite(
+            apps.get_model('activity', model_name),
+            read=[name for name, dimension in FIELDS],
+            write=[f'{name}_dim_id' for name, dimension in FIELDS],
+            convert=lambda index, values: intern(dimensions[index], values),
+        )
+
+
+def decode(apps, schema_editor):
+    dimensions = [apps.get_model('activity', dimension) for name, dimension in FIELDS]
+    for model_name in ['Activity', 'People']:
+        rewrite(
+            apps.get_model('activity', model_name),
+            read=[f'{name}_dim_id' for name, dimension in FIELDS],
+            write=[name for name, dimension in FIELDS],
+            convert=lambda index, ids: dict(dimensions[index].objects.filter(pk__in=ids).values_list('pk', 'value')),
+        )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('activity', '0023_dimension_tables'),
+    ]
+
+    operations = [
+        migrations.RunPython(encode, decode),
+    ]
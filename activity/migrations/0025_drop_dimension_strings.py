@@ -0,0 +1,67 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0024_fill_dimension_tables'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='activity',
+            name='user_agent',
+        ),
+        migrations.RemoveField(
+            model_name='activity',
+            name='language',
+        ),
+        migrations.RemoveField(
+            model_name='activity',
+            name='screen_resolution',
+        ),
+        migrations.RemoveField(
+            model_name='people',
+            name='user_agent',
+        ),
+        migrations.RemoveField(
+            model_name='people',
+            name='language',
+        ),
+        migrations.RemoveField(
+            model_name='people',
+            name='screen_resolution',
+        ),
+        migrations.RenameField(
+            model_name='activity',
+            old_name='user_agent_dim',
+            new_name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='activity',
+            old_name='language_dim',
+            new_name='language',
+        ),
+        migrations.RenameField(
+            model_name='activity',
+            old_name='screen_resolution_dim',
+            new_name='screen_resolution',
+        ),
+        migrations.RenameField(
+            model_name='people',
+            old_name='user_agent_dim',
+            new_name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='people',
+            old_name='language_dim',
+            new_name='language',
+        ),
+        migrations.RenameField(
+            model_name='people',
+            old_name='screen_resolution_dim',
+            new_name='screen_resolution',
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0025_drop_dimension_strings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferrerHost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Page',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField()),
+                ('digest', models.CharField(max_length=40)),
+                ('title', models.CharField(blank=True, max_length=255, null=True)),
+                ('website', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='activity.website')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('website', 'digest'), name='unique_page_digest')],
+            },
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='page',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.RESTRICT, to='activity.page'),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='referrer_host',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='activity.referrerhost'),
+        ),
+        migrations.AlterField(
+            model_name='people',
+            name='last_page_url',
+            field=models.URLField(blank=True, max_length=2000, null=True),
+        ),
+    ]
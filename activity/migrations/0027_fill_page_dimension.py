@@ -0,0 +1,162 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:05
+
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from django.db import migrations, transaction
+
+# Rows rewritten per transaction, as in 0024_fill_dimension_tables.
+CHUNK_SIZE = 5000
+
+# Copied from activity.dimensions as it stood, so that later changes there
+# cannot change what this migration writes.
+TRACKING_PARAMS = {'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga', '_gl'}
+TRACKING_PARAM_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+MAX_URL_LENGTH = 2000
+MAX_HOST_LENGTH = 255
+
+
+def truncate(value, length):
+    return value.encode('utf-8')[:length].decode('utf-8', 'ignore')
+
+
+def host_of(parts):
+    host = (parts.hostname or '').rstrip('.')
+    return host[4:] if host.startswith('www.') else host
+
+
+def canonical_url(url):
+    if not url:
+        return None
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return truncate(url, MAX_URL_LENGTH)
+    scheme = parts.scheme.lower()
+    host = host_of(parts)
+    if scheme not in DEFAULT_PORTS or not host:
+        return truncate(url, MAX_URL_LENGTH)
+    if ':' in host:
+        host = f'[{host}]'
+    if port and port != DEFAULT_PORTS[scheme]:
+        host = f'{host}:{port}'
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PARAM_PREFIXES)
+    ))
+    return truncate(urlunsplit((scheme, host, parts.path or '/', query, '')), MAX_URL_LENGTH)
+
+
+def referrer_host(url):
+    if not url:
+        return None
+    try:
+        host = host_of(urlsplit(url.strip()))
+    except ValueError:
+        return None
+    return truncate(host, MAX_HOST_LENGTH) or None
+
+
+def digest(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def intern_pages(Page, entries):
+    """Map ``(website id, raw URL)`` to Page ids; the latest title in ``entries`` wins."""
+    canonical = {}
+    titles = {}
+    for website_id, url, title in entries:
+        page = (website_id, canonical_url(url))
+        if page[1] is None:
+            continue
+        canonical[website_id, url] = page
+        if title or page not in titles:
+            titles[page] = title or titles.get(page)
+    Page.objects.bulk_create(
+        [Page(website_id=website_id, url=url, digest=digest(url), title=title) for (website_id, url), title in titles.items()],
+        ignore_conflicts=True,
+    )
+    keyed = {(website_id, digest(url)): (website_id, url) for website_id, url in titles}
+    ids = {}
+    rows = Page.objects.filter(digest__in={key for website_id, key in keyed}).values_list('website_id', 'digest', 'pk', 'title')
+    for website_id, key, pk, title in rows:
+        page = keyed.get((website_id, key))
+        if page is None:
+            continue
+        ids[page] = pk
+        if titles[page] and title != titles[page]:
+            Page.objects.filter(pk=pk).update(title=titles[page])
+    return {key: ids[page] for key, page in canonical.items() if page in ids}
+
+
+def intern_hosts(ReferrerHost, urls):
+    hosts = {url: referrer_host(url) for url in urls}
+    ReferrerHost.objects.bulk_create(
+        [ReferrerHost(value=host) for host in set(hosts.values()) if host], ignore_conflicts=True
+    )
+    ids = dict(ReferrerHost.objects.filter(value__in=set(hosts.values())).values_list('value', 'pk'))
+    return {url: ids.get(host) for url, host in hosts.items()}
+
+
+def chunks(Activity, *fields):
+    last = 0
+    while True:
+        with transaction.atomic():
+            rows = list(Activity.objects.filter(pk__gt=last).order_by('pk').values_list('pk', *fields)[:CHUNK_SIZE])
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][0]
+
+
+def encode(apps, schema_editor):
+    Activity = apps.get_model('activity', 'Activity')
+    Page = apps.get_model('activity', 'Page')
+    ReferrerHost = apps.get_model('activity', 'ReferrerHost')
+    # Oldest first, so the latest title ends up on each page.
+    for rows in chunks(Activity, 'website_id', 'page_url', 'page_title', 'page_referrer'):
+        pages = intern_pages(Page, [(website_id, url, title) for pk, website_id, url, title, referrer in rows])
+        hosts = intern_hosts(ReferrerHost, {referrer for *_, referrer in rows if referrer})
+        groups = {}
+        for pk, website_id, url, title, referrer in rows:
+            key = (pages.get((website_id, url)), hosts.get(referrer))
+            groups.setdefault(key, []).append(pk)
+        for (page_id, host_id), pks in groups.items():
+            if page_id is not None or host_id is not None:
+                Activity.objects.filter(pk__in=pks).update(page_id=page_id, referrer_host_id=host_id)
+
+
+def decode(apps, schema_editor):
+    Activity = apps.get_model('activity', 'Activity')
+    Page = apps.get_model('activity', 'Page')
+    ReferrerHost = apps.get_model('activity', 'ReferrerHost')
+    # Only the canonical URL, latest title and referrer host are left.
+    for rows in chunks(Activity, 'page_id', 'referrer_host_id'):
+        pages = Page.objects.in_bulk({page_id for pk, page_id, host_id in rows if page_id})
+        hosts = ReferrerHost.objects.in_bulk({host_id for pk, page_id, host_id in rows if host_id})
+        groups = {}
+        for pk, page_id, host_id in rows:
+            groups.setdefault((page_id, host_id), []).append(pk)
+        for (page_id, host_id), pks in groups.items():
+            page = pages.get(page_id)
+            host = hosts.get(host_id)
+            if page is not None or host is not None:
+                Activity.objects.filter(pk__in=pks).update(
+                    page_url=page.url if page else None,
+                    page_title=page.title if page else None,
+                    page_referrer=f'https://{host.value}/' if host else None,
+                )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('activity', '0026_page_dimension'),
+    ]
+
+    operations = [
+        migrations.RunPython(encode, decode),
+    ]
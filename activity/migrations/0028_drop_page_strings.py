@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0027_fill_page_dimension'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='activity',
+            name='page_title',
+        ),
+        migrations.RemoveField(
+            model_name='activity',
+            name='page_url',
+        ),
+        migrations.RemoveField(
+            model_name='activity',
+            name='page_referrer',
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['website', 'page', 'occured_at'], name='activity_ac_website_1ccd17_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0028_drop_page_strings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='people',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='activity.people'),
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='website',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='activity.website'),
+        ),
+    ]
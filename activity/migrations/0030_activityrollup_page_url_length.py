@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0029_activity_drop_fk_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activityrollup',
+            name='page_url',
+            field=models.URLField(blank=True, default='', max_length=2000),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0030_activityrollup_page_url_length'),
+    ]
+
+    # Added without a default first so existing rows stay null rather
+    # than all being stamped with the time of the migration.
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='inserted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='inserted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, null=True),
+        ),
+    ]
@@ -1,6 +1,10 @@
 from django.db import models
+from django.db.models.functions import Concat, Lower
+import hashlib
 import uuid
 from django.conf import settings
+from django.utils import timezone
+from .tracker import loader
 
 class Website(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -8,6 +12,10 @@ class Website(models.Model):
     site_id = models.CharField(max_length=100, unique=True, default=uuid.uuid4)
     tracking_code = models.TextField(blank=True, null=True)
     domain = models.CharField(max_length=255)
+    retention_days = models.PositiveIntegerField(
+        blank=True, null=True,
+        help_text="Days of raw activity to keep; older rows are archived. Empty keeps everything.",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -17,101 +25,12 @@ class Website(models.Model):
         super().save(*args, **kwargs)
 
     def generate_tracking_code(self):
-        return f"""
-        <script>
-        (function() {{
-            const TRACKING_URL = '{settings.SITE_URL}/api/track/';
-            const SITE_ID = '{self.site_id}';
-            let visitorId = localStorage.getItem('visitorId');
-
-            // Only track if we have a visitor ID from a previous form submission
-            function shouldTrack() {{
-                return !!localStorage.getItem('visitorId');
-            }}
-
-            function track(eventType, data) {{
-                // Don't track if we don't have a visitor ID
-                if (!shouldTrack()) return;
-
-                const commonData = {{
-                    visitor_id: visitorId,
-                    user_agent: navigator.userAgent,
-                    language: navigator.language,
-                    screen_resolution: `${{window.screen.width}}x${{window.screen.height}}`,
-                }};
-
-                fetch(TRACKING_URL, {{
-                    method: 'POST',
-                    headers: {{'Content-Type': 'application/json'}},
-                    body: JSON.stringify({{
-                        site_id: SITE_ID,
-                        event_type: eventType,
-                        ...commonData,
-                        ...data
-                    }})
-                }});
-            }}
-
-            // Track page views for identified users
-            function trackPageView() {{
-                if (shouldTrack()) {{
-                    track('Viewed Page', {{
-                        page_title: document.title,
-                        page_url: window.location.href,
-                        page_referrer: document.referrer || null
-                    }});
-                }}
-            }}
-
-            // Track initial page load
-            trackPageView();
-
-            // Track page views on route changes (for SPAs)
-            let lastUrl = window.location.href;
-            
-            // Create a new MutationObserver instance
-            const observer = new MutationObserver(function(mutations) {{
-                if (window.location.href !== lastUrl) {{
-                    lastUrl = window.location.href;
-                    // Wait for title to be updated
-                    setTimeout(trackPageView, 100);
-                }}
-            }});
-
-            // Start observing the document with the configured parameters
-            observer.observe(document, {{ subtree: true, childList: true }});
-
-            // Track form submissions
-            document.addEventListener('submit', function(e) {{
-                const form = e.target;
-                const formData = new FormData(form);
-                const data = {{}};
-                let hasEmail = false;
-                
-                // Capture all form fields
-                formData.forEach((value, key) => {{
-                    data[key] = value;
-                    // If the field is email, set up visitor tracking
-                    if (key === 'email') {{
-                        hasEmail = true;
-                        localStorage.setItem('visitorId', btoa(value));
-                        visitorId = btoa(value);
-                    }}
-                }});
-                
-                // Only track form submission if it contains an email
-                if (hasEmail) {{
-                    track('Form Submission', {{
-                        form_data: data,
-                        form_id: form.id || 'unknown',
-                        page_url: window.location.href,
-                        page_referrer: document.referrer || null
-                    }});
-                }}
-            }});
-        }})();
-        </script>
+        """A loader tag for the shared, versioned tracker script.
+
+        Re-run ``manage.py regenerate_tracking_code`` after changing the
+        tracker so existing snippets point at the new version.
         """
+        return loader(self.site_id)
 
     def __str__(self):
         if not self.name and not self.domain:
@@ -123,6 +42,79 @@ class Website(models.Model):
         verbose_name_plural = "Websites"
 
 
+class UserAgent(models.Model):
+    """A distinct User-Agent string, shared by every row that sent it.
+
+    Looked up by ``digest`` because User-Agent strings can be longer than a
+    btree index entry allows.
+    """
+    value = models.TextField()
+    digest = models.CharField(max_length=40, unique=True)
+
+    @staticmethod
+    def digest_of(value):
+        return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.digest = self.digest_of(self.value)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.value
+
+
+class Language(models.Model):
+    """A distinct browser language, e.g. ``en-CA``."""
+    value = models.CharField(max_length=10, unique=True)
+
+    def __str__(self):
+        return self.value
+
+
+class ScreenResolution(models.Model):
+    """A distinct screen size, e.g. ``1920x1080``."""
+    value = models.CharField(max_length=50, unique=True)
+
+    def __str__(self):
+        return self.value
+
+
+class ReferrerHost(models.Model):
+    """A distinct referring host, e.g. ``google.com``."""
+    value = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.value
+
+
+class Page(models.Model):
+    """A distinct page of a website, by canonical URL.
+
+    ``title`` is the latest title seen for the page.  Looked up by
+    ``digest`` because URLs can be longer than a btree index entry allows.
+    """
+    website = models.ForeignKey(Website, on_delete=models.CASCADE, related_name='pages')
+    url = models.TextField()
+    digest = models.CharField(max_length=40)
+    title = models.CharField(max_length=255, blank=True, null=True)
+
+    @staticmethod
+    def digest_of(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.digest = self.digest_of(self.url)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.url
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["website", "digest"], name="unique_page_digest"),
+        ]
+
+
 class Tag(models.Model):
     name = models.CharField(max_length=100)
 
@@ -154,9 +146,31 @@ class People(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     visitor_id = models.CharField(max_length=255, blank=True, null=True)
-    user_agent = models.TextField(blank=True, null=True)
-    language = models.CharField(max_length=10, blank=True, null=True)
-    screen_resolution = models.CharField(max_length=50, blank=True, null=True)
+    # Dictionary-encoded: each distinct string is stored once in its own
+    # table. Nothing filters on these, so they go unindexed.
+    user_agent = models.ForeignKey(
+        UserAgent, on_delete=models.PROTECT, blank=True, null=True, related_name='+', db_index=False
+    )
+    language = models.ForeignKey(
+        Language, on_delete=models.PROTECT, blank=True, null=True, related_name='+', db_index=False
+    )
+    screen_resolution = models.ForeignKey(
+        ScreenResolution, on_delete=models.PROTECT, blank=True, null=True, related_name='+', db_index=False
+    )
+    # Activity summary, maintained by the ingest path and rebuilt by
+    # `manage.py rebuild_people_summary`.
+    activity_count = models.PositiveIntegerField(default=0)
+    first_seen_at = models.DateTimeField(blank=True, null=True)
+    last_activity_type = models.CharField(max_length=50, blank=True, null=True)
+    last_page_title = models.CharField(max_length=255, blank=True, null=True)
+    last_page_url = models.URLField(blank=True, null=True, max_length=2000)
+    # Lower-cased name/email/phone, indexed for substring search by
+    # activity.search (pg_trgm on Postgres, an FTS5 mirror on SQLite).
+    search_text = models.GeneratedField(
+        expression=Lower(Concat("name", models.Value(" "), "email", models.Value(" "), "phone")),
+        output_field=models.TextField(),
+        db_persist=True,
+    )
 
     def __str__(self):
         return self.name
@@ -165,6 +179,7 @@ class People(models.Model):
         indexes = [
             models.Index(fields=["visitor_id"]),
             models.Index(fields=["email"]),
+            models.Index(fields=["last_activity", "id"]),
         ]
 
 
@@ -175,20 +190,37 @@ class Activity(models.Model):
         ("Inquiry", "Inquiry"),
     ]
 
-    website = models.ForeignKey(Website, on_delete=models.CASCADE)
-    people = models.ForeignKey(People, on_delete=models.CASCADE, null=True, blank=True)
+    # Indexed by the composite indexes below, which lead with these; a
+    # single-column index next to them only tempts the planner away.
+    website = models.ForeignKey(Website, on_delete=models.CASCADE, db_index=False)
+    people = models.ForeignKey(People, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
     activity_type = models.CharField(max_length=50)
     message = models.TextField(blank=True, null=True)
-    page_title = models.CharField(max_length=255, blank=True, null=True)
-    page_url = models.URLField(blank=True, null=True)
-    page_referrer = models.URLField(blank=True, null=True, max_length=2000)
+    # Canonical URL and latest title; indexed with the website below.
+    page = models.ForeignKey(Page, on_delete=models.RESTRICT, blank=True, null=True, db_index=False)
     form_data = models.JSONField(blank=True, null=True)
     metadata = models.JSONField(blank=True, null=True)
-    occured_at = models.DateTimeField(auto_now_add=True)
+    occured_at = models.DateTimeField(default=timezone.now, editable=False)
+    # When the row was stored, which imports cannot backdate; the rollup
+    # watermark waits on it. Null for rows stored before it was added.
+    inserted_at = models.DateTimeField(default=timezone.now, null=True, editable=False)
     visitor_id = models.CharField(max_length=255, blank=True, null=True)
-    user_agent = models.TextField(blank=True, null=True)
-    language = models.CharField(max_length=10, blank=True, null=True)
-    screen_resolution = models.CharField(max_length=50, blank=True, null=True)
+    # Dictionary-encoded: each distinct string is stored once in its own
+    # table. Nothing filters on these, so they go unindexed.
+    user_agent = models.ForeignKey(
+        UserAgent, on_delete=models.PROTECT, blank=True, null=True, related_name='+', db_index=False
+    )
+    language = models.ForeignKey(
+        Language, on_delete=models.PROTECT, blank=True, null=True, related_name='+', db_index=False
+    )
+    screen_resolution = models.ForeignKey(
+        ScreenResolution, on_delete=models.PROTECT, blank=True, null=True, related_name='+', db_index=False
+    )
+    referrer_host = models.ForeignKey(
+        ReferrerHost, on_delete=models.PROTECT, blank=True, null=True, related_name='+', db_index=False
+    )
+    # Client-generated id that makes retried or repeated events idempotent.
+    event_id = models.CharField(max_length=64, blank=True, null=True)
 
     def __str__(self):
         website_name = self.website.name or self.website.domain if self.website else "Unknown Website"
@@ -200,9 +232,82 @@ class Activity(models.Model):
         indexes = [
             models.Index(fields=["visitor_id"]),
             models.Index(fields=["occured_at"]),
+            models.Index(fields=["people", "occured_at", "id"]),
+            models.Index(fields=["website", "occured_at"]),
+            models.Index(fields=["website", "page", "occured_at"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["website", "event_id"],
+                condition=models.Q(event_id__isnull=False),
+                name="unique_activity_event_id",
+            ),
         ]
         verbose_name_plural = "Activities"
 
     @property
     def is_anonymous(self):
         return self.people is None
+
+
+class SpoolCheckpoint(models.Model):
+    """How far ``drain_spool`` has replayed one spool stream.
+
+    Updated in the same transaction as the rows it replays, so a crash
+    between the two can neither lose nor duplicate events.
+    """
+    stream = models.CharField(max_length=255, unique=True)
+    segment = models.PositiveBigIntegerField(default=0)
+    offset = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.stream} @ {self.segment}:{self.offset}"
+
+
+class ActivityRollup(models.Model):
+    """Pre-aggregated activity per website, time bucket, page and type.
+
+    Rows with an empty ``activity_type`` (``ALL``) hold the totals for the
+    whole website in that bucket, which is the only place unique visitors
+    can be read for the site as a whole. Maintained by
+    `manage.py rollup_activity`.
+    """
+    GRANULARITY_CHOICES = [
+        ("hour", "Hour"),
+        ("day", "Day"),
+    ]
+    ALL = ""
+
+    website = models.ForeignKey(Website, on_delete=models.CASCADE)
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    # As long as a canonical URL can be, see dimensions.MAX_URL_LENGTH.
+    page_url = models.URLField(blank=True, default="", max_length=2000)
+    activity_type = models.CharField(max_length=50, blank=True, default="")
+    events = models.PositiveIntegerField(default=0)
+    unique_visitors = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.website_id} {self.granularity} {self.bucket:%Y-%m-%d %H:%M} {self.activity_type or 'all'}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["website", "granularity", "bucket", "page_url", "activity_type"],
+                name="unique_activity_rollup",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["website", "granularity", "bucket"]),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """Highest Activity id already folded into the rollups."""
+    name = models.CharField(max_length=100, unique=True)
+    last_activity_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_activity_id}"
@@ -0,0 +1,137 @@
+import base64
+import json
+from django.db import connection, models
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CustomPagination(PageNumberPagination):
+    page_size = 30
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+    """Newest-first cursor pagination on ``(ordering_field, id)``.
+
+    The cursor carries the exact ``(value, id)`` of the last row served, so
+    every page is a single index range scan however deep it is and rows
+    sharing a timestamp are never skipped or repeated.  NULLs in
+    ``ordering_field`` are placed wherever the database puts them for a
+    descending sort, which keeps the plain ``(ordering_field, id)`` index
+    usable on every backend.
+    """
+    ordering_field = None
+    cursor_query_param = 'cursor'
+    page_size = 30
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(f'-{self.ordering_field}', '-id')
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(*position))
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = (getattr(rows[-1], self.ordering_field), rows[-1].pk) if self.has_next else None
+        return rows
+
+    def after(self, value, pk):
+        field = self.ordering_field
+        same_value_older_id = models.Q(**{field: value, 'id__lt': pk})
+        if value is None:
+            same_value_older_id = models.Q(**{f'{field}__isnull': True, 'id__lt': pk})
+            if connection.features.nulls_order_largest:
+                return same_value_older_id | models.Q(**{f'{field}__isnull': False})
+            return same_value_older_id
+        condition = models.Q(**{f'{field}__lt': value}) | same_value_older_id
+        if not connection.features.nulls_order_largest:
+            condition |= models.Q(**{f'{field}__isnull': True})
+        return condition
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if value is not None:
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError(value)
+            return value, int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        value, pk = position
+        if value is not None:
+            value = value.isoformat()
+        return base64.urlsafe_b64encode(json.dumps([value, pk]).encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class PeopleKeysetPagination(KeysetPagination):
+    ordering_field = 'last_activity'
+
+
+class ActivityKeysetPagination(KeysetPagination):
+    ordering_field = 'occured_at'
+    page_size = 100
+    max_page_size = 500
+
+
+class PeopleListPagination(CustomPagination):
+    """Page numbers by default, keyset pages once ``cursor`` is in the query.
+
+    Pass an empty ``cursor`` for the first keyset page.  Keyset pages are
+    always ordered by ``-last_activity, -id`` and ignore ``ordering``.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if PeopleKeysetPagination.cursor_query_param in request.query_params:
+            self.keyset = PeopleKeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
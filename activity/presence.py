@@ -0,0 +1,185 @@
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Activity
+
+
+class InProcessPresence:
+    """Sliding-window record of who was seen in the last ``window`` seconds.
+
+    Lives in this process's memory, so it only sees events ingested by the
+    same process.  Fine for a single worker and for tests; deployments with
+    several workers should use ``DatabasePresence`` or ``RedisPresence``.
+    """
+
+    def __init__(self, window=300, **options):
+        self.window = window
+        self._lock = threading.Lock()
+        self._last_seen = {}
+        self._by_website = {}
+        self._next_prune = 0.0
+
+    def mark_seen(self, website_id, person_id, at=None):
+        """Record a sighting; returns True when the person just came online."""
+        at = time.time() if at is None else at
+        with self._lock:
+            previous = self._last_seen.get(person_id)
+            if previous is None or at > previous:
+                self._last_seen[person_id] = at
+            website = self._by_website.setdefault(website_id, {})
+            if at > website.get(person_id, 0):
+                website[person_id] = at
+            if at >= self._next_prune:
+                self._prune(at - self.window)
+                self._next_prune = at + self.window
+        return previous is None or previous < at - self.window
+
+    def is_online(self, person_id):
+        last_seen = self._last_seen.get(person_id)
+        return last_seen is not None and last_seen >= time.time() - self.window
+
+    def online_among(self, person_ids):
+        cutoff = time.time() - self.window
+        last_seen = self._last_seen
+        return {pk for pk in person_ids if last_seen.get(pk, 0) >= cutoff}
+
+    def online_for_website(self, website_id):
+        """Person ids seen on ``website_id`` inside the window, latest first."""
+        cutoff = time.time() - self.window
+        with self._lock:
+            seen = list(self._by_website.get(website_id, {}).items())
+        seen = [(at, pk) for pk, at in seen if at >= cutoff]
+        return [pk for at, pk in sorted(seen, reverse=True)]
+
+    def stats(self):
+        with self._lock:
+            return {'tracked_people': len(self._last_seen), 'tracked_websites': len(self._by_website)}
+
+    def clear(self):
+        with self._lock:
+            self._last_seen.clear()
+            self._by_website.clear()
+
+    def _prune(self, cutoff):
+        self._last_seen = {pk: at for pk, at in self._last_seen.items() if at >= cutoff}
+        for website_id, seen in list(self._by_website.items()):
+            seen = {pk: at for pk, at in seen.items() if at >= cutoff}
+            if seen:
+                self._by_website[website_id] = seen
+            else:
+                del self._by_website[website_id]
+
+
+class DatabasePresence(InProcessPresence):
+    """Presence read from the stored activities, so every worker agrees.
+
+    Answers with one indexed query per call instead of from memory, and
+    sees events as soon as they are committed by any process, ``drain_spool``
+    included.  Sightings are still kept in memory, but only to tell who just
+    came online for the live feed.
+    """
+
+    def _recent(self):
+        return Activity.objects.filter(occured_at__gte=timezone.now() - timedelta(seconds=self.window))
+
+    def is_online(self, person_id):
+        return bool(self.online_among([person_id]))
+
+    def online_among(self, person_ids):
+        person_ids = list(person_ids)
+        if not person_ids:
+            return set()
+        return set(self._recent().filter(people_id__in=person_ids).values_list('people_id', flat=True).distinct())
+
+    def online_for_website(self, website_id):
+        rows = (
+            self._recent().filter(website_id=website_id).order_by()
+            .values('people_id').annotate(last_seen=models.Max('occured_at')).order_by('-last_seen')
+        )
+        return [row['people_id'] for row in rows]
+
+
+class RedisPresence:
+    """Presence shared by every worker through Redis sorted sets.
+
+    One set scores every person by last sighting, one set per website does
+    the same for that site; entries older than the window are trimmed on
+    write.
+    """
+
+    def __init__(self, window=300, url='redis://localhost:6379/0', prefix='presence', **options):
+        import redis
+
+        self.window = window
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _people_key(self):
+        return f'{self.prefix}:people'
+
+    def _website_key(self, website_id):
+        return f'{self.prefix}:website:{website_id}'
+
+    def mark_seen(self, website_id, person_id, at=None):
+        at = time.time() if at is None else at
+        cutoff = at - self.window
+        pipe = self.redis.pipeline()
+        pipe.zscore(self._people_key(), person_id)
+        pipe.zadd(self._people_key(), {person_id: at}, gt=True)
+        pipe.zadd(self._website_key(website_id), {person_id: at}, gt=True)
+        pipe.zremrangebyscore(self._people_key(), '-inf', f'({cutoff}')
+        pipe.zremrangebyscore(self._website_key(website_id), '-inf', f'({cutoff}')
+        previous = pipe.execute()[0]
+        return previous is None or previous < cutoff
+
+    def is_online(self, person_id):
+        return bool(self.online_among([person_id]))
+
+    def online_among(self, person_ids):
+        person_ids = list(person_ids)
+        if not person_ids:
+            return set()
+        cutoff = time.time() - self.window
+        scores = self.redis.zmscore(self._people_key(), person_ids)
+        return {pk for pk, score in zip(person_ids, scores) if score is not None and score >= cutoff}
+
+    def online_for_website(self, website_id):
+        members = self.redis.zrevrangebyscore(self._website_key(website_id), '+inf', time.time() - self.window)
+        return [int(member) for member in members]
+
+    def stats(self):
+        return {'tracked_people': self.redis.zcard(self._people_key())}
+
+    def clear(self):
+        keys = list(self.redis.scan_iter(f'{self.prefix}:*'))
+        if keys:
+            self.redis.delete(*keys)
+
+
+_presence = None
+_presence_lock = threading.Lock()
+
+
+def get_presence():
+    """Return the backend configured by ``TRACKING_PRESENCE``.
+
+    ``InProcessPresence`` is refused in spool mode, where events are stored
+    by ``drain_spool`` and the web workers would never see anyone online.
+    """
+    global _presence
+    with _presence_lock:
+        if _presence is None:
+            options = getattr(settings, 'TRACKING_PRESENCE', {})
+            backend = import_string(options.get('BACKEND', 'activity.presence.DatabasePresence'))
+            if backend is InProcessPresence and getattr(settings, 'TRACKING_INGEST_MODE', 'sync') == 'spool':
+                raise ImproperlyConfigured(
+                    "InProcessPresence cannot see events stored by drain_spool; "
+                    "use DatabasePresence or RedisPresence with TRACKING_INGEST_MODE 'spool'"
+                )
+            _presence = backend(window=options.get('WINDOW_SECONDS', 300), **options.get('OPTIONS', {}))
+        return _presence
@@ -0,0 +1,259 @@
+from datetime import timedelta
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, TruncDay, TruncHour
+from django.utils import timezone
+from .models import Activity, ActivityRollup, Page, RollupWatermark, Website
+
+WATERMARK = 'activity_rollup'
+GRANULARITIES = {
+    'hour': (TruncHour, timedelta(hours=1)),
+    'day': (TruncDay, timedelta(days=1)),
+}
+
+
+def upper_bound(after_id, grace):
+    """Highest activity id after ``after_id`` that is safe to fold in, or None.
+
+    Ids are handed out in insertion order but committed in any order, so a
+    lower id can become visible after a higher one.  Only rows stored at
+    least ``grace`` ago count, which leaves transactions shorter than that
+    time to commit.  ``inserted_at`` rather than ``occured_at``: imports
+    backdate the latter.  Rows from before ``inserted_at`` existed have none.
+    """
+    cutoff = timezone.now() - grace
+    return Activity.objects.filter(
+        models.Q(inserted_at__lte=cutoff) | models.Q(inserted_at__isnull=True), id__gt=after_id,
+    ).aggregate(upper=models.Max('id'))['upper']
+
+
+def affected_buckets(after_id, up_to_id):
+    """``(website_id, granularity, bucket)`` for activities in ``(after_id, up_to_id]``."""
+    activities = Activity.objects.filter(id__gt=after_id, id__lte=up_to_id).order_by()
+    buckets = set()
+    for granularity, (trunc, width) in GRANULARITIES.items():
+        rows = activities.annotate(bucket=trunc('occured_at')).values_list('website_id', 'bucket').distinct()
+        buckets.update((website_id, granularity, bucket) for website_id, bucket in rows)
+    return buckets
+
+
+def retention_cutoffs(now=None):
+    """Map each website with a retention to the time before which its rows may be archived."""
+    now = now or timezone.now()
+    return {
+        website_id: now - timedelta(days=days)
+        for website_id, days in Website.objects.filter(retention_days__isnull=False).values_list('id', 'retention_days')
+    }
+
+
+def chunk_deltas(after_id, up_to_id):
+    """What the activities in ``(after_id, up_to_id]`` add to the rollups.
+
+    Maps ``(website_id, granularity, bucket, page_url, activity_type)`` to
+    ``[events, unique_visitors]``.  A person adds a unique visitor only when
+    none of their activities already folded in (ids up to ``after_id``)
+    shares the bucket, and the page and type for the per-page rows.  Once
+    those activities are archived that can no longer be told, and a person
+    returning to an archived bucket is counted again.
+    """
+    chunk = Activity.objects.filter(id__gt=after_id, id__lte=up_to_id).order_by()
+    fields = ('website_id', 'bucket', 'page_id', 'activity_type', 'people_id')
+    deltas = {}
+    page_ids = set()
+    for granularity, (trunc, width) in GRANULARITIES.items():
+        rows = list(chunk.annotate(bucket=trunc('occured_at')).values_list(*fields).annotate(events=models.Count('id')))
+        if not rows:
+            continue
+        people = {row[4] for row in rows if row[4] is not None}
+        buckets = [row[1] for row in rows]
+        seen = set(
+            Activity.objects.filter(
+                id__lte=after_id, people_id__in=people,
+                occured_at__gte=min(buckets), occured_at__lt=max(buckets) + width,
+            ).order_by().annotate(bucket=trunc('occured_at')).values_list(*fields).distinct()
+        )
+        seen_site = {(website_id, bucket, person) for website_id, bucket, page, type_, person in seen}
+        counted_site = set()
+        for website_id, bucket, page_id, activity_type, person, events in rows:
+            page_ids.add(page_id)
+            new_visitor = person is not None and (website_id, bucket, page_id, activity_type, person) not in seen
+            delta = deltas.setdefault((website_id, granularity, bucket, page_id, activity_type), [0, 0])
+            delta[0] += events
+            delta[1] += new_visitor
+            site = (website_id, bucket, person)
+            new_visitor = person is not None and site not in seen_site and site not in counted_site
+            counted_site.add(site)
+            delta = deltas.setdefault((website_id, granularity, bucket, None, ActivityRollup.ALL), [0, 0])
+            delta[0] += events
+            delta[1] += new_visitor
+    urls = dict(Page.objects.filter(pk__in=page_ids - {None}).values_list('pk', 'url'))
+    return {
+        (website_id, granularity, bucket, urls.get(page_id, ''), activity_type): delta
+        for (website_id, granularity, bucket, page_id, activity_type), delta in deltas.items()
+    }
+
+
+def merge(deltas):
+    """Add ``chunk_deltas`` output to the rollup rows, creating missing ones."""
+    if not deltas:
+        return
+    existing = {
+        (row.website_id, row.granularity, row.bucket, row.page_url, row.activity_type): row
+        for row in ActivityRollup.objects.filter(
+            website_id__in={key[0] for key in deltas}, bucket__in={key[2] for key in deltas},
+        )
+    }
+    changed = []
+    created = []
+    for key, (events, unique_visitors) in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            website_id, granularity, bucket, page_url, activity_type = key
+            created.append(ActivityRollup(
+                website_id=website_id, granularity=granularity, bucket=bucket, page_url=page_url,
+                activity_type=activity_type, events=events, unique_visitors=unique_visitors,
+            ))
+        else:
+            row.events += events
+            row.unique_visitors += unique_visitors
+            changed.append(row)
+    ActivityRollup.objects.bulk_update(changed, ['events', 'unique_visitors'])
+    ActivityRollup.objects.bulk_create(created)
+
+
+def rebuild_bucket(website_id, granularity, bucket, up_to_id):
+    """Replace the rollup rows of one bucket with a fresh aggregate of ids up to ``up_to_id``."""
+    trunc, width = GRANULARITIES[granularity]
+    activities = Activity.objects.filter(
+        website_id=website_id, occured_at__gte=bucket, occured_at__lt=bucket + width, id__lte=up_to_id,
+    ).order_by()
+    per_page = (
+        activities
+        .annotate(page_url=Coalesce('page__url', models.Value(''), output_field=models.TextField()))
+        .values_list('page_url', 'activity_type')
+        .annotate(events=models.Count('id'), unique_visitors=models.Count('people', distinct=True))
+    )
+    rows = [
+        ActivityRollup(
+            website_id=website_id, granularity=granularity, bucket=bucket,
+            page_url=page_url, activity_type=activity_type,
+            events=events, unique_visitors=unique_visitors,
+        )
+        for page_url, activity_type, events, unique_visitors in per_page
+    ]
+    totals = activities.aggregate(events=models.Count('id'), unique_visitors=models.Count('people', distinct=True))
+    if totals['events']:
+        rows.append(ActivityRollup(
+            website_id=website_id, granularity=granularity, bucket=bucket,
+            page_url=ActivityRollup.ALL, activity_type=ActivityRollup.ALL, **totals,
+        ))
+    ActivityRollup.objects.filter(website_id=website_id, granularity=granularity, bucket=bucket).delete()
+    ActivityRollup.objects.bulk_create(rows)
+
+
+def rebuild(grace=timedelta(seconds=60), now=None):
+    """Recompute the rollups from the raw rows, in one transaction.
+
+    Buckets already rolled up that start before their website's retention
+    cutoff are kept as they are: ``archive_activity`` may have removed some
+    of their rows.  Returns ``(up_to_id, buckets rebuilt)``.
+    """
+    with transaction.atomic():
+        watermark, created = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+        upper = upper_bound(0, grace) or 0
+        older = models.Q()
+        for website_id, cutoff in retention_cutoffs(now).items():
+            older |= models.Q(website_id=website_id, bucket__lt=cutoff)
+        kept = set()
+        if older:
+            kept = set(ActivityRollup.objects.filter(older).values_list('website_id', 'granularity', 'bucket'))
+            ActivityRollup.objects.exclude(older).delete()
+        else:
+            ActivityRollup.objects.all().delete()
+        buckets = affected_buckets(0, upper) - kept
+        for website_id, granularity, bucket in sorted(buckets):
+            rebuild_bucket(website_id, granularity, bucket, upper)
+        watermark.last_activity_id = upper
+        watermark.save(update_fields=['last_activity_id', 'updated_at'])
+    return upper, len(buckets)
+
+
+def roll_up(chunk_size=10000, grace=timedelta(seconds=60)):
+    """Fold activities added since the watermark into the rollups.
+
+    Each chunk's counts are added to the existing rollup rows (see
+    ``chunk_deltas``), so a run costs the same however full the buckets
+    already are.  Rows stored less than ``grace`` ago wait for the next run
+    (see ``upper_bound``).  Yields ``(up_to_id, buckets)`` per committed
+    chunk.
+    """
+    watermark, created = RollupWatermark.objects.get_or_create(name=WATERMARK)
+    after_id = watermark.last_activity_id
+    upper = upper_bound(after_id, grace)
+    while upper is not None and after_id < upper:
+        up_to_id = min(after_id + chunk_size, upper)
+        with transaction.atomic():
+            # Locked so that two runs never add the same chunk twice.
+            locked = RollupWatermark.objects.select_for_update().get(pk=watermark.pk)
+            if locked.last_activity_id != after_id:
+                return
+            deltas = chunk_deltas(after_id, up_to_id)
+            merge(deltas)
+            locked.last_activity_id = up_to_id
+            locked.save(update_fields=['last_activity_id', 'updated_at'])
+        after_id = up_to_id
+        yield up_to_id, len({key[:3] for key in deltas})
+
+
+def website_stats(website_id, start, end, granularity='day', top_pages=10):
+    """Traffic for one website between ``start`` and ``end``, from rollups only.
+
+    ``start`` is rounded down to its bucket so the first partial bucket is
+    included.
+    """
+    start = timezone.localtime(start).replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        start = start.replace(hour=0)
+    rollups = ActivityRollup.objects.filter(
+        website_id=website_id, granularity=granularity, bucket__gte=start, bucket__lt=end
+    )
+    views = models.Sum('events', filter=models.Q(activity_type='Viewed Page'), default=0)
+    form_submissions = models.Sum('events', filter=models.Q(activity_type='Form Submission'), default=0)
+    whole_site = models.Q(activity_type=ActivityRollup.ALL)
+    series = [
+        {
+            'bucket': row['bucket'],
+            'events': row['bucket_events'],
+            'views': row['bucket_views'],
+            'form_submissions': row['bucket_form_submissions'],
+            'unique_visitors': row['bucket_unique_visitors'],
+        }
+        for row in (
+            rollups.values('bucket')
+            .annotate(
+                bucket_events=models.Sum('events', filter=whole_site, default=0),
+                bucket_views=views,
+                bucket_form_submissions=form_submissions,
+                bucket_unique_visitors=models.Sum('unique_visitors', filter=whole_site, default=0),
+            )
+            .order_by('bucket')
+        )
+    ]
+    pages = (
+        rollups.exclude(whole_site)
+        .values('page_url')
+        .annotate(views=views, form_submissions=form_submissions)
+        .order_by('-views', 'page_url')[:top_pages]
+    )
+    return {
+        'website': website_id,
+        'granularity': granularity,
+        'start': start,
+        'end': end,
+        'totals': {
+            'events': sum(row['events'] for row in series),
+            'views': sum(row['views'] for row in series),
+            'form_submissions': sum(row['form_submissions'] for row in series),
+        },
+        'series': series,
+        'top_pages': list(pages),
+    }
@@ -0,0 +1,6 @@
+from django.urls import path
+from .consumers import ActivityFeedConsumer
+
+websocket_urlpatterns = [
+    path('ws/websites/<int:website_id>/activity/', ActivityFeedConsumer.as_asgi()),
+]
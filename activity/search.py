@@ -0,0 +1,53 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+# People.search_text is indexed with pg_trgm on Postgres and mirrored into an
+# FTS5 trigram table on SQLite; both answer substring matches from an index.
+TRIGRAM_INDEX = 'activity_people_search_trgm'
+FTS_TABLE = 'activity_people_fts'
+# Trigram indexes cannot help with shorter terms.
+MIN_INDEXED_LENGTH = 3
+
+
+def normalize(value):
+    return value.strip().lower()
+
+
+def search_people(queryset, value):
+    """Filter People whose name, email or phone contains ``value``."""
+    term = normalize(value)
+    if not term:
+        return queryset
+    if connection.vendor == 'sqlite' and len(term) >= MIN_INDEXED_LENGTH:
+        phrase = '"%s"' % term.replace('"', '""')
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [phrase])
+        )
+    return queryset.filter(search_text__contains=term)
+
+
+def rebuild_index(using=connection):
+    """Repopulate the SQLite mirror, e.g. after bulk_create or update()."""
+    if using.vendor != 'sqlite':
+        return
+    with using.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'INSERT INTO {FTS_TABLE}(rowid, search_text) SELECT id, search_text FROM activity_people')
+
+
+def index_person(pk, using=connection):
+    if using.vendor != 'sqlite':
+        return
+    with using.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE}(rowid, search_text) SELECT id, search_text FROM activity_people WHERE id = %s',
+            [pk],
+        )
+
+
+def unindex_person(pk, using=connection):
+    if using.vendor != 'sqlite':
+        return
+    with using.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
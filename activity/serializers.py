@@ -1,49 +1,91 @@
 from rest_framework import serializers
-from .models import Website, Activity, People, Tag
+from datetime import timedelta
+from django.utils import timezone
+from .models import Website, Activity, ActivityRollup, People, Tag
+from .metrics import TimedSerializerMixin
+from .presence import get_presence
 
-class WebsiteSerializer(serializers.ModelSerializer):
+class WebsiteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Website
-        fields = ['id', 'name', 'site_id', 'tracking_code', 'domain', 'created_at']
+        fields = ['id', 'name', 'site_id', 'tracking_code', 'domain', 'retention_days', 'created_at']
         read_only_fields = ['site_id', 'tracking_code']
 
-class ActivitySmallSerializer(serializers.ModelSerializer):
+class ActivitySmallSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    page_title = serializers.CharField(source='page.title', read_only=True, allow_null=True)
+    page_url = serializers.CharField(source='page.url', read_only=True, allow_null=True)
+
     class Meta:
         model = Activity
         fields = ['id', 'activity_type', 'page_title', 'occured_at','page_url','form_data']
 
-class PeopleWithActivitiesSerializer(serializers.ModelSerializer):
+class OnlineMixin:
+    """Serve ``is_online`` from the presence tracker.
+
+    List views put the online ids for the whole page in the ``online_people``
+    context entry so each row is a set lookup.
+    """
+
+    def get_is_online(self, obj):
+        online = self.context.get('online_people')
+        if online is None:
+            return get_presence().is_online(obj.pk)
+        return obj.pk in online
+
+class PeopleWithActivitiesSerializer(TimedSerializerMixin, OnlineMixin, serializers.ModelSerializer):
     activities = serializers.SerializerMethodField()
+    is_online = serializers.SerializerMethodField()
     class Meta:
         model = People
         fields = [
             'id', 'name', 'email', 'phone', 'last_activity', 
             'stage', 'source', 'source_url', 'created_at',
-            'activities'
+            'activity_count', 'first_seen_at', 'last_activity_type',
+            'last_page_title', 'last_page_url',
+            'is_online', 'activities'
+        ]
+        read_only_fields = [
+            'activity_count', 'first_seen_at', 'last_activity_type',
+            'last_page_title', 'last_page_url',
         ]
     def get_activities(self, obj):
-        activities = Activity.objects.filter(people=obj).order_by('-occured_at')[:2]
+        # Views prefetch these for the whole page, see with_latest_activities().
+        activities = getattr(obj, 'latest_activities', None)
+        if activities is None:
+            activities = Activity.objects.filter(people=obj).select_related('page').order_by('-occured_at', '-id')[:2]
         return ActivitySmallSerializer(activities, many=True).data
 
-class PeopleSerializer(serializers.ModelSerializer):
-    is_online = serializers.BooleanField(read_only=True)
+class PeopleSerializer(TimedSerializerMixin, OnlineMixin, serializers.ModelSerializer):
+    is_online = serializers.SerializerMethodField()
     
     class Meta:
         model = People
         fields = [
             'id', 'name', 'email', 'phone', 'last_activity', 
             'stage', 'source', 'source_url', 'created_at',
+            'activity_count', 'first_seen_at', 'last_activity_type',
+            'last_page_title', 'last_page_url',
             'is_online'
         ]
+        read_only_fields = [
+            'activity_count', 'first_seen_at', 'last_activity_type',
+            'last_page_title', 'last_page_url',
+        ]
 
-class PeopleFromVisitorIdSerializer(serializers.ModelSerializer):
+class PeopleFromVisitorIdSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = People
         fields = ['id', 'name']
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     website = WebsiteSerializer()
     people = PeopleSerializer()
+    user_agent = serializers.StringRelatedField()
+    language = serializers.StringRelatedField()
+    screen_resolution = serializers.StringRelatedField()
+    referrer_host = serializers.StringRelatedField()
+    page_title = serializers.CharField(source='page.title', read_only=True, allow_null=True)
+    page_url = serializers.CharField(source='page.url', read_only=True, allow_null=True)
     
     class Meta:
         model = Activity
@@ -55,7 +97,7 @@ class ActivitySerializer(serializers.ModelSerializer):
             'message',
             'page_title',
             'page_url',
-            'page_referrer',
+            'referrer_host',
             'form_data',
             'metadata',
             'occured_at',
@@ -65,10 +107,19 @@ class ActivitySerializer(serializers.ModelSerializer):
             'screen_resolution',
         ]
 
+class FormDataSerializer(serializers.Serializer):
+    # The keys a Form Submission copies onto its person, sized to the People
+    # columns. Any other keys are kept as they are.
+    email = serializers.EmailField(required=False, allow_blank=True, max_length=100)
+    name = serializers.CharField(required=False, allow_blank=True, max_length=100, trim_whitespace=False)
+    phone = serializers.CharField(required=False, allow_blank=True, max_length=100, trim_whitespace=False)
+
 class TrackingEventSerializer(serializers.Serializer):
     site_id = serializers.CharField()
-    event_type = serializers.CharField()
-    visitor_id = serializers.CharField(required=False, allow_null=True)
+    # Lengths match the columns these end up in; longer values would fail
+    # the whole batch's insert.
+    event_type = serializers.CharField(max_length=50)
+    visitor_id = serializers.CharField(required=False, allow_null=True, max_length=255)
     visitor_email = serializers.EmailField(required=False, allow_null=True)
     page_url = serializers.CharField(required=False, allow_null=True)
     page_title = serializers.CharField(required=False, allow_null=True)
@@ -76,5 +127,43 @@ class TrackingEventSerializer(serializers.Serializer):
     form_data = serializers.JSONField(required=False, allow_null=True)
     metadata = serializers.JSONField(required=False, allow_null=True)
     user_agent = serializers.CharField(required=False, allow_null=True)
-    language = serializers.CharField(required=False, allow_null=True)
-    screen_resolution = serializers.CharField(required=False, allow_null=True)
+    language = serializers.CharField(required=False, allow_null=True, max_length=10)
+    screen_resolution = serializers.CharField(required=False, allow_null=True, max_length=50)
+    event_id = serializers.CharField(required=False, allow_null=True, max_length=64)
+
+    def validate_form_data(self, value):
+        if value is None:
+            return value
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected an object.")
+        form_data = FormDataSerializer(data=value)
+        if not form_data.is_valid():
+            raise serializers.ValidationError(form_data.errors)
+        return value
+
+class ImportEventSerializer(TrackingEventSerializer):
+    """A historical tracking payload, stamped with when it happened."""
+    occured_at = serializers.DateTimeField(required=False)
+
+class WebsiteStatsQuerySerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    granularity = serializers.ChoiceField(choices=ActivityRollup.GRANULARITY_CHOICES, default='day')
+
+    def validate(self, attrs):
+        attrs.setdefault('end', timezone.now())
+        attrs.setdefault('start', attrs['end'] - timedelta(days=30))
+        if attrs['start'] >= attrs['end']:
+            raise serializers.ValidationError("start must be before end")
+        return attrs
+
+class ExportQuerySerializer(serializers.Serializer):
+    website = serializers.PrimaryKeyRelatedField(queryset=Website.objects.none(), required=False)
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    activity_type = serializers.CharField(required=False)
+    output = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['website'].queryset = Website.objects.filter(user=self.context['request'].user)
@@ -0,0 +1,39 @@
+from django.db import connections, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import search
+from .cache import visitor_cache, website_cache
+from .models import Website, People
+
+
+@receiver(post_save, sender=Website)
+@receiver(post_delete, sender=Website)
+def invalidate_website_cache(sender, instance, **kwargs):
+    website_cache.invalidate(str(instance.site_id))
+
+
+@receiver(post_save, sender=People)
+def cache_visitor(sender, instance, **kwargs):
+    # Covers update_or_create on Form Submission. Deferred to commit so a
+    # rolled back insert never leaves a dangling person id in the cache.
+    visitor_id, person_id = instance.visitor_id, instance.pk
+    if visitor_id:
+        transaction.on_commit(lambda: visitor_cache.set(visitor_id, person_id))
+
+
+@receiver(post_delete, sender=People)
+def invalidate_visitor_cache(sender, instance, **kwargs):
+    if instance.visitor_id:
+        visitor_cache.invalidate(instance.visitor_id)
+
+
+@receiver(post_save, sender=People)
+def index_person(sender, instance, update_fields=None, using=None, **kwargs):
+    if update_fields is not None and not {'name', 'email', 'phone'} & set(update_fields):
+        return
+    search.index_person(instance.pk, connections[using])
+
+
+@receiver(post_delete, sender=People)
+def unindex_person(sender, instance, using=None, **kwargs):
+    search.unindex_person(instance.pk, connections[using])
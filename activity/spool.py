@@ -0,0 +1,137 @@
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from django.conf import settings
+from django.utils import timezone
+
+# Every record is a 4-byte big-endian payload length, a 4-byte CRC32 of the
+# payload and the payload itself (UTF-8 JSON).
+HEADER = struct.Struct('>II')
+SEGMENT_SUFFIX = '.seg'
+
+
+def encode_record(event):
+    payload = json.dumps(event, separators=(',', ':'), default=str).encode('utf-8')
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path, offset=0):
+    """Yield ``(event, end_offset)`` for each complete record after ``offset``.
+
+    Stops silently at the first truncated or corrupt record; callers compare
+    the last ``end_offset`` with the file size to tell the two apart from a
+    clean end of segment.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc = HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            offset += HEADER.size + length
+            yield json.loads(payload), offset
+
+
+def segment_number(path):
+    return int(path.name[:-len(SEGMENT_SUFFIX)])
+
+
+def list_segments(stream_dir):
+    return sorted(Path(stream_dir).glob(f'*{SEGMENT_SUFFIX}'), key=segment_number)
+
+
+def list_streams(directory):
+    directory = Path(directory)
+    if not directory.exists():
+        return []
+    return sorted(path for path in directory.iterdir() if path.is_dir())
+
+
+class SpoolWriter:
+    """Append-only, length-prefixed segment log for tracking events.
+
+    Each process writes to its own stream directory so appends never
+    interleave.  A writer always starts a fresh segment, which keeps a torn
+    record left behind by a crashed process at the very end of a sealed
+    segment.  ``fsync`` is ``'always'`` (after every record), ``'interval'``
+    (at most every ``fsync_interval`` seconds) or ``'never'``.
+    """
+
+    def __init__(self, directory, stream=None, segment_bytes=64 * 1024 * 1024,
+                 fsync='interval', fsync_interval=1.0):
+        if fsync not in ('always', 'interval', 'never'):
+            raise ValueError(f"fsync must be 'always', 'interval' or 'never', not {fsync!r}")
+        self.stream = stream or f'{socket.gethostname()}-{os.getpid()}'
+        self.directory = Path(directory) / self.stream
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._fd = None
+        self._size = 0
+        self._segment = 0
+        self._last_fsync = 0.0
+
+    def append(self, event):
+        """Append ``event``, stamped with when it was received."""
+        record = encode_record({'received_at': timezone.now(), **event})
+        with self._lock:
+            # st_nlink drops to 0 once drain_spool has removed an idle stream.
+            if self._fd is None or self._size >= self.segment_bytes or os.fstat(self._fd).st_nlink == 0:
+                self._rotate()
+            os.write(self._fd, record)
+            self._size += len(record)
+            now = time.monotonic()
+            if self.fsync == 'always' or (
+                self.fsync == 'interval' and now - self._last_fsync >= self.fsync_interval
+            ):
+                os.fsync(self._fd)
+                self._last_fsync = now
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._fd is not None:
+            if self.fsync != 'never':
+                os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def _rotate(self):
+        self._close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        existing = list_segments(self.directory)
+        self._segment = max(segment_number(existing[-1]), self._segment) + 1 if existing else self._segment + 1
+        path = self.directory / f'{self._segment:012d}{SEGMENT_SUFFIX}'
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = 0
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_spool():
+    """Return this process's writer configured by ``TRACKING_SPOOL``."""
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.stream != f'{socket.gethostname()}-{os.getpid()}':
+            options = getattr(settings, 'TRACKING_SPOOL', {})
+            _writer = SpoolWriter(
+                options.get('DIR', Path(settings.BASE_DIR, 'spool')),
+                segment_bytes=options.get('SEGMENT_BYTES', 64 * 1024 * 1024),
+                fsync=options.get('FSYNC', 'interval'),
+                fsync_interval=options.get('FSYNC_INTERVAL_MS', 1000) / 1000,
+            )
+        return _writer
@@ -0,0 +1,162 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryWriteBehind:
+    """Coalesces People summary updates in memory and writes them in bulk.
+
+    ``add`` folds committed activities into one pending entry per person
+    (counts add up, the earliest and latest activity win); a daemon thread
+    hands everything pending to ``flush`` (``ingest.apply_people_summary``)
+    at least every ``max_staleness`` seconds, sooner once ``max_pending``
+    people are waiting, in UPDATEs of at most ``batch_size`` people.  A busy
+    visitor thus costs one People write per interval instead of one per
+    event.  The updates only add and take maxima, so several processes can
+    write behind the same rows.  A failed flush is folded back in and
+    retried on the next round.
+    """
+
+    def __init__(self, flush, max_staleness=1.0, max_pending=10000, batch_size=500):
+        self.flush = flush
+        self.max_staleness = max_staleness
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._reset()
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.last_flush_seconds = 0.0
+
+    def _reset(self):
+        self.counts = Counter()
+        self.first = {}
+        self.latest = {}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='tracking-summary-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the worker after writing everything still pending."""
+        self._stopping.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        # Anything added while shutting down, e.g. by the ingest buffer's
+        # own final flush.
+        self._flush_pending()
+
+    def add(self, activities):
+        from .ingest import summarize
+
+        if not activities:
+            return
+        if self._stopping.is_set():
+            self.flush(*summarize(activities))
+            return
+        self.start()
+        with self._lock:
+            summarize(activities, self.counts, self.first, self.latest)
+            self.enqueued += len(activities)
+            if len(self.counts) >= self.max_pending:
+                self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending_people': len(self.counts),
+                'enqueued': self.enqueued,
+                'flushed': self.flushed,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'flush_seconds_total': self.flush_seconds_total,
+                'last_flush_seconds': self.last_flush_seconds,
+            }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.max_staleness)
+            self._wake.clear()
+            self._flush_pending()
+
+    def _flush_pending(self):
+        with self._lock:
+            counts, first, latest = self.counts, self.first, self.latest
+            self._reset()
+        if not counts:
+            return
+        started = time.monotonic()
+        pks = list(counts)
+        written = 0
+        try:
+            for start in range(0, len(pks), self.batch_size):
+                chunk = pks[start:start + self.batch_size]
+                self.flush(
+                    Counter({pk: counts[pk] for pk in chunk}),
+                    {pk: first[pk] for pk in chunk},
+                    {pk: latest[pk] for pk in chunk},
+                )
+                written += len(chunk)
+        except Exception:
+            logger.exception('Failed to write summaries for %d people', len(pks) - written)
+            self._restore(pks[written:], counts, first, latest)
+        finally:
+            close_old_connections()
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.flushed += written
+            self.failed += len(pks) - written
+            self.flushes += 1
+            self.flush_seconds_total += elapsed
+            self.last_flush_seconds = elapsed
+
+    def _restore(self, pks, counts, first, latest):
+        with self._lock:
+            for pk in pks:
+                self.counts[pk] += counts[pk]
+                if pk not in self.first or first[pk].occured_at < self.first[pk].occured_at:
+                    self.first[pk] = first[pk]
+                if pk not in self.latest or latest[pk].occured_at >= self.latest[pk].occured_at:
+                    self.latest[pk] = latest[pk]
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_summary_writer():
+    """The process-wide writer, or None unless ``TRACKING_SUMMARY['WRITE_BEHIND']`` is on."""
+    global _writer
+    options = getattr(settings, 'TRACKING_SUMMARY', {})
+    if not options.get('WRITE_BEHIND', False):
+        return None
+    with _writer_lock:
+        if _writer is None:
+            from .ingest import apply_people_summary
+
+            _writer = SummaryWriteBehind(
+                apply_people_summary,
+                max_staleness=options.get('MAX_STALENESS_MS', 1000) / 1000,
+                max_pending=options.get('MAX_PENDING', 10000),
+                batch_size=options.get('BATCH_SIZE', 500),
+            )
+            atexit.register(_writer.stop)
+        return _writer
@@ -0,0 +1,142 @@
+import io
+import itertools
+import random
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from . import search
+from .dimensions import dimension_ids, intern_events, page_interner
+from .models import Activity, People, Tag, Website
+
+FIRST_NAMES = ['james', 'mary', 'robert', 'patricia', 'john', 'jennifer', 'michael', 'linda', 'david', 'elizabeth',
+               'william', 'barbara', 'richard', 'susan', 'joseph', 'jessica', 'thomas', 'sarah', 'priya', 'wei']
+LAST_NAMES = ['smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis', 'rodriguez', 'martinez',
+              'hernandez', 'lopez', 'gonzalez', 'wilson', 'anderson', 'thomas', 'taylor', 'moore', 'patel', 'chen']
+DOMAINS = ['gmail.com', 'yahoo.com', 'outlook.com', 'hotmail.com', 'icloud.com', 'homebaba.ca']
+TAGS = ['buyer', 'seller', 'investor', 'first-time', 'pre-construction', 'condo', 'detached', 'rental',
+        'hot', 'cold', 'newsletter', 'referral']
+PAGE_KINDS = ['listing', 'project', 'blog', 'city', 'builder']
+# Share of each activity type among generated events.
+ACTIVITY_TYPES = [('Viewed Page', 0.85), ('Form Submission', 0.10), ('Inquiry', 0.05)]
+OWNER = 'synthetic'
+DEVICE = {'user_agent': 'Mozilla/5.0 (synthetic)', 'language': 'en-CA', 'screen_resolution': '1920x1080'}
+
+
+def fake_person(i, rng):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return People(
+        name=f'{first.title()} {last.title()}',
+        email=f'{first}.{last}{i}@{rng.choice(DOMAINS)}',
+        phone=f'{rng.randint(200, 999)}555{rng.randint(0, 9999):04d}',
+        visitor_id=f'visitor-{i}',
+        stage=rng.choice(People.STAGE_CHOICES)[0],
+    )
+
+
+def zipf_weights(count, skew):
+    """Cumulative weights where rank ``r`` is ``1 / r ** skew`` as likely as rank 1."""
+    return list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, count + 1)))
+
+
+class Generator:
+    """Grows the database to a target size with ``bulk_create``.
+
+    Every call tops the tables up to the requested counts, so a benchmark
+    can step through scales on one database.  Visitors are Zipf-skewed:
+    a handful of people carry most of the activity, like real traffic.
+    """
+
+    def __init__(self, seed=42, skew=1.1, days=365, batch_size=5000, log=None):
+        self.rng = random.Random(seed)
+        self.skew = skew
+        self.days = days
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+
+    def owner(self):
+        user, created = get_user_model().objects.get_or_create(
+            username=OWNER, defaults={'is_staff': True, 'is_superuser': True}
+        )
+        return user
+
+    def grow(self, websites, people, activities):
+        owner = self.owner()
+        self.grow_websites(owner, websites)
+        self.grow_tags()
+        self.grow_people(people)
+        added = self.grow_activities(activities)
+        if added:
+            self.log("Rebuilding people summaries")
+            call_command('rebuild_people_summary', chunk_size=self.batch_size, stdout=io.StringIO())
+        search.rebuild_index(connection)
+
+    def grow_websites(self, owner, total):
+        existing = Website.objects.filter(user=owner).count()
+        for i in range(existing, total):
+            Website.objects.create(user=owner, name=f'Synthetic {i}', domain=f'site{i}.example.com',
+                                   site_id=f'synthetic-{i}')
+
+    def grow_tags(self):
+        existing = set(Tag.objects.filter(name__in=TAGS).values_list('name', flat=True))
+        Tag.objects.bulk_create([Tag(name=name) for name in TAGS if name not in existing])
+
+    def grow_people(self, total):
+        existing = People.objects.count()
+        tag_ids = list(Tag.objects.filter(name__in=TAGS).values_list('id', flat=True))
+        through = People.tags.through
+        for start in range(existing, total, self.batch_size):
+            people = People.objects.bulk_create([
+                fake_person(i, self.rng) for i in range(start, min(start + self.batch_size, total))
+            ])
+            # About a third of people carry one or two tags.
+            through.objects.bulk_create([
+                through(people_id=person.pk, tag_id=tag_id)
+                for person in people if self.rng.random() < 0.33
+                for tag_id in self.rng.sample(tag_ids, self.rng.randint(1, 2))
+            ])
+            self.log(f"People: {min(start + self.batch_size, total)}/{total}")
+
+    def grow_activities(self, total):
+        existing = Activity.objects.count()
+        if existing >= total:
+            return 0
+        people = list(People.objects.order_by('pk').values_list('pk', 'visitor_id'))
+        websites = list(Website.objects.filter(user__username=OWNER).values_list('pk', 'domain'))
+        weights = zipf_weights(len(people), self.skew)
+        # Shuffle so the heaviest visitors are not simply the oldest rows.
+        people = self.rng.sample(people, len(people))
+        pages = zipf_weights(500, self.skew)
+        types, type_weights = zip(*ACTIVITY_TYPES)
+        now = timezone.now()
+        span = self.days * 86400
+        dimensions = dimension_ids(DEVICE, intern_events([DEVICE]))
+        paths = [f'{PAGE_KINDS[rank % len(PAGE_KINDS)]}/{rank}' for rank in range(500)]
+        site_pages = page_interner.pages(
+            (website_id, f'https://{domain}/{path}', path.replace('/', ' ').title())
+            for website_id, domain in websites for path in paths
+        )
+        for start in range(existing, total, self.batch_size):
+            count = min(self.batch_size, total - start)
+            visitors = self.rng.choices(people, cum_weights=weights, k=count)
+            page_ranks = self.rng.choices(range(500), cum_weights=pages, k=count)
+            kinds = self.rng.choices(types, weights=type_weights, k=count)
+            batch = []
+            for (person_id, visitor_id), page, kind in zip(visitors, page_ranks, kinds):
+                # Each visitor browses a single site.
+                website_id, domain = websites[person_id % len(websites)]
+                batch.append(Activity(
+                    website_id=website_id,
+                    people_id=person_id,
+                    visitor_id=visitor_id,
+                    activity_type=kind,
+                    page=site_pages[website_id, f'https://{domain}/{paths[page]}'],
+                    form_data={'email': f'{visitor_id}@example.com'} if kind != 'Viewed Page' else {},
+                    occured_at=now - timedelta(seconds=self.rng.randrange(span)),
+                    **dimensions,
+                ))
+            Activity.objects.bulk_create(batch)
+            self.log(f"Activities: {start + count}/{total}")
+        return total - existing
+
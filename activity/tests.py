@@ -1,3 +1,1408 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from . import buffer as buffer_module, ingest, live, presence, rollups, summary, tracker
+from .buffer import BufferFull, IngestBuffer, get_buffer
+from .cache import MISSING, recent_events, visitor_cache, website_cache
+from .dimensions import MAX_URL_LENGTH, VALUE_LOOKUPS, canonical_url, interners, page_interner
+from .export import ACTIVITY_EXPORT_FIELDS, PEOPLE_EXPORT_FIELDS
+from .models import (
+    Website, People, Activity, ActivityRollup, Language, Page, ReferrerHost, RollupWatermark, ScreenResolution,
+    SpoolCheckpoint, Tag, UserAgent,
+)
+from .pagination import PeopleKeysetPagination
+from .presence import get_presence
+from .routing import websocket_urlpatterns
+from .search import FTS_TABLE, TRIGRAM_INDEX, search_people
+from .spool import SpoolWriter, list_segments
+from .synthetic import Generator
+from .views import TRACK_BATCH_MAX_EVENTS
 
-# Create your tests here.
+
+def clear_caches():
+    """Empty the process-wide caches, which outlive a test's rollback."""
+    website_cache.clear()
+    visitor_cache.clear()
+    recent_events.clear()
+    page_interner.cache.clear()
+    for interner in interners.values():
+        interner.cache.clear()
+    presence._presence = None
+
+
+class TrackingTestCase(TestCase):
+    """An owner with one website and one known visitor, and empty caches around each test."""
+    site_id = 'test-site'
+    website_fields = {}
+    person_fields = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='secret')
+        cls.website = Website.objects.create(
+            user=cls.user, domain='example.com', site_id=cls.site_id, **cls.website_fields,
+        )
+        cls.person = People.objects.create(**{
+            'name': 'Person', 'email': 'person@example.com', 'phone': '1', 'visitor_id': 'visitor-1',
+            **cls.person_fields,
+        })
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+
+
+class PeopleListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='owner', password='secret')
+        website = Website.objects.create(user=user, domain='example.com')
+        pages = [Page.objects.create(website=website, url=f'https://example.com/{n}', title=f'Page {n}') for n in range(3)]
+        for i in range(40):
+            person = People.objects.create(
+                name=f'Person {i}', email=f'person{i}@example.com', phone=str(i), visitor_id=f'visitor-{i}'
+            )
+            Activity.objects.bulk_create([
+                Activity(
+                    website=website,
+                    people=person,
+                    visitor_id=person.visitor_id,
+                    activity_type='Viewed Page',
+                    page=page,
+                )
+                for page in pages
+            ])
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        url = reverse('people-list-create')
+        # COUNT(*), the page of people, one prefetch for all their activities
+        # and one presence lookup.
+        with self.assertNumQueries(4):
+            small = self.client.get(url, {'page_size': 5})
+        with self.assertNumQueries(4):
+            large = self.client.get(url, {'page_size': 40})
+        self.assertEqual(len(small.json()['results']), 5)
+        self.assertEqual(len(large.json()['results']), 40)
+
+    def test_returns_two_latest_activities_per_person(self):
+        response = self.client.get(reverse('people-list-create'), {'page_size': 40})
+        for person in response.json()['results']:
+            expected = list(
+                Activity.objects.filter(people_id=person['id']).order_by('-occured_at', '-id').values_list('id', flat=True)[:2]
+            )
+            self.assertEqual([activity['id'] for activity in person['activities']], expected)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        # Ties on last_activity, and people never seen, on both sides of the
+        # ids of the rest.
+        for n, last_activity in enumerate([now, None, now - timedelta(hours=1), now, None, now,
+                                           now - timedelta(hours=1), None, now + timedelta(hours=1)]):
+            People.objects.create(name=f'Person {n}', email=f'person{n}@example.com', phone=str(n),
+                                  last_activity=last_activity)
+
+    def walk(self, page_size):
+        ids = []
+        response = self.client.get(reverse('people-list-create'), {'cursor': '', 'page_size': page_size})
+        while True:
+            body = response.json()
+            self.assertLessEqual(len(body['results']), page_size)
+            ids.extend(person['id'] for person in body['results'])
+            if body['next'] is None:
+                return ids
+            response = self.client.get(body['next'])
+
+    def test_pages_cover_every_person_once(self):
+        expected = list(People.objects.order_by('-last_activity', '-id').values_list('id', flat=True))
+        for page_size in range(1, len(expected) + 2):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.walk(page_size), expected)
+
+    def test_cursor_conditions_for_either_null_placement(self):
+        people = list(People.objects.all())
+        paginator = PeopleKeysetPagination()
+        never = timezone.now()
+        for nulls_largest in [False, True]:
+            # A descending sort puts NULLs first where they order largest.
+            order = sorted(people, reverse=True, key=lambda person: (
+                (person.last_activity is not None) != nulls_largest, person.last_activity or never, person.pk,
+            ))
+            with self.subTest(nulls_largest=nulls_largest), \
+                    mock.patch.object(connection.features, 'nulls_order_largest', nulls_largest):
+                for index, person in enumerate(order):
+                    after = People.objects.filter(paginator.after(person.last_activity, person.pk))
+                    self.assertEqual(set(after.values_list('id', flat=True)), {p.pk for p in order[index + 1:]})
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    # Flushed by hand: the in-memory layer only wakes consumers when sent
+    # to from the test's own event loop.
+    TRACKING_LIVE={'COALESCE_MS': 60000, 'MAX_BATCH': 3},
+)
+class ActivityFeedTests(TrackingTestCase):
+    site_id = 'feed-site'
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, live, '_publisher', None)
+        live._publisher = None
+        self.addCleanup(lambda: live._publisher and live._publisher.stop())
+
+    def ingest(self, events):
+        # Published once the ingest commits.
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest.ingest_events(events)
+
+    async def connect(self, user):
+        # asgiref's communicator: channels.testing needs daphne.
+        path = f'/ws/websites/{self.website.pk}/activity/'
+        communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+            'type': 'websocket', 'path': path, 'query_string': b'', 'headers': [], 'subprotocols': [], 'user': user,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        response = await communicator.receive_output(timeout=1)
+        return communicator, response['type'] == 'websocket.accept'
+
+    async def receive_frame(self, communicator):
+        return json.loads((await communicator.receive_output(timeout=1))['text'])
+
+    def event(self, n):
+        return {
+            'site_id': 'feed-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-1',
+            'page_url': f'https://example.com/{n}', 'page_title': f'Page {n}',
+        }
+
+    async def test_rejects_users_who_do_not_own_the_website(self):
+        other = await User.objects.acreate(username='other')
+        for user in [AnonymousUser(), other]:
+            communicator, connected = await self.connect(user)
+            self.assertFalse(connected)
+
+    async def test_coalesces_a_burst_into_one_frame(self):
+        communicator, connected = await self.connect(self.user)
+        self.assertTrue(connected)
+        for n in range(5):
+            await sync_to_async(self.ingest)([self.event(n)])
+        await sync_to_async(live.get_publisher().flush)()
+        frame = await self.receive_frame(communicator)
+        self.assertEqual(frame['type'], 'activity')
+        self.assertEqual([a['page_title'] for a in frame['activities']], ['Page 2', 'Page 3', 'Page 4'])
+        self.assertEqual(frame['dropped'], 2)
+        self.assertEqual(frame['online'], [self.person.pk])
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=1)
+
+    async def test_rolled_back_events_are_not_published(self):
+        communicator, connected = await self.connect(self.user)
+
+        def ingest_then_fail():
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                ingest.ingest_events([self.event(0)])
+                transaction.set_rollback(True)
+
+        await sync_to_async(ingest_then_fail)()
+        await sync_to_async(live.get_publisher().flush)()
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=1)
+
+    def test_coalesces_per_website_before_sending(self):
+        sent = []
+        publisher = live.LivePublisher(lambda group, message: sent.append((group, message)), max_batch=3)
+        for n in range(4):
+            publisher.add({1: [{'id': n}], 2: [{'id': 10 + n}]}, {1: [7]})
+        publisher.flush()
+        self.assertEqual(sorted((group, [a['id'] for a in message['activities']], message['online'], message['dropped'])
+                                for group, message in sent), [
+            (live.group_name(1), [1, 2, 3], [7], 1),
+            (live.group_name(2), [11, 12, 13], [], 1),
+        ])
+
+    async def test_historical_events_are_not_published(self):
+        communicator, connected = await self.connect(self.user)
+        old = dict(self.event(0), occured_at=timezone.now() - timedelta(days=1))
+        await sync_to_async(self.ingest)([old])
+        await sync_to_async(live.get_publisher().flush)()
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=1)
+
+
+class PresenceTests(TrackingTestCase):
+    site_id = 'presence-site'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.people = [
+            People.objects.create(name=f'Person {n}', email=f'person{n}@example.com', phone=str(n)) for n in range(3)
+        ]
+
+    def test_online_from_stored_activity(self):
+        # Stored by some other process: nothing was marked seen here.
+        recent, earlier, stale = self.people
+        now = timezone.now()
+        for person, at in [(recent, now), (earlier, now - timedelta(minutes=1)), (stale, now - timedelta(hours=1))]:
+            Activity.objects.create(website=self.website, people=person, activity_type='Viewed Page', occured_at=at)
+        backend = get_presence()
+        self.assertIsInstance(backend, presence.DatabasePresence)
+        self.assertTrue(backend.is_online(recent.pk))
+        self.assertFalse(backend.is_online(stale.pk))
+        self.assertEqual(backend.online_among(person.pk for person in self.people), {recent.pk, earlier.pk})
+        self.assertEqual(backend.online_for_website(self.website.pk), [recent.pk, earlier.pk])
+
+    @override_settings(TRACKING_INGEST_MODE='spool',
+                       TRACKING_PRESENCE={'BACKEND': 'activity.presence.InProcessPresence'})
+    def test_in_process_presence_is_refused_in_spool_mode(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_presence()
+
+
+class DuplicateEventTests(TrackingTestCase):
+    site_id = 'dedupe-site'
+
+    def event(self, event_id):
+        return {'site_id': 'dedupe-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-1',
+                'page_url': 'https://example.com/', 'event_id': event_id}
+
+    def test_repeated_event_is_dropped_without_queries(self):
+        url = reverse('track-event')
+        self.assertEqual(self.client.post(url, self.event('a'), content_type='application/json').json()['status'],
+                         'success')
+        with self.assertNumQueries(0):
+            response = self.client.post(url, self.event('a'), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'duplicate')
+        self.assertEqual(Activity.objects.filter(event_id='a').count(), 1)
+
+    def test_unique_constraint_catches_repeats_the_filter_forgot(self):
+        ingest.ingest_events([self.event('a')])
+        recent_events.clear()
+        duplicates = recent_events.stats()['duplicates']
+        outcomes = ingest.ingest_events([self.event('a'), self.event('b'), self.event('b')])
+        self.assertEqual([status for status, activity in outcomes],
+                         [ingest.DUPLICATE, ingest.STORED, ingest.DUPLICATE])
+        # One caught by the constraint, one by the filter.
+        self.assertEqual(recent_events.stats()['duplicates'], duplicates + 2)
+        self.assertEqual(People.objects.get().activity_count, 2)
+
+
+class TrackBatchTests(TrackingTestCase):
+    site_id = 'batch-site'
+
+    def event(self, **extra):
+        return {'site_id': 'batch-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-1',
+                'page_url': 'https://example.com/', **extra}
+
+    def post(self, data):
+        return self.client.post(reverse('track-batch'), data, content_type='application/json')
+
+    def test_reports_each_event(self):
+        response = self.post({'events': [
+            self.event(event_id='a'),
+            self.event(visitor_id='stranger'),
+            self.event(site_id='no-such-site'),
+            self.event(event_type=None),
+            self.event(language='x' * 11),
+            self.event(screen_resolution='x' * 51),
+            self.event(event_id='a'),
+        ]})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['received'], body['stored']), (7, 1))
+        self.assertEqual([result['status'] for result in body['results']], [
+            'stored', 'anonymous', 'unknown_site', 'invalid', 'invalid', 'invalid', 'duplicate',
+        ])
+        self.assertEqual([result['index'] for result in body['results']], list(range(7)))
+        self.assertEqual(body['results'][0]['id'], Activity.objects.get().pk)
+        self.assertIn('event_type', body['results'][3]['errors'])
+        self.assertIn('language', body['results'][4]['errors'])
+        self.assertIn('screen_resolution', body['results'][5]['errors'])
+
+    def test_rejects_overlong_event_types_and_visitor_ids(self):
+        results = self.post([self.event(event_type='x' * 51), self.event(visitor_id='x' * 256)]).json()['results']
+        self.assertEqual([sorted(result['errors']) for result in results], [['event_type'], ['visitor_id']])
+        self.assertFalse(Activity.objects.exists())
+
+    def test_rejects_bad_form_data_without_failing_the_batch(self):
+        def submission(**form_data):
+            return self.event(event_type='Form Submission', form_data={'email': 'new@example.com', **form_data})
+
+        results = self.post([
+            submission(email='not-an-email'),
+            submission(name='x' * 101),
+            submission(phone=['1']),
+            self.event(event_type='Form Submission', form_data=['new@example.com']),
+            submission(name='New', message='kept'),
+        ]).json()['results']
+        self.assertEqual([result['status'] for result in results], ['invalid'] * 4 + ['stored'])
+        self.assertEqual([sorted(result['errors']['form_data']) for result in results[:3]],
+                         [['email'], ['name'], ['phone']])
+        self.assertEqual(People.objects.get(email='new@example.com').name, 'New')
+        self.assertEqual(Activity.objects.get().form_data['message'], 'kept')
+
+    def test_rejects_malformed_batches(self):
+        self.assertEqual(self.post({'event': self.event()}).status_code, 400)
+        self.assertEqual(self.post([self.event()] * (TRACK_BATCH_MAX_EVENTS + 1)).status_code, 400)
+        self.assertFalse(Activity.objects.exists())
+
+
+class IngestBufferTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def flush(self, batch):
+        self.entered.set()
+        self.release.wait(5)
+        self.batches.append([event['n'] for event in batch])
+
+    def buffer(self, **options):
+        buffer = IngestBuffer(flush=self.flush, **{'flush_interval': 60, **options})
+        self.addCleanup(buffer.stop)
+        return buffer
+
+    def hold_worker(self, buffer):
+        """Leave the worker stuck flushing event 0, with the queue empty."""
+        self.release.clear()
+        buffer.put({'n': 0})
+        self.assertTrue(self.entered.wait(5))
+
+    def test_reject_overflow(self):
+        buffer = self.buffer(max_size=1, batch_size=1)
+        self.hold_worker(buffer)
+        buffer.put({'n': 1})
+        with self.assertRaises(BufferFull):
+            buffer.put({'n': 2})
+        self.release.set()
+        buffer.stop()
+        self.assertEqual(self.batches, [[0], [1]])
+        self.assertEqual((buffer.stats()['rejected'], buffer.stats()['flushed']), (1, 2))
+
+    def test_block_overflow_waits_for_room(self):
+        buffer = self.buffer(max_size=1, batch_size=1, overflow='block', block_timeout=0.05)
+        self.hold_worker(buffer)
+        buffer.put({'n': 1})
+        started = time.monotonic()
+        with self.assertRaises(BufferFull):
+            buffer.put({'n': 2})
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        buffer.block_timeout = 5
+        threading.Timer(0.05, self.release.set).start()
+        buffer.put({'n': 3})
+        buffer.stop()
+        self.assertEqual(self.batches, [[0], [1], [3]])
+
+    def test_flushes_a_full_batch_without_waiting(self):
+        buffer = self.buffer(batch_size=3)
+        for n in range(3):
+            buffer.put({'n': n})
+        self.assertTrue(self.entered.wait(5))
+        buffer.stop()
+        self.assertEqual(self.batches, [[0, 1, 2]])
+
+    def test_flushes_a_partial_batch_after_the_interval(self):
+        buffer = self.buffer(batch_size=100, flush_interval=0.05)
+        buffer.put({'n': 0})
+        self.assertTrue(self.entered.wait(5))
+        buffer.stop()
+        self.assertEqual(self.batches, [[0]])
+
+    def test_stop_drains_the_queue(self):
+        buffer = self.buffer(batch_size=2)
+        for n in range(5):
+            buffer.put({'n': n})
+        buffer.stop()
+        self.assertEqual(self.batches, [[0, 1], [2, 3], [4]])
+
+    def test_stamps_events_when_received(self):
+        received = []
+        buffer = IngestBuffer(flush=received.extend, flush_interval=60)
+        before = timezone.now()
+        buffer.put({'n': 0})
+        buffer.stop()
+        self.assertTrue(before <= received[0]['received_at'] <= timezone.now())
+
+    @override_settings(TRACKING_BUFFER={'FLUSH_INTERVAL_MS': 60000})
+    def test_stopped_at_exit(self):
+        self.addCleanup(setattr, buffer_module, '_buffer', None)
+        buffer_module._buffer = None
+        with mock.patch('atexit.register') as register:
+            buffer = get_buffer()
+        register.assert_called_once_with(buffer.stop)
+
+
+class DrainSpoolTests(TrackingTestCase):
+    site_id = 'spool-site'
+
+    def setUp(self):
+        super().setUp()
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(TRACKING_SPOOL={'DIR': self.directory}))
+        self.writer = SpoolWriter(self.directory, stream='test', fsync='never')
+        self.addCleanup(self.writer.close)
+
+    def append(self, *event_ids, **extra):
+        for event_id in event_ids:
+            self.writer.append({'site_id': 'spool-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-1',
+                                'page_url': 'https://example.com/', 'event_id': event_id, **extra})
+
+    def drain(self):
+        stderr = io.StringIO()
+        call_command('drain_spool', '--once', '--batch-size', '4', stdout=io.StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def stored(self):
+        return sorted(Activity.objects.values_list('event_id', flat=True))
+
+    def test_replays_every_record(self):
+        self.append(*'abcdefghij')
+        self.drain()
+        self.assertEqual(self.stored(), list('abcdefghij'))
+        [segment] = list_segments(self.directory / 'test')
+        checkpoint = SpoolCheckpoint.objects.get(stream='test')
+        self.assertEqual(checkpoint.offset, segment.stat().st_size)
+
+    def test_keeps_the_time_events_were_received(self):
+        received = timezone.now() - timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', return_value=received):
+            self.append('a')
+            # Older than the person's last activity, yet not an import.
+            self.append('b', event_type='Form Submission',
+                        form_data={'email': 'person@example.com', 'name': 'Renamed'})
+        People.objects.filter(visitor_id='visitor-1').update(last_activity=timezone.now() - timedelta(hours=1))
+        self.drain()
+        self.assertEqual(set(Activity.objects.values_list('occured_at', flat=True)), {received})
+        self.assertEqual(People.objects.get(visitor_id='visitor-1').name, 'Renamed')
+
+    def test_resumes_from_the_checkpoint(self):
+        # Without event ids nothing would catch a second replay of a and b.
+        self.append('a', 'b', event_id=None)
+        self.drain()
+        self.append('c', event_id=None)
+        self.drain()
+        self.assertEqual(Activity.objects.count(), 3)
+
+    def test_skips_a_torn_record_at_the_end_of_a_sealed_segment(self):
+        self.append('a', 'b')
+        [segment] = list_segments(self.directory / 'test')
+        with open(segment, 'ab') as f:
+            f.write(b'\x00\x00\x01\x00torn')
+        self.writer.close()
+        self.append('c')
+        self.assertIn('8 corrupt bytes', self.drain())
+        self.assertEqual(self.stored(), ['a', 'b', 'c'])
+        self.assertFalse(segment.exists())
+
+    def test_sets_aside_records_that_cannot_be_ingested(self):
+        self.append('a', 'b')
+        self.append('c', occured_at='not a date')
+        self.append('d', 'e')
+        self.assertIn('dead-letter.jsonl', self.drain())
+        self.assertEqual(self.stored(), ['a', 'b', 'd', 'e'])
+        [line] = (self.directory / 'dead-letter.jsonl').read_text().splitlines()
+        self.assertEqual(json.loads(line)['event']['event_id'], 'c')
+        [segment] = list_segments(self.directory / 'test')
+        self.assertEqual(SpoolCheckpoint.objects.get(stream='test').offset, segment.stat().st_size)
+
+
+class WebsiteCacheTests(TrackingTestCase):
+    site_id = 'cached-site'
+
+    def test_known_site_ids_are_looked_up_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(ingest.resolve_websites(['cached-site']), {'cached-site': self.website.pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(ingest.resolve_websites(['cached-site']), {'cached-site': self.website.pk})
+
+    def test_unknown_site_ids_are_cached_as_missing(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(ingest.resolve_websites(['no-such-site', 'cached-site']), {'cached-site': self.website.pk})
+        self.assertIsNone(website_cache.get('no-such-site'))
+        with self.assertNumQueries(0):
+            self.assertEqual(ingest.resolve_websites(['no-such-site']), {})
+
+    def test_saving_a_website_invalidates_its_entry(self):
+        ingest.resolve_websites(['new-site'])
+        website = Website.objects.create(user=self.user, domain='new.example.com', site_id='new-site')
+        self.assertEqual(ingest.resolve_websites(['new-site']), {'new-site': website.pk})
+
+    def test_deleting_a_website_invalidates_its_entry(self):
+        ingest.resolve_websites(['cached-site'])
+        self.website.delete()
+        self.assertEqual(ingest.resolve_websites(['cached-site']), {})
+
+    def test_generated_site_ids_are_keyed_as_strings(self):
+        # The default site_id is a UUID object until the row is read back.
+        website = Website.objects.create(user=self.user, domain='generated.example.com')
+        site_id = str(website.site_id)
+        self.assertEqual(ingest.resolve_websites([site_id]), {site_id: website.pk})
+        website.delete()
+        self.assertIs(website_cache.get(site_id), MISSING)
+
+
+class StaleCacheTests(TransactionTestCase):
+    # Foreign keys are checked at commit, so this needs real transactions.
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+        user = User.objects.create_user(username='owner', password='secret')
+        Website.objects.create(user=user, domain='example.com', site_id='stale-site')
+        gone = People.objects.create(name='Gone', email='gone@example.com', phone='1', visitor_id='visitor-1').pk
+        People.objects.filter(pk=gone).delete()
+        self.person = People.objects.create(name='Person', email='person@example.com', phone='1',
+                                            visitor_id='visitor-1')
+        # What another process that never saw the delete still holds.
+        visitor_cache.set('visitor-1', gone)
+
+    def event(self, event_id):
+        return {'site_id': 'stale-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-1',
+                'page_url': 'https://example.com/', 'event_id': event_id}
+
+    def test_ingest_looks_up_a_stale_person_again(self):
+        [(status, activity)] = ingest.ingest_events([self.event('a')])
+        self.assertEqual(status, ingest.STORED)
+        self.assertEqual(Activity.objects.get().people_id, self.person.pk)
+        self.assertEqual(visitor_cache.get('visitor-1'), self.person.pk)
+
+    def test_ingest_looks_up_stale_pages_and_dimensions_again(self):
+        ingest.ingest_events([{**self.event('a'), 'language': 'en-US'}])
+        # Deleted by another process, so still cached here.
+        Activity.objects.all().delete()
+        Page.objects.all().delete()
+        Language.objects.all().delete()
+        [(status, activity)] = ingest.ingest_events([{**self.event('b'), 'language': 'en-US'}])
+        self.assertEqual(status, ingest.STORED)
+        stored = Activity.objects.get()
+        self.assertEqual((stored.page_id, stored.language_id), (Page.objects.get().pk, Language.objects.get().pk))
+
+    def test_drain_spool_looks_up_a_stale_person_again(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(TRACKING_SPOOL={'DIR': directory}):
+            writer = SpoolWriter(directory, stream='test', fsync='never')
+            writer.append(self.event('a'))
+            writer.close()
+            call_command('drain_spool', '--once', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Activity.objects.get().people_id, self.person.pk)
+        self.assertFalse(Path(directory, 'dead-letter.jsonl').exists())
+
+
+@override_settings(TRACKING_SUMMARY={'WRITE_BEHIND': True, 'MAX_STALENESS_MS': 60000})
+class SummaryWriteBehindTests(TrackingTestCase):
+    site_id = 'summary-site'
+
+    def setUp(self):
+        super().setUp()
+        summary._writer = None
+        self.writer = summary.get_summary_writer()
+        self.addCleanup(setattr, summary, '_writer', None)
+        self.addCleanup(self.writer.stop)
+
+    def test_coalesces_a_busy_visitor_into_one_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(3):
+                ingest.ingest_events([{
+                    'site_id': 'summary-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-1',
+                    'page_url': f'https://example.com/{n}',
+                }])
+        self.person.refresh_from_db()
+        self.assertEqual(self.person.activity_count, 0)
+        with self.assertNumQueries(1):
+            self.writer._flush_pending()
+        self.person.refresh_from_db()
+        self.assertEqual(self.person.activity_count, 3)
+        self.assertEqual(self.person.last_page_url, 'https://example.com/2')
+        self.assertEqual(self.person.last_activity, Activity.objects.latest('occured_at').occured_at)
+
+
+class BackdatedFormSubmissionTests(TrackingTestCase):
+    site_id = 'import-site'
+    person_fields = {'name': 'Current', 'phone': '2', 'visitor_id': 'visitor-new', 'stage': 'Customer'}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.person.last_activity = timezone.now()
+        cls.person.save(update_fields=['last_activity'])
+
+    def submission(self, email, days_ago):
+        return {'site_id': 'import-site', 'event_type': 'Form Submission', 'visitor_id': 'visitor-old',
+                'language': 'en-CA', 'occured_at': timezone.now() - timedelta(days=days_ago),
+                'form_data': {'email': email, 'name': 'Old', 'phone': '1'}}
+
+    def test_only_fills_blanks_on_existing_people(self):
+        last_activity = self.person.last_activity
+        [(status, activity)] = ingest.ingest_events([self.submission('person@example.com', 10)])
+        self.assertEqual(status, ingest.STORED)
+        self.assertEqual(activity.people_id, self.person.pk)
+        self.person.refresh_from_db()
+        self.assertEqual((self.person.name, self.person.phone, self.person.visitor_id, self.person.stage),
+                         ('Current', '2', 'visitor-new', 'Customer'))
+        self.assertEqual(self.person.language.value, 'en-CA')
+        self.assertEqual(self.person.last_activity, last_activity)
+
+    def test_creates_missing_people(self):
+        event = self.submission('new@example.com', 10)
+        ingest.ingest_events([event])
+        person = People.objects.get(email='new@example.com')
+        self.assertEqual((person.name, person.visitor_id, person.stage), ('Old', 'visitor-old', 'Contact'))
+        self.assertEqual(person.last_activity, event['occured_at'])
+
+
+class ImportEventsTests(TrackingTestCase):
+    site_id = 'import-events-site'
+
+    def test_reports_progress_through_the_command_output(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as f:
+            for n in range(2):
+                f.write(json.dumps({'site_id': 'import-events-site', 'event_type': 'Viewed Page',
+                                    'visitor_id': 'visitor-1', 'occured_at': f'2026-01-0{n + 1}T12:00:00Z'}) + '\n')
+            f.flush()
+            out = io.StringIO()
+            call_command('import_events', f.name, '--chunk-size', '1', verbosity=2, stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[:2], ['worker 0: 1 events', 'worker 0: 2 events'])
+        self.assertIn('Imported 2 of 2 events', out.getvalue())
+
+
+class DimensionTests(TrackingTestCase):
+    site_id = 'dimension-site'
+
+    def test_values_are_stored_once_and_read_back_as_strings(self):
+        events = [
+            {'site_id': 'dimension-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-1',
+             'user_agent': 'Mozilla/5.0 (test)', 'language': 'en-CA', 'screen_resolution': f'{width}x1080'}
+            for width in [1920, 1920, 1280]
+        ]
+        ingest.ingest_events(events)
+        self.assertEqual(UserAgent.objects.count(), 1)
+        self.assertEqual(ScreenResolution.objects.count(), 2)
+        response = self.client.get(
+            reverse('export-activities'), HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}'
+        )
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual({row['user_agent'] for row in rows}, {'Mozilla/5.0 (test)'})
+        self.assertEqual(sorted(row['screen_resolution'] for row in rows), ['1280x1080', '1920x1080', '1920x1080'])
+
+    def test_anonymous_events_add_no_values(self):
+        ingest.ingest_events([
+            {'site_id': site_id, 'event_type': 'Viewed Page', 'visitor_id': f'stranger-{n}',
+             'user_agent': f'Bot/{n}', 'language': 'xx', 'screen_resolution': '1x1',
+             'page_referrer': f'https://spam-{n}.example.org/'}
+            for n, site_id in enumerate(['dimension-site', 'dimension-site', 'no-such-site'])
+        ])
+        for model in [UserAgent, Language, ScreenResolution, ReferrerHost]:
+            self.assertFalse(model.objects.exists(), model.__name__)
+
+
+class PageDimensionTests(TrackingTestCase):
+    site_id = 'page-site'
+
+    def test_canonical_url(self):
+        self.assertEqual(
+            canonical_url('HTTPS://WWW.Example.com:443/listing?utm_source=x&b=2&a=1&gclid=y#reviews'),
+            'https://example.com/listing?a=1&b=2',
+        )
+        self.assertEqual(canonical_url('http://example.com:8000'), 'http://example.com:8000/')
+        self.assertEqual(canonical_url('about:blank'), 'about:blank')
+        self.assertIsNone(canonical_url(''))
+        # Capped to what People.last_page_url and ActivityRollup.page_url hold.
+        long_url = canonical_url('https://example.com/' + 'é' * 3000)
+        self.assertLessEqual(len(long_url.encode('utf-8')), MAX_URL_LENGTH)
+        self.assertLessEqual(len(long_url), People._meta.get_field('last_page_url').max_length)
+        self.assertLessEqual(len(long_url), ActivityRollup._meta.get_field('page_url').max_length)
+
+    def test_url_variants_share_a_page(self):
+        events = [
+            {'site_id': 'page-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-1',
+             'page_url': url, 'page_title': title, 'page_referrer': 'https://www.google.com/search?q=homes'}
+            for url, title in [
+                ('https://example.com/listing', 'Listing'),
+                ('https://www.example.com/listing?utm_campaign=spring#photos', 'Listing - updated'),
+                ('https://example.com/other', 'Other'),
+            ]
+        ]
+        ingest.ingest_events(events)
+        page = Page.objects.get(url='https://example.com/listing')
+        self.assertEqual(page.title, 'Listing - updated')
+        self.assertEqual(Page.objects.count(), 2)
+        self.assertEqual(
+            set(Activity.objects.values_list('referrer_host__value', flat=True)), {'google.com'}
+        )
+        response = self.client.get(
+            reverse('website-page-activity', args=[self.website.pk]),
+            {'url': 'https://www.example.com/listing#top'},
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}',
+        )
+        self.assertEqual(
+            [activity['page_url'] for activity in response.json()['results']], [page.url, page.url]
+        )
+
+    def test_anonymous_events_name_no_pages(self):
+        Page.objects.create(website=self.website, url='https://example.com/listing', title='Listing')
+        for path in ['listing', 'spam-1', 'spam-2']:
+            response = self.client.post(reverse('track-event'), {
+                'site_id': 'page-site', 'event_type': 'Viewed Page', 'visitor_id': 'stranger',
+                'page_url': f'https://example.com/{path}', 'page_title': 'Spam',
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Page.objects.values_list('url', 'title')), [('https://example.com/listing', 'Listing')])
+
+    def test_a_form_submission_identifies_the_rest_of_its_batch(self):
+        def event(path, **extra):
+            return {'site_id': 'page-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-2',
+                    'page_url': f'https://example.com/{path}', **extra}
+
+        outcomes = ingest.ingest_events([
+            event('before'),
+            event('form', event_type='Form Submission', form_data={'email': 'new@example.com'}),
+            event('after'),
+        ])
+        self.assertEqual([status for status, activity in outcomes], [ingest.ANONYMOUS, ingest.STORED, ingest.STORED])
+        self.assertEqual(sorted(Page.objects.values_list('url', flat=True)),
+                         ['https://example.com/after', 'https://example.com/form'])
+
+
+def explain(sql):
+    """The query plan of ``sql``, one line per plan node."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # The seeded tables are small enough that a sequential scan is
+            # always cheapest; disabled, one is left only where no index fits.
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                cursor.execute(f'EXPLAIN {sql}')
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            finally:
+                cursor.execute('RESET enable_seqscan')
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return '\n'.join(row[-1] for row in cursor.fetchall())
+
+
+def full_scans(sql, plan):
+    """Tables ``plan`` reads in full rather than through an index."""
+    if connection.vendor == 'postgresql':
+        return set(re.findall(r'Seq Scan on (\w+)', plan))
+    aliases = {alias: table for table, alias in re.findall(r'"(\w+)" ([UT]\d+)\b', sql)}
+    return {aliases.get(name, name) for name in re.findall(r'^SCAN (\w+)$', plan, re.MULTILINE)}
+
+
+def index_names(model, *fields):
+    """Names of the indexes on ``model`` whose leading columns are ``fields``."""
+    table = model._meta.db_table
+    columns = [model._meta.get_field(field).column for field in fields]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # Introspection does not name the indexes behind UNIQUE columns.
+            cursor.execute(f'PRAGMA index_list({table})')
+            indexes = {}
+            for name in [row[1] for row in cursor.fetchall()]:
+                cursor.execute(f'PRAGMA index_info({name})')
+                indexes[name] = [row[2] for row in cursor.fetchall()]
+            if columns == [model._meta.pk.column]:
+                indexes['INTEGER PRIMARY KEY'] = columns
+        else:
+            constraints = connection.introspection.get_constraints(cursor, table)
+            indexes = {
+                name: constraint['columns'] for name, constraint in constraints.items()
+                if constraint['index'] or constraint['unique'] or constraint['primary_key']
+            }
+    return {name for name, indexed in indexes.items() if indexed[:len(columns)] == columns}
+
+
+class ExportTests(TrackingTestCase):
+    site_id = 'export-site'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        other = User.objects.create_user(username='other', password='secret')
+        cls.second = Website.objects.create(user=cls.user, domain='example.org', site_id='export-site-2')
+        cls.foreign = Website.objects.create(user=other, domain='example.net', site_id='foreign-site')
+        cls.stranger = People.objects.create(name='Stranger', email='stranger@example.com', phone='2',
+                                             visitor_id='visitor-2')
+        cls.day = (timezone.now() - timedelta(days=1)).replace(microsecond=0)
+        page = Page.objects.create(website=cls.website, url='https://example.com/', title='Home')
+        language = Language.objects.create(value='en-CA')
+        cls.view = Activity.objects.create(
+            website=cls.website, people=cls.person, visitor_id='visitor-1', activity_type='Viewed Page',
+            page=page, language=language, occured_at=cls.day,
+        )
+        cls.submission = Activity.objects.create(
+            website=cls.second, people=cls.person, visitor_id='visitor-1', activity_type='Form Submission',
+            form_data={'email': 'person@example.com', 'message': 'Hi, "there"'}, occured_at=cls.day + timedelta(hours=1),
+        )
+        Activity.objects.create(website=cls.foreign, people=cls.stranger, activity_type='Viewed Page', occured_at=cls.day)
+
+    def export(self, kind, **params):
+        response = self.client.get(reverse(f'export-{kind}'), params,
+                                   HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def ndjson(self, kind, **params):
+        response, body = self.export(kind, **params)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_activities_as_ndjson(self):
+        response, body = self.export('activities')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="activities.ndjson"')
+        view, submission = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(list(view), ACTIVITY_EXPORT_FIELDS)
+        self.assertEqual(
+            (view['id'], view['page_url'], view['page_title'], view['language'], view['occured_at']),
+            (self.view.pk, 'https://example.com/', 'Home', 'en-CA', self.day.isoformat()),
+        )
+        self.assertEqual((submission['id'], submission['form_data']['message']), (self.submission.pk, 'Hi, "there"'))
+
+    def test_activities_as_csv(self):
+        response, body = self.export('activities', output='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="activities.csv"')
+        header, *rows = csv.reader(io.StringIO(body))
+        self.assertEqual(header, ACTIVITY_EXPORT_FIELDS)
+        view, submission = [dict(zip(header, row)) for row in rows]
+        self.assertEqual((view['id'], view['page_url'], view['language'], view['form_data']),
+                         (str(self.view.pk), 'https://example.com/', 'en-CA', ''))
+        self.assertEqual(json.loads(submission['form_data'])['message'], 'Hi, "there"')
+
+    def test_activities_are_filtered(self):
+        def ids(**params):
+            return [row['id'] for row in self.ndjson('activities', **params)]
+
+        self.assertEqual(ids(website=self.second.pk), [self.submission.pk])
+        self.assertEqual(ids(activity_type='Viewed Page'), [self.view.pk])
+        self.assertEqual(ids(start=(self.day + timedelta(minutes=30)).isoformat()), [self.submission.pk])
+        self.assertEqual(ids(end=(self.day + timedelta(hours=1)).isoformat()), [self.view.pk])
+
+    def test_people_with_matching_activity(self):
+        self.assertEqual([row['id'] for row in self.ndjson('people')], [self.person.pk])
+        self.assertEqual(self.ndjson('people', activity_type='Inquiry'), [])
+        response, body = self.export('people', output='csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="people.csv"')
+        header, *rows = csv.reader(io.StringIO(body))
+        self.assertEqual(header, PEOPLE_EXPORT_FIELDS)
+        self.assertEqual([(row[0], row[2]) for row in rows], [(str(self.person.pk), 'person@example.com')])
+
+    def test_only_the_requesters_websites(self):
+        auth = f'Bearer {AccessToken.for_user(self.user)}'
+        for kind in ['activities', 'people']:
+            with self.subTest(kind=kind):
+                response = self.client.get(reverse(f'export-{kind}'), {'website': self.foreign.pk},
+                                           HTTP_AUTHORIZATION=auth)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('website', response.json())
+                self.assertEqual(self.client.get(reverse(f'export-{kind}')).status_code, 401)
+                self.assertEqual(self.client.get(reverse(f'export-{kind}'), {'output': 'xml'},
+                                                 HTTP_AUTHORIZATION=auth).status_code, 400)
+
+
+class SearchPeopleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ada = People.objects.create(name='Ada Lovelace', email='ada@engine.example', phone='555 0101')
+        cls.grace = People.objects.create(name='Grace Hopper', email='grace@navy.example', phone='555 0202')
+        cls.joan = People.objects.create(name='Joan Clarke', email='joan@hut8.example', phone='555 0303')
+
+    def search(self, term):
+        with CaptureQueriesContext(connection) as captured:
+            found = set(search_people(People.objects.all(), term).values_list('pk', flat=True))
+        indexed = any(FTS_TABLE in query['sql'] for query in captured.captured_queries)
+        return found, indexed
+
+    def test_matches_substrings_of_any_field_from_the_index(self):
+        for term, expected in [('LOVE', {self.ada}), ('navy.ex', {self.grace}), ('0303', {self.joan}),
+                               ('555 0', {self.ada, self.grace, self.joan}), ('  hopper ', {self.grace}),
+                               ('"quoted"', set())]:
+            with self.subTest(term=term):
+                found, indexed = self.search(term)
+                self.assertEqual(found, {person.pk for person in expected})
+                self.assertEqual(indexed, connection.vendor == 'sqlite')
+
+    def test_short_terms_fall_back_to_a_scan(self):
+        found, indexed = self.search('JO')
+        self.assertEqual(found, {self.joan.pk})
+        self.assertFalse(indexed)
+        self.assertEqual(self.search('')[0], {self.ada.pk, self.grace.pk, self.joan.pk})
+
+    def test_index_follows_updates_and_deletes(self):
+        self.ada.name = 'Ada King'
+        self.ada.save()
+        self.assertEqual(self.search('lovelace')[0], set())
+        self.assertEqual(self.search('king')[0], {self.ada.pk})
+        # Fields other than name, email and phone leave the index alone.
+        self.grace.stage = 'Lead'
+        self.grace.save(update_fields=['stage'])
+        self.assertEqual(self.search('hopper')[0], {self.grace.pk})
+        self.joan.delete()
+        self.assertEqual(self.search('clarke')[0], set())
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT rowid FROM {FTS_TABLE}')
+                self.assertEqual({row[0] for row in cursor.fetchall()}, {self.ada.pk, self.grace.pk})
+
+
+class QueryPlanTests(TestCase):
+    """Query budgets and index use for every API route and admin changelist.
+
+    Each test requests a route against a seeded database, fails when it
+    runs more queries than its budget, then EXPLAINs every SELECT it ran
+    and fails when a plan reads People or Activity in full or no longer
+    uses the expected indexes.  Runs on SQLite; on Postgres the plans are
+    taken with sequential scans disabled.
+    """
+
+    # Tables too large to read in full outside of exports.
+    LARGE_TABLES = {'activity_activity', 'activity_people'}
+
+    @classmethod
+    def setUpTestData(cls):
+        Generator(seed=7, batch_size=1000).grow(websites=2, people=200, activities=2000)
+        cls.owner = Generator().owner()
+        cls.website = Website.objects.filter(user=cls.owner).order_by('pk').first()
+        cls.person = People.objects.filter(activity_count__gt=1).order_by('pk').first()
+        cls.page = Page.objects.filter(website=cls.website, activity__isnull=False).first()
+
+    def setUp(self):
+        clear_caches()
+        self.addCleanup(clear_caches)
+
+    def auth(self):
+        return {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.owner)}'}
+
+    def event(self, **extra):
+        return {
+            'site_id': self.website.site_id, 'event_type': 'Viewed Page', 'visitor_id': self.person.visitor_id,
+            'page_url': 'https://example.com/listing/1', 'page_title': 'Listing', 'user_agent': 'Mozilla/5.0 (plan)',
+            **extra,
+        }
+
+    def check(self, request, max_queries, uses=(), scans=()):
+        """Run ``request`` and check its queries; returns the response.
+
+        ``uses`` lists ``(model, field, ...)`` indexes, or literal plan
+        text, that some query must use; ``scans`` the large tables it may
+        read in full.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, response.content if not response.streaming else '')
+        executed = [query['sql'] for query in queries.captured_queries]
+        self.assertLessEqual(len(executed), max_queries, '\n'.join(executed))
+        plans = [(sql, explain(sql)) for sql in executed if sql.lstrip().upper().startswith('SELECT')]
+        for sql, plan in plans:
+            scanned = full_scans(sql, plan) & self.LARGE_TABLES - set(scans)
+            self.assertFalse(scanned, f'Full scan of {", ".join(sorted(scanned))}:\n{sql}\n{plan}')
+        for index in uses:
+            names = {index} if isinstance(index, str) else index_names(*index)
+            self.assertTrue(
+                any(name in plan for name in names for sql, plan in plans),
+                f'No plan uses {index}:\n' + '\n\n'.join(f'{sql}\n{plan}' for sql, plan in plans),
+            )
+        return response
+
+    def test_track(self):
+        self.check(
+            lambda: self.client.post(reverse('track-event'), self.event(), content_type='application/json'),
+            max_queries=12, uses=[(Website, 'site_id'), (People, 'visitor_id'), (Page, 'website', 'digest')],
+        )
+
+    def test_track_batch(self):
+        events = [self.event(page_url=f'https://example.com/listing/{n}') for n in range(5)]
+        self.check(
+            lambda: self.client.post(reverse('track-batch'), events, content_type='application/json'),
+            max_queries=12, uses=[(Website, 'site_id'), (People, 'visitor_id'), (Page, 'website', 'digest')],
+        )
+
+    @override_settings(TRACKING_ASYNC={'WRITE_THREADS': 0})
+    def test_track_async(self):
+        # Pool threads would run the queries on connections not captured here.
+        self.addCleanup(setattr, ingest, '_write_executor', ingest._write_executor)
+        ingest._write_executor = None
+        self.check(
+            lambda: self.client.post(reverse('track-event-async'), self.event(), content_type='application/json'),
+            max_queries=12, uses=[(Website, 'site_id'), (People, 'visitor_id')],
+        )
+
+    def test_people_list(self):
+        url = reverse('people-list-create')
+        self.check(lambda: self.client.get(url), max_queries=4,
+                   uses=[(People, 'last_activity'), (Activity, 'people', 'occured_at')])
+        self.check(lambda: self.client.get(url, {'cursor': ''}), max_queries=3,
+                   uses=[(People, 'last_activity'), (Activity, 'people', 'occured_at')])
+
+    def test_people_search(self):
+        index = FTS_TABLE if connection.vendor == 'sqlite' else TRIGRAM_INDEX
+        self.check(lambda: self.client.get(reverse('people-list-create'), {'search': 'smith'}),
+                   max_queries=4, uses=[index])
+
+    def test_person_detail(self):
+        self.check(lambda: self.client.get(reverse('people-detail', args=[self.person.pk])), max_queries=3,
+                   uses=[(People, 'id'), (Activity, 'people', 'occured_at')])
+
+    def test_person_activities(self):
+        self.check(lambda: self.client.get(reverse('person-activities', args=[self.person.pk])), max_queries=1,
+                   uses=[(Activity, 'people', 'occured_at', 'id')])
+
+    def test_people_from_visitor_id(self):
+        url = reverse('people-from-visitor-id', args=[self.person.visitor_id])
+        self.check(lambda: self.client.get(url), max_queries=2, uses=[(People, 'visitor_id')])
+
+    def test_export_activities(self):
+        self.check(
+            lambda: self.client.get(reverse('export-activities'), {'website': self.website.pk}, **self.auth()),
+            max_queries=3, uses=[(Activity, 'website', 'occured_at')],
+        )
+
+    def test_export_people(self):
+        self.check(
+            lambda: self.client.get(reverse('export-people'), {'website': self.website.pk}, **self.auth()),
+            max_queries=3, uses=[(Activity, 'website'), (People, 'id')],
+        )
+
+    def test_tracker_script(self):
+        self.check(lambda: self.client.get(reverse('tracker-script', args=[tracker.script().digest])), max_queries=0)
+
+    @override_settings(TRACKING_METRICS={'ENABLED': True, 'TOKEN': 'scrape'})
+    def test_metrics(self):
+        self.check(lambda: self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape'), max_queries=0)
+
+    def test_websites(self):
+        # Each authenticated request also loads its user.
+        self.check(lambda: self.client.get(reverse('website-list'), **self.auth()), max_queries=3,
+                   uses=[(Website, 'user')])
+        self.check(lambda: self.client.get(reverse('website-detail', args=[self.website.pk]), **self.auth()),
+                   max_queries=2, uses=[(Website, 'id')])
+
+    def test_website_online(self):
+        Activity.objects.create(website=self.website, people=self.person, activity_type='Viewed Page')
+        response = self.check(
+            lambda: self.client.get(reverse('website-online', args=[self.website.pk]), **self.auth()),
+            max_queries=4, uses=[(Activity, 'website', 'occured_at'), (People, 'id')],
+        )
+        self.assertTrue(response.json())
+
+    def test_website_stats(self):
+        self.check(lambda: self.client.get(reverse('website-stats', args=[self.website.pk]), **self.auth()),
+                   max_queries=4, uses=[(ActivityRollup, 'website', 'granularity', 'bucket')])
+
+    def test_website_page_activity(self):
+        url = reverse('website-page-activity', args=[self.website.pk])
+        response = self.check(lambda: self.client.get(url, {'url': self.page.url}, **self.auth()), max_queries=4,
+                              uses=[(Page, 'website', 'digest'), (Activity, 'website', 'page', 'occured_at')])
+        self.assertTrue(response.json()['results'])
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.owner)
+        # SQLite walks People's rowid for ORDER BY id, which reads as a scan.
+        cases = [
+            (Activity, 7, [(Activity, 'occured_at')], []),
+            (People, 4, [], ['activity_people']),
+            (Website, 6, [], []),
+            (Page, 6, [], []),
+            (Tag, 5, [], []),
+        ]
+        for model, max_queries, uses, scans in cases:
+            with self.subTest(model=model.__name__):
+                url = reverse(f'admin:activity_{model._meta.model_name}_changelist')
+                self.check(lambda: self.client.get(url), max_queries, uses, scans)
+
+
+@override_settings(TRACKING_METRICS={'ENABLED': True, 'TOKEN': 'scrape'})
+class MetricsEndpointTests(TestCase):
+    def get(self, **headers):
+        return self.client.get(reverse('metrics'), **headers).status_code
+
+    def test_requires_the_token_or_staff(self):
+        # The test client is 127.0.0.1, like every request behind a local proxy.
+        self.assertEqual(self.get(), 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer wrong'), 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer scrape'), 200)
+        self.client.force_login(User.objects.create_user(username='user', password='secret'))
+        self.assertEqual(self.get(), 403)
+        self.client.force_login(User.objects.create_user(username='staff', password='secret', is_staff=True))
+        self.assertEqual(self.get(), 200)
+
+    @override_settings(TRACKING_METRICS={'ENABLED': True, 'ALLOWED_IPS': ['127.0.0.1']})
+    def test_allowed_ips(self):
+        self.assertEqual(self.get(), 200)
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.1'), 403)
+
+
+class TrackerScriptTests(TestCase):
+    def test_snippet_loads_the_versioned_tracker(self):
+        user = User.objects.create_user(username='owner', password='secret')
+        website = Website.objects.create(user=user, domain='example.com', site_id='tracker-site')
+        url = reverse('tracker-script', args=[tracker.script().digest])
+        self.assertIn(f'{url}" data-site-id="tracker-site"', website.tracking_code)
+
+        response = self.client.get(url)
+        self.assertEqual(response.content, tracker.script().body)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertRedirects(self.client.get(reverse('tracker-script', args=['0' * 16])), url)
+
+    def test_regenerate_updates_stale_snippets(self):
+        user = User.objects.create_user(username='owner', password='secret')
+        website = Website.objects.create(user=user, domain='example.com', tracking_code='<script>old</script>')
+        call_command('regenerate_tracking_code', stdout=io.StringIO())
+        website.refresh_from_db()
+        self.assertEqual(website.tracking_code, website.generate_tracking_code())
+
+
+class RollupTests(TrackingTestCase):
+    site_id = 'rollup-site'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.people = [
+            People.objects.create(name=f'Person {n}', email=f'person{n}@example.com', phone=str(n)) for n in range(3)
+        ]
+        cls.home = Page.objects.create(website=cls.website, url='https://example.com/', title='Home')
+        cls.listing = Page.objects.create(website=cls.website, url='https://example.com/listing', title='Listing')
+        cls.day = (timezone.now() - timedelta(days=2)).replace(hour=12, minute=0, second=0, microsecond=0)
+
+    def add(self, person, page, activity_type='Viewed Page', at=None, inserted_at=None):
+        return Activity.objects.create(
+            website=self.website, people=person, page=page, activity_type=activity_type, occured_at=at or self.day,
+            inserted_at=inserted_at or at or self.day,
+        )
+
+    def stats(self, **params):
+        response = self.client.get(
+            reverse('website-stats', args=[self.website.pk]), params,
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_rollup_feeds_stats(self):
+        first, second, third = self.people
+        self.add(first, self.home)
+        self.add(first, self.listing)
+        self.add(second, self.listing)
+        self.add(third, self.listing, 'Form Submission')
+        self.add(second, None)
+        call_command('rollup_activity', stdout=io.StringIO())
+
+        stats = self.stats()
+        self.assertEqual(stats['totals'], {'events': 5, 'views': 4, 'form_submissions': 1})
+        [bucket] = stats['series']
+        self.assertEqual(bucket['unique_visitors'], 3)
+        self.assertEqual(
+            [(page['page_url'], page['views'], page['form_submissions']) for page in stats['top_pages']],
+            [('https://example.com/listing', 2, 1), ('', 1, 0), ('https://example.com/', 1, 0)],
+        )
+
+    def rollup(self, *args):
+        out = io.StringIO()
+        call_command('rollup_activity', *args, stdout=out)
+        return out.getvalue()
+
+    def watermark(self):
+        return RollupWatermark.objects.get(name=rollups.WATERMARK).last_activity_id
+
+    def test_watermark_merges_only_buckets_with_new_rows(self):
+        first, second, third = self.people
+        earlier = self.day - timedelta(days=1)
+        self.add(first, self.home)
+        self.add(second, self.home)
+        self.add(second, self.home, at=self.day - timedelta(days=2))
+        self.rollup()
+        self.assertEqual(self.watermark(), Activity.objects.latest('id').pk)
+        untouched = set(ActivityRollup.objects.filter(bucket__lt=earlier.replace(hour=0)).values_list('pk', flat=True))
+        self.add(first, self.listing)
+        self.add(third, self.home, at=earlier)
+
+        output = self.rollup('--chunk-size', '1')
+        self.assertEqual(output.count('Rolled up activities'), 2)
+        self.assertEqual(self.watermark(), Activity.objects.latest('id').pk)
+        self.assertEqual(set(ActivityRollup.objects.filter(bucket__lt=earlier.replace(hour=0)).values_list('pk', flat=True)),
+                         untouched)
+        self.assertTrue(ActivityRollup.objects.filter(granularity='day', bucket=earlier.replace(hour=0)).exists())
+        # The returning visitor was seen in the bucket, so is not counted twice.
+        whole_day = ActivityRollup.objects.get(
+            granularity='day', bucket=self.day.replace(hour=0), activity_type=ActivityRollup.ALL,
+        )
+        self.assertEqual((whole_day.events, whole_day.unique_visitors), (3, 2))
+        self.assertEqual(self.rollup(), 'Rollups are up to date\n')
+
+    def test_grace_window_holds_back_recent_rows(self):
+        first, second, third = self.people
+        old = self.add(first, self.home)
+        self.add(second, self.home, at=timezone.now())
+        self.rollup()
+        self.assertEqual(self.watermark(), old.pk)
+        self.assertEqual(self.stats()['totals']['events'], 1)
+        self.rollup('--grace-seconds', '0')
+        self.assertEqual(self.watermark(), Activity.objects.latest('id').pk)
+        self.assertEqual(self.stats()['totals']['events'], 2)
+
+    def test_backdated_rows_wait_for_the_grace_window(self):
+        first, second, third = self.people
+        old = self.add(first, self.home)
+        self.add(second, self.home, inserted_at=timezone.now())
+        self.rollup()
+        self.assertEqual(self.watermark(), old.pk)
+        self.rollup('--grace-seconds', '0')
+        self.assertEqual(self.stats()['totals']['events'], 2)
+
+    def test_new_rows_are_added_to_existing_buckets(self):
+        first, second, third = self.people
+        self.add(first, self.home)
+        self.add(second, self.home)
+        self.rollup()
+        # Were the bucket re-aggregated from raw rows, only the new one would count.
+        Activity.objects.all().delete()
+        self.add(third, self.home)
+        self.rollup()
+        whole_day = ActivityRollup.objects.get(
+            granularity='day', bucket=self.day.replace(hour=0), activity_type=ActivityRollup.ALL,
+        )
+        self.assertEqual((whole_day.events, whole_day.unique_visitors), (3, 3))
+        self.assertEqual(self.stats()['totals']['events'], 3)
+
+    def test_rebuild_recomputes_from_raw_rows(self):
+        first, second, third = self.people
+        self.add(first, self.home)
+        self.rollup()
+        ActivityRollup.objects.update(events=10)
+        self.add(second, self.home)
+        self.assertIn('Rebuilt', self.rollup('--rebuild'))
+        self.assertEqual(self.stats()['totals']['events'], 2)
+        self.assertEqual(self.watermark(), Activity.objects.latest('id').pk)
+
+    def test_stats_sum_buckets_within_the_range(self):
+        first, second, third = self.people
+        earlier = self.day - timedelta(days=1)
+        self.add(first, self.home, at=earlier)
+        self.add(first, self.home)
+        self.add(second, self.home, at=self.day + timedelta(minutes=20))
+        self.add(first, self.listing, at=self.day + timedelta(minutes=90))
+        self.add(third, self.listing, 'Form Submission', at=self.day + timedelta(minutes=70))
+        self.rollup()
+
+        # start is rounded down to its bucket; end is exclusive.
+        daily = self.stats(start=(earlier + timedelta(hours=3)).isoformat(),
+                           end=(self.day + timedelta(days=1)).isoformat())
+        self.assertEqual(daily['totals'], {'events': 5, 'views': 4, 'form_submissions': 1})
+        self.assertEqual([(row['events'], row['unique_visitors']) for row in daily['series']], [(1, 1), (4, 3)])
+
+        hourly = self.stats(granularity='hour', start=(self.day + timedelta(minutes=30)).isoformat(),
+                            end=(self.day + timedelta(hours=2)).isoformat())
+        self.assertEqual(hourly['totals'], {'events': 4, 'views': 3, 'form_submissions': 1})
+        self.assertEqual(
+            [(row['events'], row['views'], row['form_submissions'], row['unique_visitors']) for row in hourly['series']],
+            [(2, 2, 0, 2), (2, 1, 1, 2)],
+        )
+        first_hour = self.stats(granularity='hour', start=self.day.isoformat(),
+                                end=(self.day + timedelta(hours=1)).isoformat())
+        self.assertEqual(first_hour['totals']['events'], 2)
+
+
+class ArchiveTests(TrackingTestCase):
+    site_id = 'archive-site'
+    website_fields = {'retention_days': 30}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.old = (timezone.now() - timedelta(days=60)).replace(hour=12, minute=0, second=0, microsecond=0)
+
+    def setUp(self):
+        super().setUp()
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+
+    def ingest(self, path, at, **extra):
+        ingest.ingest_events([{
+            'site_id': 'archive-site', 'event_type': 'Viewed Page', 'visitor_id': 'visitor-1',
+            'page_url': f'https://example.com/{path}', 'page_title': path.title(), 'occured_at': at, **extra,
+        }])
+
+    def rows(self):
+        return list(Activity.objects.order_by('id').values('id', 'people_id', 'occured_at', *VALUE_LOOKUPS.values()))
+
+    def old_views(self):
+        response = self.client.get(
+            reverse('website-stats', args=[self.website.pk]),
+            {'start': self.old.isoformat(), 'end': (self.old + timedelta(days=1)).isoformat()},
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}',
+        )
+        return response.json()['totals']['views']
+
+    def archive(self):
+        self.ingest('old', self.old, language='fr-CA', screen_resolution='800x600', user_agent='Old Browser',
+                    page_referrer='https://old.example.org/')
+        self.ingest('old', self.old + timedelta(minutes=5), language='fr-CA')
+        self.ingest('new', timezone.now() - timedelta(days=1))
+        call_command('rollup_activity', '--grace-seconds', '0', stdout=io.StringIO())
+        before = self.rows()
+        call_command('archive_activity', '--directory', str(self.directory), stdout=io.StringIO())
+        return before
+
+    def test_round_trip(self):
+        before = self.archive()
+        self.assertEqual(self.rows(), before[2:])
+        # Nothing references these any more; restoring must recreate them.
+        Page.objects.filter(url='https://example.com/old').delete()
+        Language.objects.filter(value='fr-CA').delete()
+        ReferrerHost.objects.all().delete()
+        clear_caches()
+
+        [path] = (self.directory / 'archive-site').glob('*.ndjson.gz')
+        call_command('restore_activity', str(path), stdout=io.StringIO())
+        self.assertEqual(self.rows(), before)
+        self.assertEqual(Page.objects.get(url='https://example.com/old').title, 'Old')
+
+    def test_people_summary_counts_archived_activity(self):
+        self.archive()
+        person = People.objects.get()
+        People.objects.update(activity_count=0, first_seen_at=None)
+
+        def rebuild():
+            call_command('rebuild_people_summary', '--archive-directory', str(self.directory), stdout=io.StringIO())
+            return People.objects.values_list('activity_count', 'first_seen_at', 'last_page_url').get()
+
+        self.assertEqual(rebuild(), (3, self.old, person.last_page_url))
+        # Restored rows are not counted twice.
+        [path] = (self.directory / 'archive-site').glob('*.ndjson.gz')
+        call_command('restore_activity', str(path), stdout=io.StringIO())
+        self.assertEqual(rebuild(), (3, self.old, person.last_page_url))
+
+    def test_rebuild_keeps_archived_buckets(self):
+        self.archive()
+        self.assertEqual(self.old_views(), 2)
+        call_command('rollup_activity', '--rebuild', '--grace-seconds', '0', stdout=io.StringIO())
+        self.assertEqual(self.old_views(), 2)
+        # A late import into an archived bucket is added to it.
+        self.ingest('late', self.old + timedelta(minutes=10))
+        call_command('rollup_activity', '--grace-seconds', '0', stdout=io.StringIO())
+        self.assertEqual(self.old_views(), 3)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from django.conf import settings
+from django.urls import reverse
+from django.utils.html import format_html
+
+# Browsers and CDNs may keep a versioned tracker this long; a new version
+# gets a new URL.
+MAX_AGE = 365 * 86400
+
+SOURCE = r"""
+(function() {
+    // The loader tag carries the site: <script src=".../tracker.<hash>.js" data-site-id="...">
+    const script = document.currentScript;
+    const SITE_ID = script && script.dataset.siteId;
+    if (!SITE_ID) return;
+    const TRACKING_URL = __TRACKING_URL__;
+    let visitorId = localStorage.getItem('visitorId');
+
+    // Only track if we have a visitor ID from a previous form submission
+    function shouldTrack() {
+        return !!localStorage.getItem('visitorId');
+    }
+
+    function newEventId() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+
+    // One id per navigation, so repeated page views of it are dropped server-side
+    let pageViewId = newEventId();
+
+    function track(eventType, data, eventId) {
+        if (!shouldTrack()) return;
+
+        const commonData = {
+            event_id: eventId || newEventId(),
+            visitor_id: visitorId,
+            user_agent: navigator.userAgent,
+            language: navigator.language,
+            screen_resolution: `${window.screen.width}x${window.screen.height}`,
+        };
+
+        fetch(TRACKING_URL, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                site_id: SITE_ID,
+                event_type: eventType,
+                ...commonData,
+                ...data
+            })
+        });
+    }
+
+    function trackPageView() {
+        if (shouldTrack()) {
+            track('Viewed Page', {
+                page_title: document.title,
+                page_url: window.location.href,
+                page_referrer: document.referrer || null
+            }, pageViewId);
+        }
+    }
+
+    trackPageView();
+
+    // Track page views on route changes (for SPAs)
+    let lastUrl = window.location.href;
+    const observer = new MutationObserver(function() {
+        if (window.location.href !== lastUrl) {
+            lastUrl = window.location.href;
+            pageViewId = newEventId();
+            // Wait for title to be updated
+            setTimeout(trackPageView, 100);
+        }
+    });
+    observer.observe(document, { subtree: true, childList: true });
+
+    // Track form submissions; one with an email identifies the visitor
+    document.addEventListener('submit', function(e) {
+        const form = e.target;
+        const formData = new FormData(form);
+        const data = {};
+        let hasEmail = false;
+
+        formData.forEach((value, key) => {
+            data[key] = value;
+            if (key === 'email') {
+                hasEmail = true;
+                localStorage.setItem('visitorId', btoa(value));
+                visitorId = btoa(value);
+            }
+        });
+
+        if (hasEmail) {
+            track('Form Submission', {
+                form_data: data,
+                form_id: form.id || 'unknown',
+                page_url: window.location.href,
+                page_referrer: document.referrer || null
+            });
+        }
+    });
+})();
+"""
+
+
+@dataclass(frozen=True)
+class Script:
+    body: bytes
+    digest: str
+
+
+def minify(source):
+    """Drop comment lines, indentation and blank lines.
+
+    Lines are kept apart, so statements never depend on semicolons; this
+    is most of what a full minifier saves once the file is gzipped.
+    """
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+@lru_cache(maxsize=None)
+def build(tracking_url):
+    body = minify(SOURCE.replace('__TRACKING_URL__', json.dumps(tracking_url))).encode('utf-8')
+    return Script(body=body, digest=hashlib.sha256(body).hexdigest()[:16])
+
+
+def script():
+    """The current tracker, built once per process."""
+    return build(f"{settings.SITE_URL}{reverse('track-event')}")
+
+
+def script_url():
+    return f"{settings.SITE_URL}{reverse('tracker-script', args=[script().digest])}"
+
+
+def loader(site_id):
+    """The snippet a website embeds: a tag loading the shared tracker for ``site_id``."""
+    return format_html('<script async src="{}" data-site-id="{}"></script>', script_url(), site_id)
@@ -3,10 +3,16 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     WebsiteViewSet, 
     track_event,
+    track_event_async,
+    track_batch,
     person_activities,
+    export_activities,
+    export_people,
     PeopleListCreateView,
     PeopleRetrieveUpdateDestroyView,
-    PeopleFromVisitorIdView
+    PeopleFromVisitorIdView,
+    metrics_endpoint,
+    tracker_script,
 )
 
 router = DefaultRouter()
@@ -14,10 +20,17 @@ router.register(r'websites', WebsiteViewSet, basename='website')
 
 urlpatterns = [
     path('track/', track_event, name='track-event'),
+    path('track/batch/', track_batch, name='track-batch'),
+    path('track/async/', track_event_async, name='track-event-async'),
     path('people/list/', PeopleListCreateView.as_view(), name='people-list-create'),
     path('people/<int:pk>/', PeopleRetrieveUpdateDestroyView.as_view(), name='people-detail'),
     path('people/<int:pk>/activities/', person_activities, name='person-activities'),
     path('people/visitor_id/<str:visitor_id>/', PeopleFromVisitorIdView.as_view(), name='people-from-visitor-id'),
+    path('export/activities/', export_activities, name='export-activities'),
+    path('export/people/', export_people, name='export-people'),
+    path('_metrics', metrics_endpoint, name='metrics'),
+    path('tracker.js', tracker_script, name='tracker-script-latest'),
+    path('tracker.<str:digest>.js', tracker_script, name='tracker-script'),
 ]
 
 urlpatterns += router.urls
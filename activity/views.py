@@ -1,24 +1,56 @@
 from rest_framework import viewsets, generics
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
-from .models import Website, Activity, People
+from .models import Website, Activity, Page, People
 from .serializers import (
     WebsiteSerializer, 
-    ActivitySerializer, 
     TrackingEventSerializer,
     PeopleSerializer,
     ActivitySmallSerializer,
     PeopleWithActivitiesSerializer,
     PeopleFromVisitorIdSerializer,
+    WebsiteStatsQuerySerializer,
+    ExportQuerySerializer,
 )
 from .filters import PeopleFilter
-from django.shortcuts import get_object_or_404
-from django.utils import timezone
+from . import ingest
+from . import metrics, tracker
+from .buffer import get_buffer, BufferFull
+from .spool import get_spool
+from .presence import get_presence
+from .rollups import website_stats
+from .dimensions import canonical_url
+from .export import ACTIVITY_EXPORT_FIELDS, PEOPLE_EXPORT_FIELDS, activity_filter, streaming_export
+from django.conf import settings
+import hmac
+import json
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST, require_safe
+from django.utils.cache import patch_cache_control
+from django.shortcuts import get_object_or_404, redirect
 from django.db import models
-from rest_framework.pagination import PageNumberPagination
+from .pagination import ActivityKeysetPagination, PeopleListPagination
+
+TRACK_BATCH_MAX_EVENTS = 500
+
+def with_latest_activities(queryset):
+    """Prefetch each person's two latest activities in a single query."""
+    return queryset.prefetch_related(
+        models.Prefetch(
+            'activity_set',
+            queryset=Activity.objects.select_related('page').order_by('-occured_at', '-id')[:2],
+            to_attr='latest_activities',
+        )
+    )
+
+def online_people(people):
+    """Ids of the online people among ``people``, for the serializer context."""
+    return get_presence().online_among(person.pk for person in people)
 
 class WebsiteViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
@@ -27,6 +59,37 @@ class WebsiteViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Website.objects.filter(user=self.request.user)
 
+    @action(detail=True, methods=['get'])
+    def online(self, request, pk=None):
+        """People seen on this website within the presence window, latest first."""
+        website = self.get_object()
+        person_ids = get_presence().online_for_website(website.pk)
+        people = People.objects.in_bulk(person_ids)
+        people = [people[pk] for pk in person_ids if pk in people]
+        context = {**self.get_serializer_context(), 'online_people': set(person_ids)}
+        return Response(PeopleSerializer(people, many=True, context=context).data)
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Traffic for a date range, answered from the rollup tables."""
+        website = self.get_object()
+        query = WebsiteStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(website_stats(website.pk, **query.validated_data))
+
+    @action(detail=True, methods=['get'])
+    def page_activity(self, request, pk=None):
+        """Activity on the page at ``?url=``, latest first; any variant of its URL works."""
+        website = self.get_object()
+        url = canonical_url(request.query_params.get('url'))
+        if not url:
+            return Response({'url': ['This field is required.']}, status=400)
+        page = Page.objects.filter(website=website, digest=Page.digest_of(url)).first()
+        activities = Activity.objects.filter(website=website, page=page) if page else Activity.objects.none()
+        paginator = ActivityKeysetPagination()
+        activities = paginator.paginate_queryset(activities.select_related('page'), request)
+        return paginator.get_paginated_response(ActivitySmallSerializer(activities, many=True).data)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
@@ -35,72 +98,108 @@ class WebsiteViewSet(viewsets.ModelViewSet):
 def track_event(request):
     serializer = TrackingEventSerializer(data=request.data)
     if serializer.is_valid():
-        site_id = serializer.validated_data['site_id']
-        website = get_object_or_404(Website, site_id=site_id)
-        
-        visitor_id = serializer.validated_data.get('visitor_id')
-        form_data = serializer.validated_data.get('form_data', {})
-        
-        # Try to find existing person by visitor_id
-        person = People.objects.filter(visitor_id=visitor_id).first()
-        
-        # Handle form submission data
-        if serializer.validated_data.get('event_type') == 'Form Submission' and form_data:
-            email = form_data.get('email')
-            if email:
-                # Update or create person with all form data
-                person, created = People.objects.update_or_create(
-                    email=email,
-                    defaults={
-                        'name': form_data.get('name', ''),
-                        'phone': form_data.get('phone', ''),
-                        'visitor_id': visitor_id,
-                        'user_agent': serializer.validated_data.get('user_agent'),
-                        'language': serializer.validated_data.get('language'),
-                        'screen_resolution': serializer.validated_data.get('screen_resolution'),
-                        'last_activity': timezone.now(),
-                        'stage': 'Contact',
-                    }
-                )
-        
-        # Only create activity record if we have an identified person
-        if person:
-            activity = Activity.objects.create(
-                website=website,
-                visitor_id=visitor_id,
-                people=person,
-                activity_type=serializer.validated_data.get('event_type'),
-                page_url=serializer.validated_data.get('page_url'),
-                page_title=serializer.validated_data.get('page_title'),
-                page_referrer=serializer.validated_data.get('page_referrer'),
-                form_data=form_data,
-                metadata=serializer.validated_data.get('metadata'),
-                user_agent=serializer.validated_data.get('user_agent'),
-                language=serializer.validated_data.get('language'),
-                screen_resolution=serializer.validated_data.get('screen_resolution'),
-            )
-            
-            # Update person's last activity
-            person.last_activity = timezone.now()
-            person.save(update_fields=['last_activity'])
-            
-            return Response(ActivitySerializer(activity).data)
-            
+        data = serializer.validated_data
+        if settings.TRACKING_INGEST_MODE == 'buffered':
+            try:
+                get_buffer().put(dict(data))
+            except BufferFull:
+                return Response({'status': 'rejected', 'message': 'Tracking buffer is full, retry later'}, status=503)
+            return Response({'status': 'accepted'}, status=202)
+        if settings.TRACKING_INGEST_MODE == 'spool':
+            get_spool().append(dict(data))
+            return Response({'status': 'accepted'}, status=202)
+
+        if data['site_id'] not in ingest.resolve_websites([data['site_id']]):
+            raise Http404('No Website matches the given query.')
+
+        outcome, activity = ingest.ingest_events([data])[0]
+        if activity is not None:
+            return Response({'status': 'success', 'id': activity.pk})
+        if outcome == ingest.DUPLICATE:
+            return Response({'status': 'duplicate', 'message': 'Event already received'})
+
         # If no person found, just return success without creating activity
         return Response({'status': 'success', 'message': 'Event received but not stored (anonymous user)'})
-    
+
     return Response(serializer.errors, status=400)
 
+@csrf_exempt
+@require_POST
+async def track_event_async(request):
+    """``track_event`` for ASGI deployments.
+
+    Validation runs on the event loop and the database write on the
+    ingest write pool, so a slow insert holds a pool thread rather than a
+    server worker.
+    """
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'detail': 'JSON parse error'}, status=400)
+    serializer = TrackingEventSerializer(data=payload)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    data = serializer.validated_data
+    if settings.TRACKING_INGEST_MODE == 'buffered':
+        try:
+            await sync_to_async(get_buffer().put, thread_sensitive=False)(dict(data))
+        except BufferFull:
+            return JsonResponse({'status': 'rejected', 'message': 'Tracking buffer is full, retry later'}, status=503)
+        return JsonResponse({'status': 'accepted'}, status=202)
+    if settings.TRACKING_INGEST_MODE == 'spool':
+        await sync_to_async(get_spool().append, thread_sensitive=False)(dict(data))
+        return JsonResponse({'status': 'accepted'}, status=202)
+
+    outcome, activity = (await ingest.aingest_events([data]))[0]
+    if outcome == ingest.UNKNOWN_SITE:
+        return JsonResponse({'detail': 'No Website matches the given query.'}, status=404)
+    if activity is not None:
+        return JsonResponse({'status': 'success', 'id': activity.pk})
+    if outcome == ingest.DUPLICATE:
+        return JsonResponse({'status': 'duplicate', 'message': 'Event already received'})
+    return JsonResponse({'status': 'success', 'message': 'Event received but not stored (anonymous user)'})
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def track_batch(request):
+    events = request.data
+    if isinstance(events, dict):
+        events = events.get('events')
+    if not isinstance(events, list):
+        return Response({'detail': 'Expected a list of events.'}, status=400)
+    if len(events) > TRACK_BATCH_MAX_EVENTS:
+        return Response(
+            {'detail': f'A batch may contain at most {TRACK_BATCH_MAX_EVENTS} events.'},
+            status=400,
+        )
+
+    results = [None] * len(events)
+    valid = []
+    for index, event in enumerate(events):
+        serializer = TrackingEventSerializer(data=event)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {'index': index, 'status': 'invalid', 'errors': serializer.errors}
+
+    outcomes = ingest.ingest_events([data for index, data in valid])
+    for (index, data), (status, activity) in zip(valid, outcomes):
+        result = {'index': index, 'status': status}
+        if activity is not None:
+            result['id'] = activity.pk
+        results[index] = result
+
+    return Response({
+        'received': len(events),
+        'stored': sum(1 for result in results if result['status'] == ingest.STORED),
+        'results': results,
+    })
+
 @api_view(['GET'])
 def people_list(request):
-    people = People.objects.annotate(
-        is_online=models.Exists(
-            Activity.objects.filter(
-                people=models.OuterRef('pk'),
-            )
-        )
-    ).order_by('-last_activity')[:10]
-    return Response(PeopleWithActivitiesSerializer(people, many=True).data)
+    people = list(with_latest_activities(People.objects.order_by('-last_activity')[:10]))
+    context = {'request': request, 'online_people': online_people(people)}
+    return Response(PeopleWithActivitiesSerializer(people, many=True, context=context).data)
 
 @api_view(['GET'])
 def person_detail(request, pk):
@@ -110,37 +209,52 @@ def person_detail(request, pk):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def person_activities(request, pk):
-    activities = Activity.objects.filter(people_id=pk).order_by('-occured_at')
-    return Response(ActivitySmallSerializer(activities, many=True).data)
+    paginator = ActivityKeysetPagination()
+    activities = paginator.paginate_queryset(Activity.objects.filter(people_id=pk).select_related('page'), request)
+    return paginator.get_paginated_response(ActivitySmallSerializer(activities, many=True).data)
 
-class CustomPagination(PageNumberPagination):
-    page_size = 30
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_activities(request):
+    query = ExportQuerySerializer(data=request.query_params, context={'request': request})
+    query.is_valid(raise_exception=True)
+    activities = Activity.objects.filter(activity_filter(request.user, **query.validated_data)).order_by('occured_at', 'id')
+    return streaming_export(activities, ACTIVITY_EXPORT_FIELDS, query.validated_data['output'], 'activities')
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_people(request):
+    """People with at least one activity matching the export query."""
+    query = ExportQuerySerializer(data=request.query_params, context={'request': request})
+    query.is_valid(raise_exception=True)
+    # IN rather than a correlated EXISTS: the matching activities are read
+    # once through the website index instead of once per person.
+    matching = Activity.objects.filter(activity_filter(request.user, **query.validated_data)).values('people_id')
+    people = People.objects.filter(pk__in=matching).order_by('id')
+    return streaming_export(people, PEOPLE_EXPORT_FIELDS, query.validated_data['output'], 'people')
 
 class PeopleListCreateView(generics.ListCreateAPIView):
     queryset = People.objects.all()
     serializer_class = PeopleWithActivitiesSerializer
     permission_classes = [AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_class = PeopleFilter
-    search_fields = ['name', 'email', 'phone']
     ordering_fields = ['name', 'created_at', 'last_activity']
     ordering = ['-last_activity']
-    pagination_class = CustomPagination
+    pagination_class = PeopleListPagination
     
     def get_queryset(self):
-        return People.objects.annotate(
-            is_online=models.Exists(
-                Activity.objects.filter(
-                    people=models.OuterRef('pk'),
-                    occured_at__gte=timezone.now() - timezone.timedelta(minutes=5)
-                )
-            )
-        )
+        return with_latest_activities(People.objects.all())
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many') and args:
+            people = list(args[0])
+            kwargs['context'] = {**self.get_serializer_context(), 'online_people': online_people(people)}
+            args = (people, *args[1:])
+        return super().get_serializer(*args, **kwargs)
 
 class PeopleRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = People.objects.all()
+    queryset = with_latest_activities(People.objects.all())
     serializer_class = PeopleWithActivitiesSerializer
     permission_classes = [AllowAny]
 
@@ -151,4 +265,44 @@ class PeopleFromVisitorIdView(generics.ListAPIView):
 
     def get_queryset(self):
         visitor_id = self.kwargs['visitor_id']
-        return People.objects.filter(visitor_id=visitor_id)
\ No newline at end of file
+        return People.objects.filter(visitor_id=visitor_id)
+
+
+def _tracker_etag(request, digest=None):
+    script = tracker.script()
+    return script.digest if digest == script.digest else None
+
+@require_safe
+@condition(etag_func=_tracker_etag)
+def tracker_script(request, digest=None):
+    """The tracker under its content hash, cacheable for good.
+
+    Any other name, e.g. a hash from before a deploy, redirects to the
+    current version for a short while.
+    """
+    script = tracker.script()
+    if digest != script.digest:
+        response = redirect('tracker-script', digest=script.digest)
+        patch_cache_control(response, public=True, max_age=300)
+        return response
+    response = HttpResponse(script.body, content_type='application/javascript; charset=utf-8')
+    patch_cache_control(response, public=True, max_age=tracker.MAX_AGE, immutable=True)
+    return response
+
+
+def metrics_endpoint(request):
+    """Prometheus scrape target for MetricsMiddleware and the ingest components.
+
+    Open to ``TRACKING_METRICS['TOKEN']`` as a bearer token, staff sessions
+    and ``ALLOWED_IPS``.
+    """
+    options = metrics.options()
+    if not options['ENABLED']:
+        raise Http404
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    token = options['TOKEN'] and authorization.startswith('Bearer ') and hmac.compare_digest(
+        authorization[len('Bearer '):].encode(), options['TOKEN'].encode()
+    )
+    if not (token or request.user.is_staff or request.META.get('REMOTE_ADDR') in options['ALLOWED_IPS']):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -45,6 +45,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'activity.middleware.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'tracking_be.urls'
@@ -66,6 +67,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'tracking_be.wsgi.application'
+ASGI_APPLICATION = 'tracking_be.asgi.application'
 
 
 # Database
@@ -190,3 +192,115 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 SITE_URL = 'https://analytics.homebaba.ca'
 WS_URL = 'ws://127.0.0.1:8000'
+
+# Tracking ingestion. 'sync' writes each event in the request; 'buffered'
+# queues validated events in memory and writes them in batches from a
+# background thread; 'spool' appends them to a local segment log replayed by
+# `manage.py drain_spool`. Both of the latter answer 202 straight away.
+TRACKING_INGEST_MODE = 'sync'
+TRACKING_BUFFER = {
+    'MAX_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL_MS': 250,
+    'OVERFLOW': 'reject',  # or 'block'
+    'BLOCK_TIMEOUT_MS': 1000,
+}
+TRACKING_SPOOL = {
+    'DIR': Path(BASE_DIR, 'spool'),
+    'SEGMENT_BYTES': 64 * 1024 * 1024,
+    'FSYNC': 'interval',  # 'always', 'interval' or 'never'
+    'FSYNC_INTERVAL_MS': 1000,
+    # Events drain_spool cannot ingest, one JSON object per line.
+    'DEAD_LETTER': Path(BASE_DIR, 'spool', 'dead-letter.jsonl'),
+}
+
+# Threads that run database writes for the async tracking view
+# (/api/track/async/ under ASGI). 0 uses Django's single sync thread.
+TRACKING_ASYNC = {
+    'WRITE_THREADS': 8,
+}
+
+# People summary columns (activity_count, last_activity, ...). With
+# WRITE_BEHIND they are coalesced per person in memory and written at least
+# every MAX_STALENESS_MS (sooner once MAX_PENDING people wait), in UPDATEs
+# of BATCH_SIZE people, instead of once per ingest batch.
+TRACKING_SUMMARY = {
+    'WRITE_BEHIND': False,
+    'MAX_STALENESS_MS': 1000,
+    'MAX_PENDING': 10000,
+    'BATCH_SIZE': 500,
+}
+
+# Per-process caches on the ingest path. Negative entries remember ids that
+# do not exist so junk traffic does not reach the database.
+TRACKING_SITE_CACHE = {
+    'MAX_SIZE': 1024,
+    'TTL': 300,
+    'NEGATIVE_TTL': 60,
+}
+TRACKING_VISITOR_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'NEGATIVE_TTL': 30,
+}
+
+# user_agent/language/screen_resolution string -> dimension row id. Ids
+# never change, so entries can live long.
+TRACKING_DIMENSION_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 3600,
+}
+
+# Events carrying an event_id already seen for the site within WINDOW_SECONDS
+# are dropped before touching the database; a unique constraint on
+# (website, event_id) catches the rest.
+TRACKING_DEDUPE = {
+    'WINDOW_SECONDS': 600,
+    'MAX_SIZE': 100000,
+}
+
+# Who counts as online: people with an event in the last WINDOW_SECONDS.
+# DatabasePresence queries the stored activities, so every worker agrees;
+# activity.presence.RedisPresence (OPTIONS: url, prefix) keeps the queries
+# off the database. InProcessPresence only sees its own worker's events and
+# suits a single worker in 'sync' or 'buffered' mode.
+TRACKING_PRESENCE = {
+    'BACKEND': 'activity.presence.DatabasePresence',
+    'WINDOW_SECONDS': 300,
+    'OPTIONS': {},
+}
+
+# Where `manage.py archive_activity` writes expired activity.
+TRACKING_ARCHIVE_DIR = Path(BASE_DIR, 'archive')
+
+# Per-route latency, SQL and serialization metrics served at /api/_metrics
+# in Prometheus format. Off unless ENABLED; every process keeps its own.
+# Scrapers send "Authorization: Bearer <TOKEN>"; staff sessions are let in
+# too. ALLOWED_IPS is matched against REMOTE_ADDR, which behind a reverse
+# proxy is the proxy's address, so only list addresses that reach Django
+# directly.
+TRACKING_METRICS = {
+    'ENABLED': False,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_REQUEST_TOP_QUERIES': 5,
+    'TOKEN': None,
+    'ALLOWED_IPS': [],
+}
+
+# Live activity feed at ws/websites/<id>/activity/ (served by the ASGI app).
+# InMemoryChannelLayer only reaches sockets in the process that stored the
+# event, so it suits tests and single-process development; with several
+# workers, or TRACKING_INGEST_MODE 'buffered' or 'spool', use
+# channels_redis.core.RedisChannelLayer.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+# Committed activities are coalesced per website for COALESCE_MS, then sent
+# to its group as one frame of at most MAX_BATCH activities.
+TRACKING_LIVE = {
+    'ENABLED': True,
+    'COALESCE_MS': 250,
+    'MAX_BATCH': 200,
+}